@@ -1,7 +1,8 @@
 import customtkinter as ctk
 import threading
+import queue # Begrenzte Warteschlangen zwischen den Stufen der Generierungs-Pipeline
 import io
-from PIL import Image, ImageTk # Benötigt Pillow: pip install Pillow
+from PIL import Image, ImageTk, ImageDraw, ImageFilter # Benötigt Pillow: pip install Pillow
 import os
 from datetime import datetime
 import torch
@@ -15,6 +16,7 @@ import safetensors.torch # Für das Auslesen von Safetensors-Metadaten
 from diffusers import (
     StableDiffusionPipeline,
     StableDiffusionXLPipeline,
+    StableDiffusionXLImg2ImgPipeline, # SDXL-Refiner (übernimmt die Latents des Basismodells)
     EulerDiscreteScheduler,
     DPMSolverMultistepScheduler,
     DDIMScheduler,
@@ -29,21 +31,49 @@ from diffusers import (
     DPMSolverSinglestepScheduler,
     UniPCMultistepScheduler,
     DPMSolverSDEScheduler,
+    LCMScheduler,
+    AutoPipelineForInpainting, # Inpainting mit den Komponenten der geladenen Pipeline
 )
+from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0, SlicedAttnProcessor # Attention-Varianten (Auto-Tuning, Backend-Auswahl)
+from diffusers.utils.torch_utils import randn_tensor # Gleiche Rauscherzeugung wie in den Pipelines
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
 from tkinter import filedialog, messagebox # Importiere filedialog und messagebox für Dateiauswahl und Bestätigungsdialoge
 import random # Für zufällige Seeds
 import json # Für das Speichern von Metadaten
 import traceback # Importiere traceback für detaillierte Fehlerausgaben
-from collections import deque # Für den Prompt-Verlauf
+from collections import deque, OrderedDict # Für den Prompt-Verlauf und LRU-Caches
 import sys # Neu: Für Kommandozeilenargumente
 import time # Neu: Für Zeitmessung
 import gc # Neu: Für Garbage Collection
+import hashlib # Für Modell-Hashes (Cache-Schlüssel)
+import shutil # Für das Löschen von Cache-Verzeichnissen
+import mmap # Für geteilte, speicherabgebildete Modellgewichte
+import struct # Zum Lesen des safetensors-Headers
+import warnings
+import contextlib
+import math
+import importlib.util # Auch zum Prüfen optionaler Pakete (xformers, Triton)
+import sqlite3 # Für das indizierte Bildarchiv
+import shlex # Zum Zerlegen von Suchanfragen mit Anführungszeichen
+import re # Zum Zerlegen von Modellnamen in Wörter
+import tarfile # Für die Ausgabe als Tar-Shards (WebDataset)
+from concurrent.futures import ThreadPoolExecutor # Kachel-Threads des Hochskalierers
 
 try:
     import pyperclip # Für Zwischenablage-Operationen
 except ImportError:
     pyperclip = None # Fallback, wenn pyperclip nicht installiert ist
 
+try:
+    import onnxruntime as ort # Optionales ONNX-Runtime-Backend für reine CPU-Rechner
+except ImportError:
+    ort = None
+
+try:
+    import psutil # Für die Anzeige des tatsächlich belegten Arbeitsspeichers
+except ImportError:
+    psutil = None # Fallback auf /proc (nur Linux), wenn psutil nicht installiert ist
+
 # Setzt das Erscheinungsbild (System, Light, Dark)
 ctk.set_appearance_mode("Dark")
 # Setzt das Standard-Farbschema (blue, dark-blue, green)
@@ -52,14 +82,2202 @@ ctk.set_default_color_theme("blue")
 # Verzeichnis für gespeicherte Bilder und Metadaten
 IMAGE_DIR = "output" # Geändert von "generated_images_local" zu "output"
 METADATA_FILE = os.path.join(IMAGE_DIR, "image_data_local.json")
-PROMPT_HISTORY_FILE = os.path.join(IMAGE_DIR, "prompt_history.json")
+PROMPT_HISTORY_FILE = os.path.join(IMAGE_DIR, "prompt_history.json") # Nur noch für die Übernahme alter Verläufe
+ARCHIVE_DB_FILE = os.path.join(IMAGE_DIR, "image_archive.sqlite") # Indiziertes Archiv aller Generierungen
+ARCHIVE_SEARCH_LIMIT = 200 # Maximale Anzahl Treffer in der Galerie
+THUMBNAIL_SIZE = 200 # Kantenlänge der Galerie-Vorschaubilder
+THUMBNAIL_CACHE_SIZE = ARCHIVE_SEARCH_LIMIT # So viele Vorschaubilder bleiben im Speicher (kein erneutes Dekodieren der PNGs)
+DEFAULT_DISPLAY_AREA = (700, 500) # Anzeigefläche, solange das Fenster seine Größe noch nicht kennt
+PROMPT_SEARCH_LIMIT = 20 # Maximale Anzahl Vorschläge in der Prompt-Suche
 MODELS_DIR = "models" # Neues Verzeichnis für Modelldateien
+CACHE_DIR = "cache" # Verzeichnis für konvertierte Modelle und andere Zwischenstände
+CONVERTED_MODELS_DIR = os.path.join(CACHE_DIR, "converted") # Pro Modell konvertiertes Diffusers-Layout
+MODEL_HASH_CACHE_FILE = os.path.join(CACHE_DIR, "model_hashes.json") # Merkt sich Hashes anhand von Größe und Änderungszeit
+CONVERTED_CACHE_MAX_GB = 40.0 # Älteste konvertierte Modelle werden oberhalb dieser Größe automatisch entfernt
+QUANTIZED_MODELS_DIR = os.path.join(CACHE_DIR, "quantized") # float32/int8-Vergleichsberichte der CPU-Quantisierung
+INT8_COMPONENTS = ("text_encoder", "text_encoder_2", "unet") # Komponenten, deren Linear-Schichten quantisiert werden
+INT8_BENCHMARK_SIZE = 512 # Bildgröße für den Geschwindigkeitsvergleich float32 vs. int8
+ONNX_MODELS_DIR = os.path.join(CACHE_DIR, "onnx") # Pro Modell exportierte ONNX-Graphen (CPU-Backend)
+ONNX_OPSET = 17
+TOME_DEFAULT_RATIO = 0.5 # Anteil der Tokens, die vor der Self-Attention zusammengeführt werden
+DEEP_CACHE_INTERVALS = ["2", "3", "4", "5"] # Auswahl: volle UNet-Berechnung alle N Aufrufe
+DEEP_CACHE_DEFAULT_INTERVAL = "3"
+CFG_TRUNCATION_PERCENTAGES = ["50", "60", "70", "80", "90"] # Auswahl: CFG nur in den ersten N % der Schritte
+CFG_TRUNCATION_DEFAULT = "80"
+BENCHMARK_DIR = os.path.join(IMAGE_DIR, "benchmarks") # Berichte der eingebauten Benchmarks (JSON)
+PROFILE_SKIP_STEPS = 1 # Profiling: so viele Entrauschungsschritte am Anfang nicht aufzeichnen (Aufwärmen, Text-Encoder)
+PROFILE_RECORD_STEPS = ["1", "3", "5", "10"] # Auswahl: so viele Schritte danach aufzeichnen
+PROFILE_RECORD_DEFAULT = "3"
+PROFILE_TABLE_ROWS = 40 # Zeilen der Operator-Tabelle
+SHARD_DIR = os.path.join(IMAGE_DIR, "shards") # Tar-Shards im WebDataset-Layout für große Datensätze
+SHARD_MAX_SAMPLES = 10000 # Ein Shard wird abgeschlossen, sobald er so viele Beispiele ...
+SHARD_MAX_BYTES = 1024**3 # ... oder so viele Bytes enthält
+LORA_DIR = "loras" # LoRA-Dateien (.safetensors), z.B. LCM-LoRAs für den Few-Step-Modus
+UPSCALER_DIR = "upscalers" # Optionale Super-Resolution-Modelle im ONNX-Format (z.B. Real-ESRGAN), laufen auf der CPU
+UPSCALE_FACTORS = ["2", "3", "4"] # Auswahl: Vergrößerungsfaktor nach der Generierung
+UPSCALE_DEFAULT_FACTOR = "2"
+UPSCALE_LANCZOS = "Lanczos"
+UPSCALE_TILE_SIZE = 256 # Kachelgröße im Eingangsbild (Pixel), begrenzt den Speicherbedarf pro Kachel
+UPSCALE_TILE_OVERLAP = 32 # Überlappung benachbarter Kacheln (Pixel) für nahtloses Überblenden
+UPSCALE_WORKERS = os.cpu_count() or 1 # Kacheln, die gleichzeitig vergrößert werden
+LORA_FUSED_CACHE_MAX_GB = 2.0 # Obergrenze für zwischengespeicherte fusionierte Gewichte (älteste Kombinationen fallen heraus)
+FEW_STEP_MAX_STEPS = 8 # Schrittbereich im Few-Step-Modus: 1 bis 8
+FEW_STEP_DEFAULT_STEPS = 4
+FEW_STEP_MAX_CFG = 2.0 # Destillierte Modelle vertragen kaum CFG, bei 1.0 entfällt der negative Durchlauf ganz
+FEW_STEP_SCHEDULERS = {"lcm": "LCM", "turbo": "Euler Ancestral Trailing", "lightning": "Euler Trailing"} # Passender Scheduler je Modellart
+TOME_MAX_RATIO = 0.75 # Mehr geht nicht: pro 2x2-Feld bleibt mindestens ein Ziel-Token übrig
+ATTENTION_BACKENDS = {"Auto": None, "SDPA": "sdpa", "xformers": "xformers", "In Scheiben": "sliced"} # Auswahl im UI -> Backend
+ATTENTION_DEFAULT_BACKEND = "Auto"
+ATTENTION_SLICE_SIZES = ["Auto", "1", "2", "4", "8", "16"] # Köpfe (mal Batch) pro Scheibe, Auto = passend zum freien Speicher
+ATTENTION_DEFAULT_SLICE_SIZE = 4 # Für "In Scheiben" aus älteren Tuning-Profilen
+ATTENTION_AUTO_MEMORY_FRACTION = 0.5 # Auto: Höchstens dieser Anteil des freien Speichers für die Attention-Matrizen
+LATENT_STRIDE = 8 # Bildgrößen müssen Vielfache des VAE-Skalierungsfaktors sein
+MIN_IMAGE_SIDE = 64 # Kleinste erlaubte Kantenlänge in Pixeln
+MAX_IMAGE_SIDE = 8192 # Größte erlaubte Kantenlänge in Pixeln (nur mit Kachelung sinnvoll)
+MAX_UNTILED_IMAGE_SIDE = 2048 # Größte Kantenlänge ohne Kachelung; darüber wächst die Self-Attention quadratisch über jeden Speicher
+INPAINT_PADDING = 32 # Inpainting: so viel Kontext (Pixel) um die Bounding-Box der Maske wird mit entrauscht
+INPAINT_FEATHER = 12 # Breite des weichen Übergangs (Pixel) beim Einsetzen des Ausschnitts
+INPAINT_MAX_ASPECT = 2.0 # Schmale Ausschnitte werden bis zu diesem Seitenverhältnis verbreitert (mehr Kontext)
+INPAINT_DEFAULT_STRENGTH = 0.75 # Anteil des Rauschens im maskierten Bereich (1.0 = komplett neu)
+INPAINT_EDITOR_SIZE = 640 # Maximale Kantenlänge des Bildes im Masken-Editor
+INPAINT_DEFAULT_BRUSH = 40 # Pinseldurchmesser im Masken-Editor (Bildpixel)
+REFINER_SWITCH_FRACTIONS = ["0.7", "0.75", "0.8", "0.85", "0.9"] # Auswahl: Anteil der Schritte im Basismodell, den Rest übernimmt der Refiner
+REFINER_DEFAULT_SWITCH = "0.8"
+REFINER_VRAM_HEADROOM = 1.5 # Passt das Refiner-UNet nicht mit diesem Puffer in den freien VRAM, laufen beide Pipelines mit Offloading
+DRAFT_COUNTS = ["4", "8", "12", "16", "24"] # Auswahl: so viele Seeds pro Entwurfsraster
+DRAFT_DEFAULT_COUNT = "8"
+DRAFT_STEPS = 8 # Entwürfe laufen mit höchstens so vielen Schritten
+DRAFT_DOWNSCALE = 2 # Entwürfe haben 1/DRAFT_DOWNSCALE der Kantenlänge des finalen Bildes
+DRAFT_BATCH_SIZE = 4 # Entwürfe pro UNet-Stapel
+DRAFT_GRID_COLUMNS = 4
+JOB_BATCH_SIZES = ["1", "2", "4", "8"] # Warteschlange: höchstens so viele kompatible Aufträge pro UNet-Stapel
+JOB_BATCH_DEFAULT_SIZE = "4"
+JOB_BATCH_WAIT_SECONDS = ["0", "0.5", "1", "2", "5"] # Warteschlange: so lange darf der älteste Auftrag auf weitere warten
+JOB_BATCH_DEFAULT_WAIT = "1"
+PIPELINE_QUEUE_SIZE = 2 # Maximal wartende Bilder zwischen Entrauschen, Dekodieren und Speichern (begrenzt den Speicherbedarf)
+CUDA_FLUSH_FREE_FRACTION = 0.1 # Allokator-Cache nur leeren, wenn weniger als dieser Anteil des VRAM frei ist
+TILE_BATCH_SIZE = 4 # Anzahl Latent-Kacheln, die pro UNet-Aufruf gemeinsam entrauscht werden
+RESULT_CACHE_FILE = os.path.join(CACHE_DIR, "result_cache.sqlite") # Zuordnung Generierungsspezifikation -> gespeichertes Bild
+RESULT_CACHE_MAX_ENTRIES = 2000 # Am längsten nicht genutzte Einträge werden oberhalb dieser Anzahl verworfen
+PRELOAD_MEMORY_FRACTION = 0.5 # Vollständiges Vorladen nur, wenn das Modell höchstens diesen Anteil des freien Arbeitsspeichers belegt
+PRELOAD_READ_CHUNK = 16 * 1024 * 1024 # Blockgröße beim Vorlesen in den Page-Cache (Abbruch ist zwischen Blöcken möglich)
+WARMUP_SIZE = 256 # Bildgröße des Aufwärmlaufs nach dem Laden
+WARMUP_STEPS = 2 # Schritte des Aufwärmlaufs
+AUTOTUNE_PROFILES_FILE = os.path.join(CACHE_DIR, "tuning_profiles.json") # Schnellste gemessene Einstellungen pro Modell, Rechner und Bildgröße
+AUTOTUNE_STEPS = 3 # Entrauschungsschritte pro Messlauf des Auto-Tunings
+AUTOTUNE_RUNS = 2 # Gemessene Läufe pro Kandidat nach einem Aufwärmlauf (der schnellste zählt)
+AUTOTUNE_MIN_GAIN = 0.02 # Ein Kandidat ersetzt den bisher besten nur, wenn er mindestens 2 % schneller ist (Messrauschen)
+AUTOTUNE_MEMORY_FRACTION = 0.9 # Ein Kandidat passt, wenn sein Spitzenverbrauch höchstens diesen Anteil des VRAM belegt
+AUTOTUNE_MIN_PSNR = 30.0 # Kandidaten, deren Testbild stärker vom Ausgangszustand abweicht (dB), werden verworfen
+AUTOTUNE_PROMPT = "a photo of a mountain lake at sunrise, detailed"
+RESULT_CACHE_VERSION = 1 # Erhöhen, wenn sich die Bedeutung der Spezifikation ändert (macht alte Einträge ungültig)
+
+_model_hash_lock = threading.Lock() # Schützt die Hash-Cache-Datei bei parallelen Ladevorgängen
+
+
+def _read_model_hash_cache():
+    """Liest den Hash-Cache (Aufrufer hält _model_hash_lock)."""
+    if not os.path.exists(MODEL_HASH_CACHE_FILE):
+        return {}
+    try:
+        with open(MODEL_HASH_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
+
+
+def compute_model_hash(model_path, cancel_event=None):
+    """
+    Berechnet den SHA-256-Hash einer Modelldatei.
+    Das Ergebnis wird anhand von Pfad, Größe und Änderungszeit zwischengespeichert,
+    damit große Dateien nur beim ersten Mal vollständig gelesen werden müssen.
+    Die Sperre gilt nur für die Cache-Datei: das Hashen eines Modells blockiert das Laden anderer nicht.
+    Wird cancel_event während des Lesens gesetzt, wird None zurückgegeben.
+    """
+    stat = os.stat(model_path)
+    cache_key = f"{os.path.abspath(model_path)}|{stat.st_size}|{int(stat.st_mtime)}"
+
+    with _model_hash_lock:
+        cached_hash = _read_model_hash_cache().get(cache_key)
+    if cached_hash:
+        return cached_hash
+
+    sha256 = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(16 * 1024 * 1024), b""): # In 16-MB-Blöcken lesen
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            sha256.update(chunk)
+    model_hash = sha256.hexdigest()
+
+    with _model_hash_lock:
+        hash_cache = _read_model_hash_cache() # Neu lesen: andere Threads können inzwischen geschrieben haben
+        # Veraltete Einträge für denselben Pfad entfernen
+        path_prefix = f"{os.path.abspath(model_path)}|"
+        hash_cache = {k: v for k, v in hash_cache.items() if not k.startswith(path_prefix)}
+        hash_cache[cache_key] = model_hash
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(MODEL_HASH_CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(hash_cache, f, indent=4)
+        return model_hash
+
+
+def converted_cache_path(model_hash, torch_dtype, is_sdxl):
+    """Gibt das Cache-Verzeichnis für ein konvertiertes Modell zurück (Hash, Datentyp, SDXL)."""
+    dtype_name = str(torch_dtype).replace("torch.", "")
+    model_type = "sdxl" if is_sdxl else "sd"
+    return os.path.join(CONVERTED_MODELS_DIR, f"{model_hash[:16]}_{dtype_name}_{model_type}")
+
+
+def get_directory_size(path):
+    """Summiert die Größe aller Dateien unterhalb eines Verzeichnisses (in Bytes)."""
+    total_size = 0
+    if not os.path.exists(path):
+        return 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total_size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass # Datei wurde zwischenzeitlich gelöscht
+    return total_size
+
+
+def list_files(path):
+    """Alle Dateien unterhalb eines Verzeichnisses (oder die Datei selbst)."""
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(root, filename) for root, _, files in os.walk(path) for filename in files]
+
+
+def preread_files(paths, cancel_event=None, chunk_size=PRELOAD_READ_CHUNK):
+    """
+    Liest Dateien einmal vollständig, damit sie im Page-Cache des Betriebssystems liegen
+    und das eigentliche Laden nicht mehr auf die Festplatte warten muss.
+    Gibt die gelesenen Bytes zurück oder None, wenn cancel_event gesetzt wurde.
+    """
+    total_read = 0
+    for path in paths:
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                total_read += len(chunk)
+    return total_read
+
+
+def get_available_memory():
+    """Freier (verfügbarer) Arbeitsspeicher des Systems in Bytes oder None, wenn unbekannt."""
+    if psutil is not None:
+        try:
+            return psutil.virtual_memory().available
+        except (psutil.Error, AttributeError):
+            pass
+    if os.path.exists("/proc/meminfo"):
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024 # Angabe in kB
+    return None
+
+
+def format_bytes(num_bytes):
+    """Formatiert eine Byte-Anzahl lesbar (MB/GB)."""
+    if num_bytes >= 1024**3:
+        return f"{num_bytes / (1024**3):.2f} GB"
+    return f"{num_bytes / (1024**2):.1f} MB"
+
+
+def prune_converted_cache(max_bytes=None, keep=()):
+    """
+    Entfernt konvertierte Modelle aus dem Cache, die am längsten nicht benutzt wurden.
+    Ohne max_bytes wird der komplette Cache geleert. Verzeichnisse in 'keep' bleiben erhalten.
+    Gibt die Anzahl der freigegebenen Bytes zurück.
+    """
+    if not os.path.exists(CONVERTED_MODELS_DIR):
+        return 0
+
+    keep = {os.path.abspath(path) for path in keep if path}
+    entries = []
+    for name in os.listdir(CONVERTED_MODELS_DIR):
+        entry_path = os.path.join(CONVERTED_MODELS_DIR, name)
+        if os.path.isdir(entry_path):
+            entries.append((os.path.getmtime(entry_path), entry_path, get_directory_size(entry_path)))
+    entries.sort() # Älteste (am längsten nicht benutzte) zuerst
+
+    total_size = sum(size for _, _, size in entries)
+    freed_bytes = 0
+    for _, entry_path, size in entries:
+        if max_bytes is not None and total_size <= max_bytes:
+            break
+        if os.path.abspath(entry_path) in keep:
+            continue
+        try:
+            shutil.rmtree(entry_path)
+            total_size -= size
+            freed_bytes += size
+            print(f"DEBUG: Konvertiertes Modell aus dem Cache entfernt: {entry_path}")
+        except OSError as e:
+            print(f"FEHLER: Konnte Cache-Verzeichnis nicht löschen {entry_path}: {e}")
+    return freed_bytes
+
+
+SAFETENSORS_DTYPES = { # Datentypen im safetensors-Header -> torch
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def mmap_safetensors(path):
+    """
+    Bildet eine safetensors-Datei in den Speicher ab und gibt Tensoren zurück, die direkt auf
+    diese Abbildung zeigen. Die Seiten liegen im Page-Cache des Betriebssystems und werden von
+    allen Prozessen geteilt, die dieselbe Datei abbilden. Die Abbildung ist copy-on-write:
+    Schreibzugriffe (z.B. beim Fusionieren von Gewichten) erzeugen private Kopien statt die Datei zu verändern.
+    """
+    with open(path, "rb") as f:
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length))
+        mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_offset = 8 + header_length
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        element_size = torch.tensor([], dtype=dtype).element_size()
+        count = (end - start) // element_size
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mapped_file, dtype=dtype, count=count, offset=data_offset + start).view(info["shape"])
+    return tensors
+
+
+def load_component_shared(component_dir, library_name, class_name):
+    """
+    Erstellt eine Modellkomponente (UNet, VAE, Text-Encoder) ohne eigene Gewichtsspeicher und
+    setzt ihre Parameter auf die speicherabgebildeten Tensoren aus dem konvertierten Cache.
+    """
+    component_class = getattr(importlib.import_module(library_name), class_name)
+    try:
+        from accelerate import init_empty_weights # Parameter zunächst nur auf dem "meta"-Gerät anlegen
+        empty_weights_context = init_empty_weights()
+    except ImportError:
+        empty_weights_context = contextlib.nullcontext() # Ohne accelerate kurzzeitig doppelter Speicherbedarf
+
+    with empty_weights_context:
+        if library_name == "diffusers":
+            model = component_class.from_config(component_class.load_config(component_dir))
+        else:
+            config = component_class.config_class.from_pretrained(component_dir)
+            model = component_class._from_config(config)
+
+    state_dict = {}
+    for filename in sorted(os.listdir(component_dir)):
+        if filename.endswith(".safetensors"):
+            state_dict.update(mmap_safetensors(os.path.join(component_dir, filename)))
+
+    model.load_state_dict(state_dict, strict=False, assign=True) # assign=True übernimmt die Tensoren ohne Kopie
+    missing = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+    if missing:
+        raise RuntimeError(f"Gewichte für {class_name} unvollständig im Cache, z.B. {missing[0]}")
+    model.eval()
+    return model
+
+
+def get_process_memory_info():
+    """
+    Liefert den belegten Arbeitsspeicher des aktuellen Prozesses in Bytes:
+    'rss' (gesamt resident), 'private' (nur von diesem Prozess belegt) und 'shared' (geteilt, z.B. Page-Cache).
+    """
+    if psutil is not None:
+        try:
+            info = psutil.Process().memory_full_info()
+            private = getattr(info, "uss", None)
+            shared = info.rss - private if private is not None else getattr(info, "shared", None)
+            return {"rss": info.rss, "private": private, "shared": shared}
+        except (psutil.Error, AttributeError):
+            pass
+    if os.path.exists("/proc/self/status"):
+        values = {}
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                    values[key] = int(value.split()[0]) * 1024 # Angaben in kB
+        if "VmRSS" in values:
+            return {
+                "rss": values["VmRSS"],
+                "private": values.get("RssAnon"),
+                "shared": values.get("RssFile", 0) + values.get("RssShmem", 0),
+            }
+    return None
+
+
+def module_size_bytes(module):
+    """Summiert die Größe aller Parameter und Buffer eines Moduls (in Bytes)."""
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def benchmark_unet(unet, height, width, runs=2, batch_size=2):
+    """
+    Misst die mittlere Dauer eines UNet-Aufrufs (in Sekunden) mit Zufallseingaben für die gegebene
+    Bildgröße. batch_size=2 entspricht einem Schritt mit Classifier-Free Guidance.
+    """
+    config = unet.config
+    dtype = getattr(unet, "dtype", torch.float32)
+    device = getattr(unet, "device", torch.device("cpu"))
+    sample = torch.randn(batch_size, config.in_channels, height // 8, width // 8, dtype=dtype, device=device)
+    encoder_hidden_states = torch.randn(batch_size, 77, config.cross_attention_dim, dtype=dtype, device=device)
+    added_cond_kwargs = None
+    if config.addition_embed_type == "text_time": # SDXL benötigt gepoolte Text-Embeddings und Größenangaben
+        text_embed_dim = config.projection_class_embeddings_input_dim - 6 * config.addition_time_embed_dim
+        added_cond_kwargs = {
+            "text_embeds": torch.randn(batch_size, text_embed_dim, dtype=dtype, device=device),
+            "time_ids": torch.tensor([[height, width, 0, 0, height, width]] * batch_size, dtype=dtype, device=device),
+        }
+    timestep = torch.tensor(500, device=device)
+
+    with torch.no_grad():
+        unet(sample, timestep, encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs, return_dict=False) # Aufwärmen
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        for _ in range(runs):
+            unet(sample, timestep, encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs, return_dict=False)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / runs
+
+
+def quantize_module_int8(module):
+    """Quantisiert alle Linear-Schichten (inkl. Attention-Projektionen) dynamisch auf int8 für die CPU."""
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def int8_cache_dir(model_hash, is_sdxl):
+    """
+    Gibt das Verzeichnis des float32/int8-Vergleichsberichts eines Modells zurück. Die PyTorch-Version gehört
+    zum Schlüssel, da die Messwerte von der Quantisierungs-Implementierung abhängen.
+    """
+    torch_version = torch.__version__.split("+")[0]
+    return os.path.join(QUANTIZED_MODELS_DIR, f"{model_hash[:16]}_{'sdxl' if is_sdxl else 'sd'}_torch{torch_version}")
+
+
+def state_dict_size_bytes(module):
+    """Größe aller Tensoren im State-Dict eines Moduls (in Bytes), auch gepackte Gewichte quantisierter Schichten."""
+    total_bytes = 0
+    for value in module.state_dict().values():
+        for tensor in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(tensor, torch.Tensor):
+                total_bytes += tensor.numel() * tensor.element_size()
+    return total_bytes
+
+
+def save_int8_report(model_hash, is_sdxl, report):
+    """Speichert den float32/int8-Vergleich eines Modells."""
+    cache_dir = int8_cache_dir(model_hash, is_sdxl)
+    os.makedirs(cache_dir, exist_ok=True)
+    report["torch_version"] = torch.__version__
+    with open(os.path.join(cache_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+
+def load_int8_report(model_hash, is_sdxl):
+    """Liest den gespeicherten float32/int8-Vergleich eines Modells (oder None)."""
+    report_path = os.path.join(int8_cache_dir(model_hash, is_sdxl), "report.json")
+    if not os.path.exists(report_path):
+        return None
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def format_int8_report(report):
+    """Formatiert den float32/int8-Vergleich für die Statusleiste."""
+    if not report:
+        return "int8 aktiv."
+    parts = []
+    if report.get("float32_unet_seconds") and report.get("int8_unet_seconds"):
+        speedup = report["float32_unet_seconds"] / report["int8_unet_seconds"]
+        parts.append(f"UNet-Schritt {report['float32_unet_seconds']:.2f}s -> {report['int8_unet_seconds']:.2f}s ({speedup:.2f}x)")
+    if report.get("float32_bytes") and report.get("int8_bytes"):
+        parts.append(f"Gewichte {format_bytes(report['float32_bytes'])} -> {format_bytes(report['int8_bytes'])}")
+    return "int8 vs. float32: " + ", ".join(parts) if parts else "int8 aktiv."
+
+
+def onnx_cache_dir(model_hash, is_sdxl):
+    """Gibt das Cache-Verzeichnis der ONNX-Graphen eines Modells zurück."""
+    return os.path.join(ONNX_MODELS_DIR, f"{model_hash[:16]}_{'sdxl' if is_sdxl else 'sd'}")
+
+
+def load_onnx_report(model_hash, is_sdxl):
+    """Liest die Export-Informationen (inkl. Vergleich torch/ONNX). Existiert die Datei, ist der Export vollständig."""
+    report_path = os.path.join(onnx_cache_dir(model_hash, is_sdxl), "report.json")
+    if not os.path.exists(report_path):
+        return None
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def format_onnx_report(report):
+    """Formatiert den Vergleich PyTorch/ONNX Runtime für die Statusleiste."""
+    if not report or not report.get("torch_unet_seconds") or not report.get("onnx_unet_seconds"):
+        return "ONNX Runtime aktiv."
+    speedup = report["torch_unet_seconds"] / report["onnx_unet_seconds"]
+    return f"ONNX Runtime vs. PyTorch: UNet-Schritt {report['torch_unet_seconds']:.2f}s -> {report['onnx_unet_seconds']:.2f}s ({speedup:.2f}x)"
+
+
+class _TextEncoderExport(torch.nn.Module):
+    """Exportiert einen Text-Encoder mit Hauptausgabe und den beiden letzten Hidden States (mehr nutzen die Pipelines nicht)."""
+
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        output = self.text_encoder(input_ids, output_hidden_states=True, return_dict=True)
+        return output[0], output.hidden_states[-2], output.hidden_states[-1]
+
+
+class _UNetExport(torch.nn.Module):
+    """Exportiert das UNet mit festen, benannten Eingängen (SDXL zusätzlich mit text_embeds und time_ids)."""
+
+    def __init__(self, unet, is_sdxl):
+        super().__init__()
+        self.unet = unet
+        self.is_sdxl = is_sdxl
+
+    def forward(self, sample, timestep, encoder_hidden_states, text_embeds=None, time_ids=None):
+        added_cond_kwargs = {"text_embeds": text_embeds, "time_ids": time_ids} if self.is_sdxl else None
+        return self.unet(sample, timestep, encoder_hidden_states, added_cond_kwargs=added_cond_kwargs, return_dict=False)[0]
+
+
+class _VAEDecoderExport(torch.nn.Module):
+    """Exportiert post_quant_conv und Decoder des VAE als einen Graphen."""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.post_quant_conv = vae.post_quant_conv if vae.config.use_post_quant_conv else torch.nn.Identity()
+        self.decoder = vae.decoder
+
+    def forward(self, latent):
+        return self.decoder(self.post_quant_conv(latent))
+
+
+def export_onnx_model(module, args, model_path, input_names, output_names, dynamic_axes):
+    """Exportiert ein Modul nach ONNX; die Gewichte landen in einer Datei neben dem Graphen (nötig ab 2 GB)."""
+    import onnx # Nur für den einmaligen Export benötigt
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    temp_dir = model_path + ".export"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    try:
+        temp_path = os.path.join(temp_dir, "model.onnx")
+        with torch.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter("ignore") # TracerWarnings der Diffusers-Modelle sind hier erwartet
+            torch.onnx.export(
+                module, args, temp_path,
+                input_names=input_names, output_names=output_names, dynamic_axes=dynamic_axes,
+                opset_version=ONNX_OPSET, do_constant_folding=True, dynamo=False,
+            )
+        onnx_model = onnx.load(temp_path) # Lädt auch ggf. einzeln abgelegte Gewichte
+        onnx.save_model(onnx_model, model_path, save_as_external_data=True, all_tensors_to_one_file=True, location=os.path.basename(model_path) + ".data", size_threshold=1024)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def export_pipeline_onnx(pipe, export_dir, is_sdxl):
+    """Exportiert Text-Encoder, UNet und VAE-Decoder einer Float32-Pipeline nach export_dir/<komponente>/model.onnx."""
+    batch_size = 2 # Ein Schritt mit Classifier-Free Guidance
+    for name in ("text_encoder", "text_encoder_2"):
+        text_encoder = getattr(pipe, name, None)
+        if text_encoder is None:
+            continue
+        input_ids = torch.zeros(batch_size, pipe.tokenizer.model_max_length, dtype=torch.long)
+        export_onnx_model(
+            _TextEncoderExport(text_encoder), (input_ids,), os.path.join(export_dir, name, "model.onnx"),
+            ["input_ids"], ["output", "hidden_penultimate", "hidden_last"],
+            {"input_ids": {0: "batch"}, "output": {0: "batch"}, "hidden_penultimate": {0: "batch"}, "hidden_last": {0: "batch"}},
+        )
+
+    config = pipe.unet.config
+    latent_side = 64 # Vielfaches von 8, damit keine größenabhängigen Upsampling-Pfade eingefroren werden
+    unet_args = [
+        torch.randn(batch_size, config.in_channels, latent_side, latent_side),
+        torch.full((batch_size,), 500.0),
+        torch.randn(batch_size, 77, config.cross_attention_dim),
+    ]
+    input_names = ["sample", "timestep", "encoder_hidden_states"]
+    dynamic_axes = {"sample": {0: "batch", 2: "height", 3: "width"}, "timestep": {0: "batch"}, "encoder_hidden_states": {0: "batch", 1: "sequence"}, "noise_pred": {0: "batch", 2: "height", 3: "width"}}
+    if is_sdxl:
+        text_embed_dim = config.projection_class_embeddings_input_dim - 6 * config.addition_time_embed_dim
+        unet_args += [torch.randn(batch_size, text_embed_dim), torch.tensor([[1024.0, 1024.0, 0.0, 0.0, 1024.0, 1024.0]] * batch_size)]
+        input_names += ["text_embeds", "time_ids"]
+        dynamic_axes.update({"text_embeds": {0: "batch"}, "time_ids": {0: "batch"}})
+    export_onnx_model(_UNetExport(pipe.unet, is_sdxl), tuple(unet_args), os.path.join(export_dir, "unet", "model.onnx"), input_names, ["noise_pred"], dynamic_axes)
+
+    export_onnx_model(
+        _VAEDecoderExport(pipe.vae), (torch.randn(1, pipe.vae.config.latent_channels, latent_side, latent_side),),
+        os.path.join(export_dir, "vae_decoder", "model.onnx"),
+        ["latent"], ["image"], {"latent": {0: "batch", 2: "height", 3: "width"}, "image": {0: "batch", 2: "height", 3: "width"}},
+    )
+
+
+def create_onnx_session(model_path, intra_op_threads=0):
+    """
+    Erstellt eine ONNX-Runtime-Sitzung für die CPU mit allen Graph-Optimierungen.
+    intra_op_threads=0 überlässt die Thread-Anzahl ONNX Runtime (alle Kerne).
+    """
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class OnnxComponent(torch.nn.Module):
+    """
+    Führt eine exportierte Pipeline-Komponente mit ONNX Runtime auf der CPU aus.
+    Das ursprüngliche Modul bleibt ohne Gewichte (auf dem "meta"-Gerät) erhalten und liefert
+    Konfiguration und Attribute, die die Diffusers-Pipelines abfragen (config, add_embedding, ...).
+    """
+
+    def __init__(self, session, original):
+        super().__init__()
+        self.session = session
+        self.input_names = [model_input.name for model_input in session.get_inputs()]
+        self.__dict__["original"] = original.to("meta") # Nicht als Untermodul registrieren (pipe.to() darf es nicht bewegen)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.__dict__["original"], name)
+
+    @property
+    def dtype(self):
+        return torch.float32
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def to(self, *args, **kwargs):
+        return self # Läuft immer auf der CPU in float32
+
+    def run(self, **inputs):
+        """Führt den Graphen aus (Tensoren rein, Tensoren raus)."""
+        feeds = {name: value.detach().cpu().numpy() for name, value in inputs.items() if name in self.input_names}
+        return [torch.from_numpy(output) for output in self.session.run(None, feeds)]
+
+
+class OnnxTextEncoderOutput(tuple):
+    """Ausgabe wie bei transformers: [0] ist die Hauptausgabe, hidden_states enthält die beiden letzten Schichten."""
+    hidden_states = None
+
+
+class OnnxTextEncoder(OnnxComponent):
+    def forward(self, input_ids, attention_mask=None, output_hidden_states=None, return_dict=None, **kwargs):
+        output, hidden_penultimate, hidden_last = self.run(input_ids=input_ids.long())
+        result = OnnxTextEncoderOutput((output,))
+        result.hidden_states = (hidden_penultimate, hidden_last)
+        return result
+
+
+class OnnxUNet(OnnxComponent):
+    def forward(self, sample, timestep, encoder_hidden_states, timestep_cond=None, attention_mask=None, cross_attention_kwargs=None, added_cond_kwargs=None, return_dict=True, **kwargs):
+        batch_size, _, height, width = sample.shape
+        # Latent-Größen, die kein Vielfaches der Downsampling-Stufen sind, werden aufgefüllt und danach zugeschnitten
+        size_multiple = 2 ** (len(self.config.block_out_channels) - 1)
+        pad_height, pad_width = (-height) % size_multiple, (-width) % size_multiple
+        model_input = sample.float()
+        if pad_height or pad_width:
+            model_input = torch.nn.functional.pad(model_input, (0, pad_width, 0, pad_height), mode="replicate")
+        inputs = {
+            "sample": model_input,
+            "timestep": torch.as_tensor(timestep, dtype=torch.float32).reshape(-1).expand(batch_size).contiguous(),
+            "encoder_hidden_states": encoder_hidden_states.float(),
+        }
+        if added_cond_kwargs:
+            inputs["text_embeds"] = added_cond_kwargs["text_embeds"].float()
+            inputs["time_ids"] = added_cond_kwargs["time_ids"].float()
+        noise_pred = self.run(**inputs)[0][:, :, :height, :width].to(sample.dtype)
+        return UNet2DConditionOutput(sample=noise_pred) if return_dict else (noise_pred,)
+
+
+class OnnxVAEDecoder(OnnxComponent):
+    def forward(self, latent, *args, **kwargs):
+        return self.run(latent=latent.float())[0].to(latent.dtype)
+
+
+def apply_onnx_backend(pipe, export_dir):
+    """
+    Ersetzt Text-Encoder, UNet und VAE-Decoder der Pipeline durch ONNX-Runtime-Sitzungen (Gewichte werden freigegeben).
+    Alle Sitzungen werden vorher erstellt, damit die Pipeline bei einem Fehler unverändert bleibt.
+    """
+    text_encoder_names = [name for name in ("text_encoder", "text_encoder_2") if getattr(pipe, name, None) is not None]
+    sessions = {name: create_onnx_session(os.path.join(export_dir, name, "model.onnx")) for name in text_encoder_names + ["unet", "vae_decoder"]}
+    for name in text_encoder_names:
+        setattr(pipe, name, OnnxTextEncoder(sessions[name], getattr(pipe, name)))
+    pipe.unet = OnnxUNet(sessions["unet"], pipe.unet)
+    # Der VAE-Encoder bleibt in PyTorch; post_quant_conv ist Teil des exportierten Decoders
+    pipe.vae.decoder = OnnxVAEDecoder(sessions["vae_decoder"], pipe.vae.decoder)
+    pipe.vae.post_quant_conv = torch.nn.Identity()
+    gc.collect()
+    return pipe
+
+
+def bipartite_soft_matching_2d(metric, height, width, merge_count, stride=2):
+    """
+    Token Merging (ToMe) nach Bolya & Hoffman: Pro stride x stride-Feld wird das linke obere Token zum Ziel,
+    alle anderen sind Quellen. Die merge_count Quellen mit der höchsten Kosinus-Ähnlichkeit zu einem Ziel
+    werden mit diesem gemittelt. Die Auswahl ist deterministisch (kein Zufall), damit gleiche Seeds gleiche
+    Bilder ergeben. Gibt die Funktionen (merge, unmerge) zurück.
+    """
+    batch_size, token_count, _ = metric.shape
+    if merge_count <= 0:
+        return (lambda x: x), (lambda x: x)
+
+    with torch.no_grad():
+        grid_height, grid_width = height // stride, width // stride
+        # Ziel-Tokens markieren (-1 sortiert vor die Quellen), Randzeilen/-spalten bleiben Quellen
+        index_buffer = torch.zeros(height, width, device=metric.device, dtype=torch.int64)
+        index_buffer[:grid_height * stride:stride, :grid_width * stride:stride] = -1
+        order = index_buffer.reshape(1, -1, 1).argsort(dim=1, stable=True)
+        dst_count = grid_height * grid_width
+        src_order = order[:, dst_count:, :]
+        dst_order = order[:, :dst_count, :]
+
+        def split(x):
+            channels = x.shape[-1]
+            src = torch.gather(x, 1, src_order.expand(x.shape[0], token_count - dst_count, channels))
+            dst = torch.gather(x, 1, dst_order.expand(x.shape[0], dst_count, channels))
+            return src, dst
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        src_metric, dst_metric = split(metric)
+        scores = src_metric @ dst_metric.transpose(-1, -2)
+        merge_count = min(src_metric.shape[1], merge_count)
+        node_max, node_index = scores.max(dim=-1)
+        edge_index = node_max.argsort(dim=-1, descending=True)[..., None]
+        unmerged_index = edge_index[..., merge_count:, :] # Quellen, die erhalten bleiben
+        merged_index = edge_index[..., :merge_count, :] # Quellen, die zusammengeführt werden
+        target_index = torch.gather(node_index[..., None], dim=-2, index=merged_index)
+
+    def merge(x):
+        src, dst = split(x)
+        n, src_count, channels = src.shape
+        unmerged = torch.gather(src, -2, unmerged_index.expand(n, src_count - merge_count, channels))
+        src = torch.gather(src, -2, merged_index.expand(n, merge_count, channels))
+        dst = dst.scatter_reduce(-2, target_index.expand(n, merge_count, channels), src, reduce="mean")
+        return torch.cat([unmerged, dst], dim=1)
+
+    def unmerge(x):
+        unmerged_count = unmerged_index.shape[1]
+        unmerged, dst = x[..., :unmerged_count, :], x[..., unmerged_count:, :]
+        n, _, channels = unmerged.shape
+        src = torch.gather(dst, -2, target_index.expand(n, merge_count, channels))
+        output = torch.zeros(n, token_count, channels, device=x.device, dtype=x.dtype)
+        output.scatter_(-2, dst_order.expand(n, dst_count, channels), dst)
+        src_positions = src_order.expand(n, src_order.shape[1], 1)
+        output.scatter_(-2, torch.gather(src_positions, 1, unmerged_index).expand(n, unmerged_count, channels), unmerged)
+        output.scatter_(-2, torch.gather(src_positions, 1, merged_index).expand(n, merge_count, channels), src)
+        return output
+
+    return merge, unmerge
+
+
+class TokenMergingAttnProcessor:
+    """
+    Hüllt den vorhandenen Attention-Prozessor einer Self-Attention (attn1) ein: Tokens werden davor
+    zusammengeführt und das Ergebnis danach wieder auf alle Tokens verteilt. Die Latent-Größe des
+    aktuellen UNet-Aufrufs kommt aus einem Forward-Pre-Hook (state["latent_size"]).
+    """
+
+    def __init__(self, processor, state, downsample):
+        self.processor = processor
+        self.state = state
+        self.downsample = downsample
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, **kwargs):
+        if temb is not None: # Nur weiterreichen, wenn gesetzt: SlicedAttnProcessor kennt temb nicht
+            kwargs["temb"] = temb
+        latent_size = self.state.get("latent_size")
+        if hidden_states.ndim != 3 or latent_size is None:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+        # Downsampling-Convs runden auf, daher ceil statt floor
+        height = -(-latent_size[0] // self.downsample)
+        width = -(-latent_size[1] // self.downsample)
+        if height * width != hidden_states.shape[1]:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+        merge, unmerge = bipartite_soft_matching_2d(hidden_states, height, width, int(hidden_states.shape[1] * self.state["ratio"]))
+        output = self.processor(attn, merge(hidden_states), encoder_hidden_states, attention_mask, **kwargs)
+        return unmerge(output)
+
+
+def attention_block_level(processor_name, unet):
+    """Auflösungsstufe (0 = volle Latent-Auflösung) eines Attention-Prozessors anhand seines Namens."""
+    parts = processor_name.split(".")
+    if parts[0] == "down_blocks":
+        return int(parts[1])
+    if parts[0] == "up_blocks":
+        return len(unet.up_blocks) - 1 - int(parts[1])
+    return len(unet.down_blocks) - 1 # mid_block
+
+
+def remove_token_merging(unet):
+    """Entfernt Token Merging wieder (ursprüngliche Prozessoren und kein Hook). Gibt True zurück, wenn es aktiv war."""
+    token_merging = getattr(unet, "_token_merging", None)
+    if token_merging is None:
+        return False
+    token_merging["hook"].remove()
+    processors = {name: processor.processor if isinstance(processor, TokenMergingAttnProcessor) else processor for name, processor in unet.attn_processors.items()}
+    unet.set_attn_processor(processors)
+    unet._token_merging = None
+    return True
+
+
+def apply_token_merging(unet, ratio):
+    """
+    Aktiviert Token Merging für die Self-Attention der höchstaufgelösten Transformer-Blöcke des UNets
+    (bei SD 1.x Stufe 0, bei SDXL Stufe 1, da dort die erste Stufe keine Attention hat).
+    Gibt die Anzahl der eingehüllten Prozessoren zurück.
+    """
+    remove_token_merging(unet)
+    processors = unet.attn_processors
+    self_attention_names = [name for name in processors if name.endswith("attn1.processor")]
+    if not self_attention_names or ratio <= 0:
+        return 0
+    top_level = min(attention_block_level(name, unet) for name in self_attention_names)
+    state = {"ratio": min(ratio, TOME_MAX_RATIO), "latent_size": None}
+    wrapped_count = 0
+    for name in self_attention_names:
+        if attention_block_level(name, unet) == top_level:
+            processors[name] = TokenMergingAttnProcessor(processors[name], state, 2 ** top_level)
+            wrapped_count += 1
+    unet.set_attn_processor(processors)
+
+    def record_latent_size(module, args, kwargs):
+        sample = args[0] if args else kwargs.get("sample")
+        state["latent_size"] = tuple(sample.shape[-2:]) if sample is not None else None
+
+    unet._token_merging = {"state": state, "hook": unet.register_forward_pre_hook(record_latent_size, with_kwargs=True)}
+    return wrapped_count
+
+
+def apply_attention_backend(pipe, backend, slice_size=None):
+    """
+    Setzt die Attention-Prozessoren von UNet und VAE ohne Neuladen: "sdpa", "xformers", "classic" oder "sliced"
+    (UNet in Scheiben zu slice_size Köpfen; das VAE hat nur einen Kopf und bleibt bei SDPA). Aktives Token Merging
+    wird vorher abgelöst und danach um die neuen Prozessoren gelegt. Gibt die Bezeichnung des Backends zurück.
+    """
+    label = f"sliced:{slice_size}" if backend == "sliced" else backend
+    if getattr(pipe.unet, "_attention_backend", None) == label:
+        return label
+    token_merging = getattr(pipe.unet, "_token_merging", None)
+    ratio = token_merging["state"]["ratio"] if token_merging else None
+    remove_token_merging(pipe.unet)
+    try:
+        if backend == "xformers":
+            pipe.enable_xformers_memory_efficient_attention() # Wirft, wenn xformers fehlt
+        else:
+            processor_class = AttnProcessor if backend == "classic" else AttnProcessor2_0
+            pipe.unet.set_attn_processor(SlicedAttnProcessor(slice_size) if backend == "sliced" else processor_class())
+            pipe.vae.set_attn_processor(processor_class())
+        pipe.unet._attention_backend = label
+    finally:
+        if ratio:
+            apply_token_merging(pipe.unet, ratio)
+    return label
+
+
+def attention_matrix_bytes(unet, latent_height, latent_width, batch_size):
+    """
+    Größte Self-Attention-Matrix eines UNet-Aufrufs, wie sie ohne fusionierten Kernel (klassisch, SDPA auf MPS)
+    angelegt wird. Gibt (Bytes, Tokens, Batch mal Köpfe) dieser Schicht zurück.
+    """
+    largest = (0, 0, 0)
+    for name in unet.attn_processors:
+        if not name.endswith("attn1.processor"):
+            continue
+        scale = 2 ** attention_block_level(name, unet)
+        tokens = -(-latent_height // scale) * -(-latent_width // scale)
+        batch_heads = batch_size * unet.get_submodule(name[:-len(".processor")]).heads
+        matrix_bytes = batch_heads * tokens * tokens * unet.dtype.itemsize
+        if matrix_bytes > largest[0]:
+            largest = (matrix_bytes, tokens, batch_heads)
+    return largest
+
+
+def attention_memory_budget(device):
+    """Speicher, den die Attention-Matrizen belegen dürfen (Anteil des freien VRAM bzw. Arbeitsspeichers), oder None."""
+    if device == "cuda":
+        free_bytes = torch.cuda.mem_get_info()[0]
+    else:
+        free_bytes = get_available_memory()
+    return int(free_bytes * ATTENTION_AUTO_MEMORY_FRACTION) if free_bytes else None
+
+
+def choose_attention_backend(device, preferred, matrix_bytes, budget_bytes):
+    """
+    Auto-Auswahl pro Bildgröße: Das bevorzugte Backend (Tuning-Profil bzw. Standard), außer es legt die volle
+    Attention-Matrix an und diese passt nicht ins Budget. xformers und SDPA auf CUDA/CPU rechnen ohne volle Matrix.
+    """
+    materializes = preferred == "classic" or (preferred == "sdpa" and device == "mps")
+    if materializes and budget_bytes is not None and matrix_bytes > budget_bytes:
+        return "sliced"
+    return preferred
+
+
+def attention_slice_size(tokens, batch_heads, element_size, budget_bytes):
+    """Größte Zweierpotenz an Köpfen pro Scheibe, deren Attention-Matrix ins Budget passt (mindestens 1)."""
+    if not budget_bytes:
+        return ATTENTION_DEFAULT_SLICE_SIZE
+    slice_size = 1
+    while slice_size * 2 <= batch_heads and slice_size * 2 * tokens * tokens * element_size <= budget_bytes:
+        slice_size *= 2
+    return slice_size
+
+
+class DeepCacheController:
+    """
+    Feature-Caching über Entrauschungsschritte (nach DeepCache): Nur jeder interval-te UNet-Aufruf wird
+    vollständig berechnet. Dazwischen werden die tiefen Blöcke (down_blocks[1:], mid_block, up_blocks[:-1])
+    nicht ausgeführt, sondern liefern ihre Ausgaben aus dem letzten vollen Aufruf; neu berechnet werden nur
+    conv_in, Zeit-Embedding, down_blocks[0], up_blocks[-1] und conv_out.
+    Gezählt wird pro UNet-Aufruf, daher funktioniert das mit allen Schedulern (auch zweistufigen wie Heun).
+    """
+
+    def __init__(self, unet, interval):
+        self.interval = interval
+        self.blocks = [block for block in list(unet.down_blocks[1:]) + [unet.mid_block] + list(unet.up_blocks[:-1]) if block is not None]
+        self.cache = {}
+        for block_index, block in enumerate(self.blocks):
+            block.forward = self._cached_forward(block_index, block.forward)
+        self.hooks = [
+            unet.register_forward_pre_hook(self._before_unet, with_kwargs=True),
+            unet.register_forward_hook(self._after_unet),
+        ]
+        self.reset()
+
+    def reset(self):
+        """Vor jedem Bild aufrufen: leert den Cache und die Messwerte."""
+        self.cache.clear()
+        self.call_index = 0
+        self.full_step = True
+        self.cached_shape = None
+        self.call_start_time = None
+        self.stats = {"full_calls": 0, "cached_calls": 0, "full_seconds": 0.0, "cached_seconds": 0.0}
+
+    def _before_unet(self, module, args, kwargs):
+        sample = args[0] if args else kwargs.get("sample")
+        sample_shape = tuple(sample.shape)
+        # Neue Bildgröße oder Batch (z.B. anderes Bild) erzwingt eine volle Berechnung
+        self.full_step = self.call_index % self.interval == 0 or sample_shape != self.cached_shape
+        if self.full_step:
+            self.cached_shape = sample_shape
+        self.call_index += 1
+        self.call_start_time = time.perf_counter()
+
+    def _after_unet(self, module, args, output):
+        elapsed = time.perf_counter() - self.call_start_time
+        kind = "full" if self.full_step else "cached"
+        self.stats[f"{kind}_calls"] += 1
+        self.stats[f"{kind}_seconds"] += elapsed
+
+    def _cached_forward(self, block_index, forward):
+        def cached_forward(*args, **kwargs):
+            if self.full_step or block_index not in self.cache:
+                output = forward(*args, **kwargs)
+                self.cache[block_index] = output
+                return output
+            return self.cache[block_index]
+        return cached_forward
+
+    def remove(self):
+        """Stellt die ursprünglichen Block-Forwards wieder her."""
+        for block in self.blocks:
+            block.__dict__.pop("forward", None)
+        for hook in self.hooks:
+            hook.remove()
+        self.cache.clear()
+
+    def summary(self):
+        """Gemessene Beschleunigung: tatsächliche UNet-Zeit gegenüber lauter vollen Aufrufen."""
+        stats = self.stats
+        total_calls = stats["full_calls"] + stats["cached_calls"]
+        if not stats["full_calls"]:
+            return "DeepCache: keine UNet-Aufrufe gemessen"
+        estimated_seconds = stats["full_seconds"] / stats["full_calls"] * total_calls
+        actual_seconds = stats["full_seconds"] + stats["cached_seconds"]
+        return f"DeepCache: {stats['full_calls']}/{total_calls} volle UNet-Aufrufe, UNet {actual_seconds:.1f}s statt ca. {estimated_seconds:.1f}s ({estimated_seconds / actual_seconds:.2f}x)"
+
+
+class PipelineProfiler:
+    """
+    Zeichnet einen Pipeline-Aufruf mit torch.profiler auf: Die ersten skip_steps Entrauschungsschritte werden
+    übersprungen, danach record_steps Schritte aufgezeichnet (step() im Schritt-Callback aufrufen).
+    UNet-Blöcke, VAE, Text-Encoder und scheduler.step erscheinen als eigene Abschnitte im Trace, damit die
+    Operatoren ihnen zugeordnet werden können. export() schreibt einen Chrome/Perfetto-Trace und eine Operator-Tabelle.
+    """
+
+    def __init__(self, pipe, num_inference_steps, skip_steps=PROFILE_SKIP_STEPS, record_steps=int(PROFILE_RECORD_DEFAULT)):
+        # Bei wenigen Schritten den Zeitplan kürzen, sonst würde nie aufgezeichnet
+        self.skip_steps = max(0, min(skip_steps, num_inference_steps - 1))
+        self.record_steps = max(1, min(record_steps, num_inference_steps - self.skip_steps))
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available() and getattr(pipe, "device", torch.device("cpu")).type == "cuda":
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.sort_key = "self_cuda_time_total" if len(activities) > 1 else "self_cpu_time_total"
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # Ohne übersprungene Schritte warnt der Profiler über fehlendes Aufwärmen
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                # Der letzte übersprungene Schritt dient als Aufwärmphase des Profilers
+                schedule=torch.profiler.schedule(wait=max(0, self.skip_steps - 1), warmup=min(1, self.skip_steps), active=self.record_steps, repeat=1),
+                on_trace_ready=self._trace_ready,
+                record_shapes=True,
+                profile_memory=True,
+            )
+        self.traced_profiler = None
+        self.hooks = []
+        self.open_ranges = {}
+        self.range_names = ["scheduler.step", "vae.decode"]
+        modules = []
+        unet = getattr(pipe, "unet", None)
+        if unet is not None:
+            modules += [(f"unet.down_blocks.{index}", block) for index, block in enumerate(unet.down_blocks)]
+            if unet.mid_block is not None:
+                modules.append(("unet.mid_block", unet.mid_block))
+            modules += [(f"unet.up_blocks.{index}", block) for index, block in enumerate(unet.up_blocks)]
+        for name in ("text_encoder", "text_encoder_2", "vae"):
+            component = getattr(pipe, name, None)
+            if isinstance(component, torch.nn.Module):
+                modules.append((name, component))
+        for name, module in modules:
+            self.range_names.append(name)
+            self.hooks.append(module.register_forward_pre_hook(self._range_start(name)))
+            self.hooks.append(module.register_forward_hook(self._range_end(name)))
+        self.scheduler = getattr(pipe, "scheduler", None)
+        if self.scheduler is not None:
+            scheduler_step = self.scheduler.step
+            def profiled_step(*args, **kwargs):
+                with torch.profiler.record_function("scheduler.step"):
+                    return scheduler_step(*args, **kwargs)
+            self.scheduler.step = profiled_step
+
+    def _range_start(self, name):
+        def hook(module, args):
+            record = torch.profiler.record_function(name)
+            record.__enter__()
+            self.open_ranges.setdefault(name, []).append(record)
+        return hook
+
+    def _range_end(self, name):
+        def hook(module, args, output):
+            ranges = self.open_ranges.get(name)
+            if ranges:
+                ranges.pop().__exit__(None, None, None)
+        return hook
+
+    def _trace_ready(self, profiler):
+        self.traced_profiler = profiler
+
+    def __enter__(self):
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.profiler.__exit__(exc_type, exc_value, exc_traceback) # Schließt eine laufende Aufzeichnung ab
+        for hook in self.hooks:
+            hook.remove()
+        if self.scheduler is not None:
+            self.scheduler.__dict__.pop("step", None)
+        self.open_ranges.clear()
+        return False
+
+    def step(self):
+        """Am Ende jedes Entrauschungsschritts aufrufen."""
+        self.profiler.step()
+
+    def export(self, base_path, title=None):
+        """
+        Schreibt <base_path>.trace.json und <base_path>.ops.txt, gibt die Pfade zurück (leer ohne Aufzeichnung).
+        title ersetzt die Kopfzeile der Tabelle (sonst: aufgezeichnete und übersprungene Schritte).
+        """
+        if self.traced_profiler is None:
+            return []
+        trace_path, table_path = base_path + ".trace.json", base_path + ".ops.txt"
+        self.traced_profiler.export_chrome_trace(trace_path)
+        averages = self.traced_profiler.key_averages()
+        sections = sorted((event for event in averages if event.key in self.range_names), key=lambda event: event.cpu_time_total, reverse=True)
+        with open(table_path, "w", encoding="utf-8") as f:
+            f.write(f"{title or f'Aufgezeichnet: {self.record_steps} Schritt(e) nach {self.skip_steps} übersprungenen'}\n\n")
+            f.write("Abschnitte (Blöcke, Komponenten, Scheduler), Zeiten in ms:\n")
+            f.write(f"{'Abschnitt':<24}{'Aufrufe':>9}{'CPU gesamt':>13}{'CPU pro Aufruf':>16}{'GPU gesamt':>13}\n")
+            for event in sections:
+                device_time = getattr(event, "device_time_total", getattr(event, "cuda_time_total", 0))
+                f.write(f"{event.key:<24}{event.count:>9}{event.cpu_time_total / 1000:>13.2f}{event.cpu_time_total / 1000 / event.count:>16.2f}{device_time / 1000:>13.2f}\n")
+            f.write("\nOperatoren:\n")
+            f.write(averages.table(sort_by=self.sort_key, row_limit=PROFILE_TABLE_ROWS))
+        return [trace_path, table_path]
+
+
+class TensorPool:
+    """
+    Wiederverwendbare Tensoren für Stapel-Durchläufe, nach Namen abgelegt. Solange Form, Datentyp und Gerät
+    gleich bleiben, wird derselbe Speicher zurückgegeben, sonst wird der Puffer ersetzt.
+    Jeder Name darf nur von einem Thread verwendet werden.
+    """
+
+    def __init__(self):
+        self.tensors = {}
+        self.reused = 0
+        self.allocated = 0
+
+    def get(self, name, shape, dtype, device):
+        key = (tuple(shape), dtype, str(device))
+        entry = self.tensors.get(name)
+        if entry is not None and entry[0] == key:
+            self.reused += 1
+            return entry[1]
+        self.tensors.pop(name, None) # Alten Puffer vor dem Anlegen freigeben (Spitzenbedarf)
+        tensor = torch.empty(shape, dtype=dtype, device=device)
+        self.tensors[name] = (key, tensor)
+        self.allocated += 1
+        return tensor
+
+    def nbytes(self):
+        return sum(tensor.numel() * tensor.element_size() for _, tensor in list(self.tensors.values()))
+
+    def clear(self):
+        self.tensors.clear()
+
+    def summary(self):
+        return f"Puffer-Pool: {self.reused}x wiederverwendet, {self.allocated}x neu angelegt, {format_bytes(self.nbytes())} belegt"
+
+
+def fit_size(width, height, max_width, max_height):
+    """Größte Größe mit dem Seitenverhältnis width:height, die in max_width x max_height passt."""
+    aspect_ratio = width / height
+    if max_width / max_height > aspect_ratio:
+        return max(1, int(max_height * aspect_ratio)), max_height
+    return max_width, max(1, int(max_width / aspect_ratio))
+
+
+def plan_job_batch(pending, max_batch_size, max_wait_seconds, now):
+    """
+    Wählt aus den wartenden Aufträgen (älteste zuerst) den nächsten Stapel: den ältesten Auftrag und bis zu
+    max_batch_size - 1 weitere mit demselben Stapel-Schlüssel (Größe, Schritte, CFG, Scheduler, LoRAs).
+    Gibt (Stapel, Wartezeit) zurück. Ist der Stapel noch nicht voll und wartet der älteste Auftrag noch keine
+    max_wait_seconds, kommt ([], Restwartezeit): So ist die Verzögerung eines einzelnen Auftrags begrenzt.
+    Ohne wartende Aufträge kommt ([], None).
+    """
+    if not pending:
+        return [], None
+    oldest = pending[0]
+    batch = [job for job in pending if job["batch_key"] == oldest["batch_key"]][:max_batch_size]
+    remaining_wait = oldest["queued_at"] + max_wait_seconds - now
+    if len(batch) < max_batch_size and remaining_wait > 0:
+        return [], remaining_wait
+    return batch, 0.0
+
+
+def cuda_memory_pressure(min_free_fraction=CUDA_FLUSH_FREE_FRACTION):
+    """True, wenn auf der GPU weniger als min_free_fraction frei ist: nur dann lohnt sich torch.cuda.empty_cache()."""
+    if not torch.cuda.is_available():
+        return False
+    free_bytes, total_bytes = torch.cuda.mem_get_info()
+    return free_bytes < total_bytes * min_free_fraction
+
+
+def module_available(name):
+    """True, wenn ein optionales Paket installiert ist (ohne es zu importieren)."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def torch_compile_available(device):
+    """torch.compile braucht auf der GPU Triton und auf der CPU einen C++-Compiler (unter Windows cl.exe)."""
+    if device == "cuda":
+        return module_available("triton")
+    return any(shutil.which(name) for name in ("cl", "g++", "clang++"))
+
+
+def default_load_settings(device):
+    """Optimierungen beim Laden ohne Tuning-Profil (bisheriges Verhalten: auf der GPU Offloading und VAE-Slicing/-Tiling)."""
+    on_cuda = device == "cuda"
+    return {
+        "threads": None, # None = PyTorch-Vorgabe
+        "attention": "xformers" if on_cuda and module_available("xformers") else "sdpa",
+        "channels_last": False,
+        "dtype": "float16" if on_cuda else "float32",
+        "offload": on_cuda,
+        "vae_slicing": on_cuda,
+        "vae_tiling": on_cuda,
+        "compile": False,
+    }
+
+
+def autotune_candidates(device):
+    """
+    Zu messende Werte je Einstellung, in der Reihenfolge des Tunings. Der Datentyp kommt zuletzt,
+    weil sich die Umwandlung der geladenen Gewichte nicht verlustfrei rückgängig machen lässt.
+    """
+    on_cuda = device == "cuda"
+    candidates = []
+    if not on_cuda:
+        cpu_count = os.cpu_count() or 1
+        candidates.append(("threads", sorted({torch.get_num_threads(), cpu_count, max(1, cpu_count // 2)}, reverse=True)))
+    attention = ["sdpa", "classic", "slicing"]
+    if on_cuda and module_available("xformers"):
+        attention.append("xformers")
+    candidates.append(("attention", attention))
+    candidates.append(("channels_last", [False, True]))
+    if on_cuda:
+        candidates.append(("offload", [True, False]))
+        candidates.append(("vae_slicing", [True, False]))
+        candidates.append(("vae_tiling", [True, False]))
+    if torch_compile_available(device):
+        candidates.append(("compile", [False, True]))
+    if on_cuda:
+        candidates.append(("dtype", ["float16"] + (["bfloat16"] if torch.cuda.is_bf16_supported() else [])))
+    else:
+        candidates.append(("dtype", ["float32", "bfloat16"]))
+    return candidates
+
+
+def apply_pipeline_settings(pipe, settings, device):
+    """
+    Wendet die Laufzeit-Einstellungen eines Tuning-Profils auf eine geladene Pipeline an (beim Tuning
+    wiederholt mit wechselnden Werten). Der Datentyp wird schon beim Laden gewählt.
+    """
+    if settings.get("threads"):
+        torch.set_num_threads(settings["threads"])
+
+    attention = settings.get("attention", "sdpa")
+    if attention == "slicing": # Spart Speicher, indem die Attention in Scheiben berechnet wird
+        apply_attention_backend(pipe, "sliced", ATTENTION_DEFAULT_SLICE_SIZE)
+    else:
+        apply_attention_backend(pipe, attention)
+
+    memory_format = torch.channels_last if settings.get("channels_last") else torch.contiguous_format
+    pipe.unet.to(memory_format=memory_format)
+    pipe.vae.to(memory_format=memory_format)
+
+    if device == "cuda":
+        if settings.get("offload"):
+            pipe.enable_model_cpu_offload()
+        else:
+            pipe.remove_all_hooks()
+            pipe.to(device)
+
+    if settings.get("vae_slicing"):
+        pipe.vae.enable_slicing()
+    else:
+        pipe.vae.disable_slicing()
+    if settings.get("vae_tiling"):
+        pipe.vae.enable_tiling()
+    else:
+        pipe.vae.disable_tiling()
+
+    # Module.compile() kompiliert an Ort und Stelle: Namen und Hooks der UNet-Schichten bleiben erhalten (LoRAs, ToMe).
+    # Rückgängig machen lässt sich das nicht; das Auto-Tuning misst torch.compile daher mit einer eigenen Hülle.
+    if settings.get("compile") and not getattr(pipe.unet, "_compiled_by_settings", False):
+        pipe.unet.compile()
+        pipe.unet._compiled_by_settings = True
+
+
+def describe_load_settings(settings):
+    """Kurzbeschreibung der Einstellungen eines Tuning-Profils für Statuszeile und Info-Label."""
+    parts = [settings.get("dtype", "?"), f"Attention {settings.get('attention', 'sdpa')}"]
+    if settings.get("threads"):
+        parts.append(f"{settings['threads']} Threads")
+    for key, label in (("channels_last", "channels_last"), ("offload", "Offloading"), ("vae_slicing", "VAE-Slicing"), ("vae_tiling", "VAE-Tiling"), ("compile", "torch.compile")):
+        if settings.get(key):
+            parts.append(label)
+    return ", ".join(parts)
+
+
+def measure_pipeline_speed(pipe, width, height, num_inference_steps=AUTOTUNE_STEPS, runs=AUTOTUNE_RUNS):
+    """
+    Misst eine komplette Generierung (Text-Encoder, Entrauschen, VAE) mit festem Seed nach einem Aufwärmlauf.
+    Gibt die kürzeste Dauer in Sekunden, den Spitzenverbrauch im VRAM (None auf der CPU) und das Testbild zurück.
+    """
+    def run():
+        return pipe(
+            prompt=AUTOTUNE_PROMPT,
+            width=width,
+            height=height,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=5.0,
+            generator=torch.Generator(device="cpu").manual_seed(0),
+            output_type="np",
+        ).images[0]
+
+    on_cuda = torch.cuda.is_available()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        run() # Aufwärmen (bei torch.compile inklusive Kompilierung)
+        if on_cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        best_seconds = float("inf")
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            image = run()
+            if on_cuda:
+                torch.cuda.synchronize()
+            best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    return best_seconds, (torch.cuda.max_memory_allocated() if on_cuda else None), image
+
+
+def autotune_device_name(device):
+    """Rechner, für den ein Tuning-Profil gilt: Name der Grafikkarte bzw. Anzahl der CPU-Threads."""
+    if device == "cuda" and torch.cuda.is_available():
+        return torch.cuda.get_device_name(0)
+    return f"CPU ({os.cpu_count()} Threads)"
+
+
+def tuning_profile_key(model_hash, device, is_sdxl):
+    """Schlüssel der Tuning-Profile eines Modells auf diesem Rechner (pro Bildgröße gibt es darunter ein Profil)."""
+    return f"{model_hash}/{'sdxl' if is_sdxl else 'sd'}/{device}/{autotune_device_name(device)}"
+
+
+def load_tuning_profiles():
+    """Liest alle gespeicherten Tuning-Profile ({Schlüssel: {"BxH": Profil}})."""
+    if not os.path.exists(AUTOTUNE_PROFILES_FILE):
+        return {}
+    try:
+        with open(AUTOTUNE_PROFILES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
+
+
+def save_tuning_profile(key, profile):
+    """Speichert ein Tuning-Profil (ersetzt ein älteres für dieselbe Bildgröße)."""
+    profiles = load_tuning_profiles()
+    profiles.setdefault(key, {})[f"{profile['width']}x{profile['height']}"] = profile
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(AUTOTUNE_PROFILES_FILE, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, ensure_ascii=False, indent=4)
+
+
+def find_tuning_profile(key, width=None, height=None):
+    """Profil für die Bildgröße, sonst das zuletzt gemessene Profil des Modells (oder None)."""
+    size_profiles = load_tuning_profiles().get(key) or {}
+    if not size_profiles:
+        return None
+    return size_profiles.get(f"{width}x{height}") or max(size_profiles.values(), key=lambda profile: profile.get("timestamp", ""))
+
+
+def guided_step_count(num_inference_steps, fraction):
+    """Anzahl der Schritte mit CFG, wenn die Guidance nach dem Anteil fraction der Schritte abgeschaltet wird (mindestens 1)."""
+    return max(1, min(num_inference_steps, int(round(num_inference_steps * fraction))))
+
+
+def image_difference(image, reference):
+    """Mittlere absolute Abweichung und PSNR (dB) zweier Bilder als float-Arrays im Bereich 0..1."""
+    mse = float(np.mean((image - reference) ** 2))
+    psnr = float("inf") if mse == 0 else 10 * math.log10(1.0 / mse)
+    return float(np.mean(np.abs(image - reference))), psnr
+
+
+def detect_distilled_model(model_name, unet=None):
+    """
+    Erkennt destillierte Few-Step-Checkpoints und gibt ihre Art zurück ("lcm", "turbo", "lightning" oder None).
+    LCM-Modelle bringen eine Guidance-Einbettung im UNet mit, Turbo- und Lightning/Hyper-SD-Modelle
+    werden am Dateinamen erkannt. Verglichen werden ganze Wörter (getrennt an Satzzeichen, Ziffern und
+    Binnenmajuskeln), damit z.B. "hyperrealism_v3" nicht als Hyper-SD gilt.
+    """
+    if unet is not None and getattr(unet.config, "time_cond_proj_dim", None) is not None:
+        return "lcm"
+    words = re.findall(r"[a-z]+|\d+", re.sub(r"([a-z])([A-Z])", r"\1 \2", model_name or "").lower())
+    if "lcm" in words:
+        return "lcm"
+    if "turbo" in words:
+        return "turbo"
+    # Hyper-SD nur als "Hyper-SD(XL)"/"HyperSD", nicht jedes Wort "hyper"
+    hyper_sd = any(word == "hyper" and following.startswith("sd") for word, following in zip(words, words[1:]))
+    if "lightning" in words or hyper_sd or "hypersd" in words or "hypersdxl" in words:
+        return "lightning"
+    return None
+
+
+def find_lcm_lora(is_sdxl, lora_dir=LORA_DIR):
+    """
+    Sucht im LoRA-Verzeichnis ein LCM-LoRA passend zur Modellart (Dateiname enthält "lcm",
+    SDXL-Varianten zusätzlich "xl"). Gibt den Pfad oder None zurück.
+    """
+    if not os.path.isdir(lora_dir):
+        return None
+    for filename in sorted(os.listdir(lora_dir)):
+        name = filename.lower()
+        if name.endswith(".safetensors") and "lcm" in name and ("xl" in name) == bool(is_sdxl):
+            return os.path.join(lora_dir, filename)
+    return None
+
+
+def read_lora_info(path):
+    """
+    Liest die Metadaten eines LoRAs aus dem safetensors-Header, ohne die Gewichte zu laden:
+    Basismodell, Rang, Alpha und Trigger-Wörter (bzw. die häufigsten Trainings-Tags).
+    """
+    info = {
+        "filename": os.path.basename(path),
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "size": os.path.getsize(path),
+        "base_model": None,
+        "is_sdxl": None,
+        "rank": None,
+        "alpha": None,
+        "trigger_words": [],
+    }
+    try:
+        with safetensors.torch.safe_open(path, framework="pt") as f:
+            metadata = f.metadata() or {}
+            keys = list(f.keys())
+    except Exception as e:
+        print(f"FEHLER: LoRA-Header von '{path}' konnte nicht gelesen werden: {e}")
+        return info
+
+    info["base_model"] = metadata.get("ss_base_model_version") or metadata.get("modelspec.architecture")
+    info["rank"] = metadata.get("ss_network_dim")
+    info["alpha"] = metadata.get("ss_network_alpha")
+    if info["base_model"]:
+        info["is_sdxl"] = "xl" in info["base_model"].lower()
+    elif any(key.startswith(("lora_te2_", "text_encoder_2.")) for key in keys):
+        info["is_sdxl"] = True # Zweiter Text-Encoder gibt es nur bei SDXL
+
+    if metadata.get("modelspec.trigger_phrase"):
+        info["trigger_words"] = [word.strip() for word in metadata["modelspec.trigger_phrase"].split(",") if word.strip()]
+    elif metadata.get("ss_tag_frequency"):
+        # kohya-Trainings-Metadaten: {Datensatz: {Tag: Häufigkeit}}
+        tag_counts = {}
+        try:
+            for dataset_tags in json.loads(metadata["ss_tag_frequency"]).values():
+                for tag, count in dataset_tags.items():
+                    tag_counts[tag.strip()] = tag_counts.get(tag.strip(), 0) + count
+        except (json.JSONDecodeError, AttributeError):
+            tag_counts = {}
+        info["trigger_words"] = sorted(tag_counts, key=tag_counts.get, reverse=True)[:3]
+    return info
+
+
+def list_loras(lora_dir=LORA_DIR):
+    """Alle LoRA-Dateien (.safetensors) im LoRA-Verzeichnis mit ihren Header-Metadaten, nach Namen sortiert."""
+    if not os.path.isdir(lora_dir):
+        return []
+    return [read_lora_info(os.path.join(lora_dir, filename))
+            for filename in sorted(os.listdir(lora_dir), key=str.lower)
+            if filename.lower().endswith(".safetensors")]
+
+
+def format_lora_info(info):
+    """Kurzbeschreibung eines LoRAs für die Auswahlliste."""
+    parts = []
+    if info["is_sdxl"] is not None:
+        parts.append("SDXL" if info["is_sdxl"] else "SD 1.x/2.x")
+    if info["rank"]:
+        parts.append(f"Rang {info['rank']}")
+    parts.append(format_bytes(info["size"]))
+    if info["trigger_words"]:
+        parts.append("Trigger: " + ", ".join(info["trigger_words"]))
+    return ", ".join(parts)
+
+
+class LoraManager:
+    """
+    Fusioniert LoRA-Kombinationen direkt in die Gewichte der Pipeline (kein Mehraufwand pro Schritt).
+    Die Originalgewichte der betroffenen Schichten werden einmal gesichert. Die fusionierten Gewichte jeder
+    Kombination aus Modell, LoRA-Satz und Stärken bleiben in einem LRU-Cache, sodass ein Wechsel zu einer
+    bekannten Kombination nur Tensoren kopiert, statt die LoRAs erneut zu laden und zu fusionieren.
+    """
+
+    def __init__(self, max_bytes=int(LORA_FUSED_CACHE_MAX_GB * 1024**3)):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.fused_cache = OrderedDict() # (Modell, Kombination) -> {Parametername: fusionierte Gewichte (CPU)}
+        self.cache_bytes = 0
+        self.model_key = None
+        self.original_weights = {} # Parametername -> Originalgewichte (CPU) der aktuellen Pipeline
+        self.current = () # Aktuell fusionierte Kombination
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, model_key=None):
+        """Neue Pipeline: gesicherte Originalgewichte verwerfen. Fusionierte Kombinationen bleiben pro Modell im Cache."""
+        with self.lock:
+            self.model_key = model_key
+            self.original_weights = {}
+            self.current = ()
+
+    @staticmethod
+    def _parameter(pipe, name):
+        component_name, parameter_name = name.split(".", 1)
+        return getattr(pipe, component_name).get_parameter(parameter_name)
+
+    def _restore(self, pipe):
+        """Schreibt die gesicherten Originalgewichte zurück."""
+        with torch.no_grad():
+            for name, tensor in self.original_weights.items():
+                self._parameter(pipe, name).copy_(tensor)
+        self.current = ()
+
+    def _fuse(self, pipe, combination):
+        """Lädt die LoRAs als Adapter, fusioniert sie mit ihren Stärken und entfernt die Adapter wieder."""
+        adapter_names = [f"lora_{index}" for index in range(len(combination))]
+        try:
+            for adapter_name, (path, _) in zip(adapter_names, combination):
+                pipe.load_lora_weights(path, adapter_name=adapter_name)
+            pipe.set_adapters(adapter_names, adapter_weights=[weight for _, weight in combination])
+            targets = {}
+            for component_name in ("text_encoder", "text_encoder_2", "unet"):
+                component = getattr(pipe, component_name, None)
+                if component is None:
+                    continue
+                for module_name, module in component.named_modules():
+                    if hasattr(module, "base_layer") and hasattr(module, "lora_A"):
+                        targets[f"{component_name}.{module_name}.weight"] = module.base_layer.weight
+            for name, parameter in targets.items():
+                if name not in self.original_weights:
+                    self.original_weights[name] = parameter.detach().to("cpu", copy=True)
+            pipe.fuse_lora(adapter_names=adapter_names)
+            return {name: parameter.detach().to("cpu", copy=True) for name, parameter in targets.items()}
+        finally:
+            pipe.unload_lora_weights() # Entfernt nur die Adapter-Schichten, die fusionierten Gewichte bleiben
+
+    def apply(self, pipe, loras):
+        """
+        Stellt die Kombination loras = [(Pfad, Stärke), ...] in den Gewichten der Pipeline her.
+        Rückgabe: "unchanged", "restored" (Originalgewichte), "cached" (aus dem Cache kopiert) oder "fused" (neu fusioniert).
+        """
+        combination = tuple((os.path.abspath(path), float(weight)) for path, weight in loras)
+        with self.lock:
+            if combination == self.current:
+                return "unchanged"
+            self._restore(pipe)
+            if not combination:
+                return "restored"
+
+            # Geänderte Dateien (Größe/Änderungszeit) ergeben einen neuen Schlüssel
+            key = (self.model_key, tuple((path, weight, os.path.getsize(path), int(os.path.getmtime(path))) for path, weight in combination))
+            fused = self.fused_cache.get(key) if self.model_key else None
+            if fused is not None:
+                self.fused_cache.move_to_end(key)
+                with torch.no_grad():
+                    for name, tensor in fused.items():
+                        parameter = self._parameter(pipe, name)
+                        if name not in self.original_weights:
+                            self.original_weights[name] = parameter.detach().to("cpu", copy=True)
+                        parameter.copy_(tensor)
+                self.current = combination
+                self.hits += 1
+                return "cached"
+
+            try:
+                fused = self._fuse(pipe, combination)
+            except Exception:
+                self._restore(pipe) # Teilweise fusionierte Gewichte zurücksetzen
+                raise
+            self.misses += 1
+            self.current = combination
+            if self.model_key:
+                self.fused_cache[key] = fused
+                self.cache_bytes += sum(tensor.numel() * tensor.element_size() for tensor in fused.values())
+                while self.cache_bytes > self.max_bytes and len(self.fused_cache) > 1:
+                    _, evicted = self.fused_cache.popitem(last=False)
+                    self.cache_bytes -= sum(tensor.numel() * tensor.element_size() for tensor in evicted.values())
+            return "fused"
+
+    def summary(self):
+        """Kurzbeschreibung des Caches für die Oberfläche."""
+        with self.lock:
+            return f"LoRA-Cache: {len(self.fused_cache)} Kombination(en), {format_bytes(self.cache_bytes)} | Treffer: {self.hits}, neu fusioniert: {self.misses}"
+
+
+def snap_to_latent_stride(value, stride=LATENT_STRIDE):
+    """Rundet eine Kantenlänge auf das nächste Vielfache der Latent-Schrittweite."""
+    return max(stride, int(round(value / stride)) * stride)
+
+
+def inpaint_crop_box(mask_bbox, image_size, padding=INPAINT_PADDING, max_aspect=INPAINT_MAX_ASPECT):
+    """
+    Ausschnitt (links, oben, rechts, unten) für das Inpainting: die Bounding-Box der Maske plus padding Pixel
+    Kontext, schmale Ausschnitte auf höchstens max_aspect verbreitert, alles auf das Bild begrenzt.
+    """
+    image_width, image_height = image_size
+    left, top, right, bottom = mask_bbox[0] - padding, mask_bbox[1] - padding, mask_bbox[2] + padding, mask_bbox[3] + padding
+    min_side = max(right - left, bottom - top) / max_aspect
+    if right - left < min_side:
+        extra = (min_side - (right - left)) / 2
+        left, right = left - extra, right + extra
+    if bottom - top < min_side:
+        extra = (min_side - (bottom - top)) / 2
+        top, bottom = top - extra, bottom + extra
+    return (max(0, int(left)), max(0, int(top)), min(image_width, int(math.ceil(right))), min(image_height, int(math.ceil(bottom))))
+
+
+def inpaint_working_size(crop_width, crop_height, native_size):
+    """
+    Auflösung, in der der Ausschnitt entrauscht wird: kleine Ausschnitte werden auf die Fläche der nativen
+    Modellauflösung vergrößert, größere bleiben 1:1. Der Aufwand hängt so von der Maske ab, nicht vom Bild.
+    """
+    scale = max(1.0, math.sqrt(native_size * native_size / (crop_width * crop_height)))
+    width = min(MAX_IMAGE_SIDE, max(MIN_IMAGE_SIDE, snap_to_latent_stride(crop_width * scale)))
+    height = min(MAX_IMAGE_SIDE, max(MIN_IMAGE_SIDE, snap_to_latent_stride(crop_height * scale)))
+    return width, height
+
+
+def feather_mask(mask, feather=INPAINT_FEATHER):
+    """Maske mit weichem Rand zum Einsetzen: um feather Pixel ausgedehnt und weichgezeichnet, innen bleibt sie voll deckend."""
+    if feather <= 0:
+        return mask
+    return mask.filter(ImageFilter.MaxFilter(2 * feather + 1)).filter(ImageFilter.GaussianBlur(feather / 2))
+
+
+def downscale_noise(noise, factor):
+    """
+    Verkleinert Startrauschen um factor (Mittelwert über factor x factor Felder) und stellt die Einheitsvarianz
+    wieder her. Die groben Strukturen des Rauschens bleiben erhalten, sodass ein Entwurf in kleiner Auflösung
+    ungefähr die Bildaufteilung des finalen Bildes mit demselben Seed zeigt.
+    """
+    if factor <= 1:
+        return noise
+    size = (max(1, noise.shape[-2] // factor), max(1, noise.shape[-1] // factor))
+    return torch.nn.functional.adaptive_avg_pool2d(noise.float(), size).mul_(factor).to(noise.dtype)
+
+
+def make_image_grid(images, labels=None, columns=DRAFT_GRID_COLUMNS):
+    """Setzt gleich große Bilder zu einem Raster zusammen, optional mit Beschriftung (z.B. Seed) in der Ecke."""
+    columns = max(1, min(columns, len(images)))
+    rows = -(-len(images) // columns)
+    width, height = images[0].size
+    grid = Image.new("RGB", (columns * width, rows * height))
+    draw = ImageDraw.Draw(grid)
+    for index, image in enumerate(images):
+        x, y = (index % columns) * width, (index // columns) * height
+        grid.paste(image, (x, y))
+        if labels:
+            draw.rectangle([x, y, x + 8 + 7 * len(str(labels[index])), y + 16], fill=(0, 0, 0))
+            draw.text((x + 4, y + 2), str(labels[index]), fill=(255, 255, 255))
+    return grid
+
+
+def compute_tile_starts(length, tile_size, overlap):
+    """
+    Berechnet die Startpositionen überlappender Kacheln entlang einer Achse.
+    Die letzte Kachel schließt bündig mit dem Rand ab, sodass die ganze Achse abgedeckt ist.
+    """
+    if length <= tile_size:
+        return [0]
+    stride = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_blend_weights(tile_height, tile_width, device, dtype):
+    """
+    Gauß-förmige Gewichte für eine Kachel: Die Mitte zählt voll, die Ränder weniger.
+    So gehen überlappende Kacheln beim Zusammenführen ohne sichtbare Nähte ineinander über.
+    """
+    def gaussian(length):
+        positions = torch.arange(length, device=device, dtype=torch.float32)
+        center = (length - 1) / 2
+        sigma = length / 4
+        return torch.exp(-((positions - center) ** 2) / (2 * sigma ** 2))
+    weights = gaussian(tile_height)[:, None] * gaussian(tile_width)[None, :]
+    return weights[None, None].to(dtype)
+
+
+def list_upscalers(upscaler_dir=UPSCALER_DIR):
+    """Verfügbare Hochskalierungsverfahren: Lanczos und (mit onnxruntime) die ONNX-Modelle im Upscaler-Ordner."""
+    methods = [UPSCALE_LANCZOS]
+    if ort is not None and os.path.isdir(upscaler_dir):
+        methods += sorted(filename for filename in os.listdir(upscaler_dir) if filename.lower().endswith(".onnx"))
+    return methods
+
+
+class TiledUpscaler:
+    """
+    Vergrößert Bilder kachelweise: Das Bild wird in überlappende Kacheln zerlegt, die ein Thread-Pool
+    vergrößert (Lanczos oder ein ONNX-Super-Resolution-Modell auf der CPU). Die Kacheln werden mit
+    Gauß-Gewichten ohne sichtbare Nähte zusammengeführt. Verarbeitet wird Kachelzeile für Kachelzeile:
+    Float-Puffer gibt es nur für eine Kachelzeile, fertige Bildzeilen wandern sofort ins uint8-Ergebnis.
+    ONNX-Modelle erwarten NCHW float32 im Bereich 0..1; weicht ihr Faktor vom gewünschten ab, wird das
+    Ergebnis jeder Kachel mit Lanczos angeglichen.
+    """
+
+    def __init__(self, method=UPSCALE_LANCZOS, tile_size=UPSCALE_TILE_SIZE, overlap=UPSCALE_TILE_OVERLAP, workers=UPSCALE_WORKERS):
+        self.method = method
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.session = None
+        if method != UPSCALE_LANCZOS:
+            # Parallelisiert wird über die Kacheln, jede Sitzung rechnet dann einfädig
+            self.session = create_onnx_session(os.path.join(UPSCALER_DIR, method), intra_op_threads=1 if workers > 1 else 0)
+            self.input_name = self.session.get_inputs()[0].name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upscale")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _upscale_tile(self, tile, factor):
+        """Vergrößert eine uint8-Kachel (h, w, 3) und gibt sie als float32 (h*factor, w*factor, 3) zurück."""
+        target_size = (tile.shape[1] * factor, tile.shape[0] * factor)
+        if self.session is None:
+            return np.asarray(Image.fromarray(tile).resize(target_size, Image.LANCZOS), dtype=np.float32)
+        model_input = np.ascontiguousarray(tile.transpose(2, 0, 1)[None], dtype=np.float32) / 255
+        output = self.session.run(None, {self.input_name: model_input})[0][0]
+        output = np.clip(output.transpose(1, 2, 0), 0, 1) * 255
+        if output.shape[:2] != (target_size[1], target_size[0]): # Modell mit anderem Faktor
+            output = np.asarray(Image.fromarray(np.rint(output).astype(np.uint8)).resize(target_size, Image.LANCZOS), dtype=np.float32)
+        return output
+
+    def upscale(self, image, factor):
+        """Vergrößert ein PIL-Bild um den ganzzahligen Faktor factor."""
+        source = np.asarray(image.convert("RGB"))
+        height, width = source.shape[:2]
+        tile_height, tile_width = min(self.tile_size, height), min(self.tile_size, width)
+        rows = compute_tile_starts(height, self.tile_size, self.overlap)
+        columns = compute_tile_starts(width, self.tile_size, self.overlap)
+        weights = tile_blend_weights(tile_height * factor, tile_width * factor, "cpu", torch.float32)[0, 0].numpy()[:, :, None]
+
+        result = np.empty((height * factor, width * factor, 3), dtype=np.uint8)
+        accumulated = np.zeros((0, width * factor, 3), dtype=np.float32) # Noch nicht fertige Bildzeilen ab accumulated_top
+        weight_sum = np.zeros((0, width * factor, 1), dtype=np.float32)
+        accumulated_top = 0
+        for row_index, y in enumerate(rows):
+            row_bottom = (y + tile_height) * factor
+            if row_bottom - accumulated_top > accumulated.shape[0]:
+                missing_rows = row_bottom - accumulated_top - accumulated.shape[0]
+                accumulated = np.concatenate([accumulated, np.zeros((missing_rows, width * factor, 3), dtype=np.float32)])
+                weight_sum = np.concatenate([weight_sum, np.zeros((missing_rows, width * factor, 1), dtype=np.float32)])
+
+            tiles = self.executor.map(lambda x: self._upscale_tile(source[y:y + tile_height, x:x + tile_width], factor), columns)
+            top = y * factor - accumulated_top
+            for x, upscaled_tile in zip(columns, tiles):
+                left = x * factor
+                accumulated[top:top + tile_height * factor, left:left + tile_width * factor] += upscaled_tile * weights
+                weight_sum[top:top + tile_height * factor, left:left + tile_width * factor] += weights
+
+            # Zeilen oberhalb der nächsten Kachelzeile sind fertig
+            finished = (rows[row_index + 1] if row_index + 1 < len(rows) else height) * factor - accumulated_top
+            result[accumulated_top:accumulated_top + finished] = np.clip(np.rint(accumulated[:finished] / weight_sum[:finished]), 0, 255)
+            accumulated, weight_sum = accumulated[finished:], weight_sum[finished:]
+            accumulated_top += finished
+        return Image.fromarray(result)
+
+
+def format_memory_info(memory_info):
+    """Formatiert das Ergebnis von get_process_memory_info für Statusmeldungen."""
+    if not memory_info:
+        return "Speicher: unbekannt (psutil nicht installiert)"
+    text = f"Speicher: {format_bytes(memory_info['rss'])} resident"
+    if memory_info.get("private") is not None:
+        text += f" | privat {format_bytes(memory_info['private'])}"
+    if memory_info.get("shared") is not None:
+        text += f" | geteilt {format_bytes(memory_info['shared'])}"
+    return text
+
+
+class ImageArchive:
+    """
+    Persistentes, indiziertes Archiv aller Generierungen auf Basis von SQLite.
+    Prompt und negativer Prompt liegen in einem FTS5-Volltextindex (invertierter Index),
+    Seed, Modell, Scheduler, Größe und Datum sind als normale Indizes filterbar.
+    """
+    FILTER_KEYS = ("seed", "model", "scheduler", "size", "date")
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock() # Die Verbindung wird vom GUI- und von Worker-Threads genutzt
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL") # Schnelle Einfügungen ohne Leser zu blockieren
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.has_fts = True
+        self._create_schema()
+
+    def _create_schema(self):
+        """Legt Tabellen, Indizes und den Volltextindex an (falls noch nicht vorhanden)."""
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY,
+                    filename TEXT UNIQUE,
+                    filepath TEXT,
+                    prompt TEXT,
+                    negative_prompt TEXT,
+                    seed INTEGER,
+                    model TEXT,
+                    scheduler TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    steps INTEGER,
+                    cfg REAL,
+                    timestamp TEXT,
+                    metadata TEXT
+                )""")
+            for column in ("seed", "model", "scheduler", "width, height", "timestamp"):
+                index_name = "idx_images_" + column.replace(", ", "_")
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON images ({column})")
+            try:
+                self.connection.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                        prompt, negative_prompt, content='images', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )""")
+                # Trigger halten den Volltextindex synchron zur Tabelle
+                self.connection.execute("""
+                    CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+                        INSERT INTO images_fts(rowid, prompt, negative_prompt) VALUES (new.id, new.prompt, new.negative_prompt);
+                    END""")
+                self.connection.execute("""
+                    CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+                        INSERT INTO images_fts(images_fts, rowid, prompt, negative_prompt) VALUES ('delete', old.id, old.prompt, old.negative_prompt);
+                    END""")
+                has_update_trigger = self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'images_fts_update'").fetchone() is not None
+                self.connection.execute("""
+                    CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN
+                        INSERT INTO images_fts(images_fts, rowid, prompt, negative_prompt) VALUES ('delete', old.id, old.prompt, old.negative_prompt);
+                        INSERT INTO images_fts(rowid, prompt, negative_prompt) VALUES (new.id, new.prompt, new.negative_prompt);
+                    END""")
+                if not has_update_trigger:
+                    # Ältere Archive ersetzten Einträge per INSERT OR REPLACE, dabei blieben veraltete Indexeinträge zurück
+                    self.connection.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError as e:
+                # SQLite ohne FTS5: Suche funktioniert weiter, aber ohne Index (LIKE)
+                self.has_fts = False
+                print(f"WARNUNG: FTS5 nicht verfügbar, Prompt-Suche ohne Volltextindex: {e}")
+
+    def count(self):
+        """Anzahl der archivierten Bilder."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def add(self, filename, entry):
+        """Fügt eine Generierung (Metadaten-Eintrag wie in METADATA_FILE) zum Archiv hinzu."""
+        with self.lock, self.connection:
+            # Upsert statt INSERT OR REPLACE: das implizite Löschen von REPLACE löst den Lösch-Trigger nicht aus
+            self.connection.execute(
+                """INSERT INTO images
+                   (filename, filepath, prompt, negative_prompt, seed, model, scheduler, width, height, steps, cfg, timestamp, metadata)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(filename) DO UPDATE SET
+                       filepath = excluded.filepath, prompt = excluded.prompt, negative_prompt = excluded.negative_prompt,
+                       seed = excluded.seed, model = excluded.model, scheduler = excluded.scheduler, width = excluded.width,
+                       height = excluded.height, steps = excluded.steps, cfg = excluded.cfg, timestamp = excluded.timestamp,
+                       metadata = excluded.metadata""",
+                (
+                    filename,
+                    entry.get("filepath"),
+                    entry.get("prompt", ""),
+                    entry.get("negative_prompt", ""),
+                    entry.get("seed"),
+                    entry.get("model"),
+                    entry.get("scheduler"),
+                    entry.get("width"),
+                    entry.get("height"),
+                    entry.get("steps"),
+                    entry.get("cfg"),
+                    entry.get("timestamp"),
+                    json.dumps(entry, ensure_ascii=False),
+                ),
+            )
+
+    def import_metadata_file(self, metadata_file):
+        """Übernimmt Einträge aus der JSON-Metadatendatei früherer Versionen (einmalig beim Anlegen des Archivs)."""
+        if not os.path.exists(metadata_file):
+            return 0
+        try:
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return 0
+        entries = sorted(metadata.items(), key=lambda item: item[1].get("timestamp", "")) # Älteste zuerst, damit die IDs chronologisch sind
+        for filename, entry in entries:
+            if "prompt" in entry and "filepath" in entry:
+                self.add(filename, entry)
+        return len(entries)
+
+    def remove(self, filename):
+        """Entfernt ein Bild aus dem Archiv."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM images WHERE filename = ?", (filename,))
+
+    def clear(self):
+        """Leert das Archiv vollständig."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM images")
+            if self.has_fts:
+                self.connection.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+
+    @staticmethod
+    def parse_query(query):
+        """
+        Zerlegt eine Suchanfrage in Freitext und Filter.
+        Beispiel: 'katze mond seed:42 model:sdxl_base scheduler:"DPM++ 2M" size:1024x1024 date:2026-10'
+        Für das Datum ist auch ein Bereich möglich: date:2026-10-01..2026-10-19
+        """
+        try:
+            tokens = shlex.split(query)
+        except ValueError: # Unvollständige Anführungszeichen
+            tokens = query.split()
+        words, filters = [], {}
+        for token in tokens:
+            key, separator, value = token.partition(":")
+            if separator and key.lower() in ImageArchive.FILTER_KEYS and value:
+                filters[key.lower()] = value
+            else:
+                words.append(token)
+        return words, filters
+
+    def search(self, query="", limit=ARCHIVE_SEARCH_LIMIT):
+        """Durchsucht das Archiv und gibt die neuesten passenden Einträge als Liste von Dicts zurück."""
+        words, filters = self.parse_query(query)
+        sql = "SELECT images.* FROM images"
+        conditions, params = [], []
+
+        if words:
+            if self.has_fts:
+                sql += " JOIN images_fts ON images_fts.rowid = images.id"
+                # Jedes Wort als Präfix-Suche, alle Wörter müssen vorkommen
+                conditions.append("images_fts MATCH ?")
+                params.append(" ".join('"' + word.replace('"', '""') + '"*' for word in words))
+            else:
+                for word in words:
+                    conditions.append("(images.prompt LIKE ? OR images.negative_prompt LIKE ?)")
+                    params.extend([f"%{word}%", f"%{word}%"])
+
+        if filters.get("seed", "").lstrip("-").isdigit():
+            conditions.append("images.seed = ?")
+            params.append(int(filters["seed"]))
+        if "model" in filters:
+            conditions.append("images.model LIKE ?")
+            params.append(filters["model"] + "%")
+        if "scheduler" in filters:
+            conditions.append("images.scheduler = ?")
+            params.append(filters["scheduler"])
+        if "size" in filters:
+            width, _, height = filters["size"].lower().partition("x")
+            if width.isdigit() and height.isdigit():
+                conditions.append("images.width = ? AND images.height = ?")
+                params.extend([int(width), int(height)])
+        if "date" in filters:
+            date_from, separator, date_to = filters["date"].partition("..")
+            if separator:
+                # Bereich inklusive Enddatum (Zeitstempel sind 'YYYY-MM-DD HH:MM:SS')
+                conditions.append("images.timestamp >= ? AND images.timestamp < ?")
+                params.extend([date_from, date_to + "\uffff"])
+            else:
+                conditions.append("images.timestamp LIKE ?")
+                params.append(date_from + "%")
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY images.id DESC LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            try:
+                rows = self.connection.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                print(f"FEHLER: Ungültige Suchanfrage '{query}': {e}")
+                return []
+        return [dict(row) for row in rows]
+
+    def recent_prompts(self, limit=10):
+        """Die zuletzt verwendeten, unterschiedlichen Prompt-Kombinationen (neueste zuerst)."""
+        with self.lock:
+            rows = self.connection.execute(
+                """SELECT prompt, negative_prompt, MAX(id) AS last_id FROM images
+                   GROUP BY prompt, negative_prompt ORDER BY last_id DESC LIMIT ?""",
+                (limit,),
+            ).fetchall()
+        return [{"prompt": row["prompt"], "negative_prompt": row["negative_prompt"] or ""} for row in rows]
+
+
+def generation_spec_key(spec):
+    """Kanonischer SHA-256 einer Generierungsspezifikation (sortierte Schlüssel, feste Trennzeichen)."""
+    canonical = json.dumps(dict(spec, cache_version=RESULT_CACHE_VERSION), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ShardWriter:
+    """
+    Schreibt Bilder mit Metadaten fortlaufend in Tar-Shards im WebDataset-Layout: pro Beispiel
+    <schlüssel>.png, <schlüssel>.json (Generierungsparameter) und <schlüssel>.txt (Prompt).
+    Ein Shard wird abgeschlossen, sobald er max_samples Beispiele oder max_bytes erreicht.
+    Zu jedem Shard gehört eine Indexdatei (JSON Lines: Schlüssel, Offset, Größe), die erst nach den Daten
+    geschrieben wird. Beim Öffnen wird der letzte Shard anhand seines Index fortgesetzt; ein nach einem
+    Absturz unvollständig geschriebenes Beispiel wird dabei abgeschnitten. Fehlt der Index (z.B. nach dem
+    Kopieren), wird er aus den Tar-Einträgen neu aufgebaut.
+    """
+
+    def __init__(self, output_dir=SHARD_DIR, max_samples=SHARD_MAX_SAMPLES, max_bytes=SHARD_MAX_BYTES):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.tar_file = None
+        self.index_file = None
+        self.samples = 0
+        self.bytes = 0
+        shard_numbers = [int(name[6:-4]) for name in os.listdir(output_dir)
+                         if name.startswith("shard-") and name.endswith(".tar") and name[6:-4].isdigit()]
+        self.shard_number = max(shard_numbers) if shard_numbers else 0 # Der letzte Shard wird fortgesetzt
+
+    def _paths(self):
+        base = os.path.join(self.output_dir, f"shard-{self.shard_number:06d}")
+        return base + ".tar", base + ".idx"
+
+    @staticmethod
+    def _rebuild_index(tar_path):
+        """
+        Indexeinträge aus den Tar-Einträgen eines Shards ohne Indexdatei. Ein Beispiel zählt nur, wenn sein
+        letzter Eintrag (.txt) vollständig in der Datei liegt.
+        """
+        entries = []
+        file_size = os.path.getsize(tar_path)
+        start_offsets = {}
+        try:
+            with tarfile.open(tar_path, "r:") as tar:
+                for member in tar:
+                    key, _, extension = member.name.partition(".")
+                    start_offsets.setdefault(key, member.offset)
+                    end_offset = member.offset_data + member.size + (-member.size % tarfile.BLOCKSIZE)
+                    if extension == "txt" and end_offset <= file_size:
+                        entries.append({"key": key, "offset": start_offsets[key], "size": end_offset - start_offsets[key]})
+        except (tarfile.TarError, OSError) as e:
+            print(f"DEBUG: Shard {os.path.basename(tar_path)} nur teilweise lesbar ({e}), Index bis dahin übernommen.")
+        return entries
+
+    def _open_shard(self):
+        """Öffnet den aktuellen Shard zum Anhängen (bzw. legt ihn an) und setzt ihn auf den letzten Indexeintrag zurück."""
+        while True:
+            tar_path, index_path = self._paths()
+            entries = []
+            if os.path.exists(tar_path) and not os.path.exists(index_path):
+                entries = self._rebuild_index(tar_path)
+                if not entries and os.path.getsize(tar_path) > 0: # Nichts lesbar: Datei unangetastet lassen
+                    print(f"DEBUG: {os.path.basename(tar_path)} ohne Index und ohne lesbare Beispiele, beginne neuen Shard.")
+                    self.shard_number += 1
+                    continue
+                print(f"DEBUG: Index für {os.path.basename(tar_path)} fehlte, aus {len(entries)} Beispielen neu aufgebaut.")
+            elif os.path.exists(index_path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entries.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            break # Unvollständige letzte Zeile nach einem Absturz
+                # Nur Beispiele behalten, die vollständig im Tar liegen; fehlt der Tar, ist der Index veraltet
+                tar_size = os.path.getsize(tar_path) if os.path.exists(tar_path) else 0
+                index_count = len(entries)
+                while entries and entries[-1]["offset"] + entries[-1]["size"] > tar_size:
+                    entries.pop()
+                if len(entries) < index_count:
+                    print(f"DEBUG: {index_count - len(entries)} Indexeinträge von {os.path.basename(tar_path)} ohne Daten verworfen.")
+            end_offset = entries[-1]["offset"] + entries[-1]["size"] if entries else 0
+            if len(entries) < self.max_samples and end_offset < self.max_bytes:
+                break
+            self.shard_number += 1 # Letzter Shard ist voll
+
+        self.tar_file = open(tar_path, "r+b" if os.path.exists(tar_path) else "wb")
+        self.tar_file.truncate(end_offset) # Entfernt Tar-Endmarkierung und unvollständige Beispiele
+        self.tar_file.seek(end_offset)
+        with open(index_path, "w", encoding="utf-8") as f: # Nur gültige Einträge behalten
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        self.index_file = open(index_path, "a", encoding="utf-8")
+        self.samples = len(entries)
+        self.bytes = end_offset
+        if entries:
+            print(f"DEBUG: Shard {os.path.basename(tar_path)} wird fortgesetzt ({self.samples} Beispiele, {format_bytes(self.bytes)}).")
+
+    def _close_shard(self):
+        if self.tar_file is None:
+            return
+        self.tar_file.write(b"\0" * (2 * tarfile.BLOCKSIZE)) # Tar-Endmarkierung
+        self.tar_file.close()
+        self.index_file.close()
+        self.tar_file = None
+        self.index_file = None
+
+    @staticmethod
+    def _member(name, data, mtime):
+        """Ein Tar-Eintrag (Header, Daten, Auffüllung auf 512 Bytes) als Bytes."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.USTAR_FORMAT) + data + b"\0" * (-len(data) % tarfile.BLOCKSIZE)
+
+    def add(self, image, metadata):
+        """Hängt ein Beispiel an und gibt (Shard-Dateiname, Schlüssel) zurück. Thread-sicher."""
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG") # Kodieren außerhalb der Sperre
+        metadata_bytes = json.dumps(metadata, ensure_ascii=False, indent=1).encode("utf-8")
+        prompt_bytes = (metadata.get("prompt") or "").encode("utf-8")
+        mtime = int(time.time())
+        with self.lock:
+            if self.tar_file is None:
+                self._open_shard()
+            key = f"{self.shard_number:06d}_{self.samples:06d}" # WebDataset-Schlüssel: ohne Punkte, eindeutig
+            record = (self._member(f"{key}.png", buffer.getvalue(), mtime)
+                      + self._member(f"{key}.json", metadata_bytes, mtime)
+                      + self._member(f"{key}.txt", prompt_bytes, mtime))
+            self.tar_file.write(record)
+            self.tar_file.flush()
+            # Index erst nach den Daten schreiben: er zeigt nie auf unvollständige Beispiele
+            self.index_file.write(json.dumps({"key": key, "offset": self.bytes, "size": len(record)}) + "\n")
+            self.index_file.flush()
+            self.samples += 1
+            self.bytes += len(record)
+            shard_name = os.path.basename(self._paths()[0])
+            if self.samples >= self.max_samples or self.bytes >= self.max_bytes:
+                self._close_shard()
+                self.shard_number += 1
+        return shard_name, key
+
+    def close(self):
+        """Schließt den offenen Shard (mit Tar-Endmarkierung). Weitere Beispiele setzen ihn später fort."""
+        with self.lock:
+            self._close_shard()
+
+    def describe(self):
+        """Kurzbeschreibung des aktuellen Shards für die Oberfläche."""
+        with self.lock:
+            return f"Shards in '{self.output_dir}': aktuell shard-{self.shard_number:06d}.tar, {self.samples} Beispiele, {format_bytes(self.bytes)}"
+
+
+class ResultCache:
+    """
+    Inhaltsadressierter Ergebnis-Cache: Hash der vollständigen Generierungsspezifikation -> Bild in IMAGE_DIR.
+    Die Bilder selbst bleiben in der Galerie; verworfen werden nur die Cache-Einträge (LRU nach Anzahl).
+    Gleichzeitig laufende identische Anfragen werden zusammengeführt (nur eine generiert, die anderen warten).
+    """
+
+    def __init__(self, db_path, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    filename TEXT,
+                    filepath TEXT,
+                    spec TEXT,
+                    created REAL,
+                    last_used REAL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used)")
+        self.inflight = {} # Schlüssel -> threading.Event der gerade laufenden Generierung
+        self.inflight_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self):
+        """Anzahl der Cache-Einträge."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def lookup(self, key):
+        """Gibt den Bildpfad zu einem Schlüssel zurück (oder None). Einträge mit fehlender Datei werden entfernt."""
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT filepath FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not row[0] or not os.path.exists(row[0]):
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def acquire(self, key, stop_event=None):
+        """
+        Liefert (Bildpfad, False) bei einem Treffer, sonst (None, True): Der Aufrufer generiert selbst und
+        muss danach release() aufrufen. Läuft dieselbe Generierung bereits, wird auf deren Ergebnis gewartet.
+        Wird stop_event während des Wartens gesetzt, kommt (None, False) zurück.
+        """
+        while True:
+            filepath = self.lookup(key)
+            if filepath:
+                self.hits += 1
+                return filepath, False
+            with self.inflight_lock:
+                event = self.inflight.get(key)
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    self.misses += 1
+                    return None, True
+            print(f"DEBUG: Identische Generierung läuft bereits ({key[:12]}), warte auf deren Ergebnis.")
+            while not event.wait(0.2):
+                if stop_event is not None and stop_event.is_set():
+                    return None, False
+            # Danach erneut nachsehen: Ist die andere Generierung fehlgeschlagen, übernimmt dieser Aufrufer
+
+    def release(self, key):
+        """Gibt eine mit acquire() übernommene Generierung frei und weckt wartende identische Anfragen."""
+        with self.inflight_lock:
+            event = self.inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def store(self, key, spec, filename, filepath):
+        """Legt ein Ergebnis ab und verwirft bei Bedarf die am längsten nicht genutzten Einträge."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, filename, filepath, spec, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, filename, filepath, json.dumps(spec, ensure_ascii=False, sort_keys=True), now, now),
+            )
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        """Leert den Cache (die Bilder selbst bleiben erhalten)."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM results")
+        self.hits = 0
+        self.misses = 0
+
 
 class ImageGeneratorApp(ctk.CTk):
     """
     Hauptanwendungsklasse für den KI-Bildgenerator mit lokaler Stable Diffusion.
     """
-    def __init__(self, force_cpu=False): # Neu: force_cpu Parameter
+    def __init__(self, force_cpu=False, profile_schedule=None): # Neu: force_cpu Parameter
         super().__init__()
 
         # Neu: CPU-Modus erzwingen und Gerät festlegen
@@ -85,6 +2303,41 @@ class ImageGeneratorApp(ctk.CTk):
             # Programm könnte hier beendet werden, wenn das Verzeichnis unerlässlich ist
             # self.destroy() 
 
+        # Öffnet (oder erstellt) das indizierte Bildarchiv
+        self.image_archive = None
+        try:
+            archive_is_new = not os.path.exists(ARCHIVE_DB_FILE)
+            self.image_archive = ImageArchive(ARCHIVE_DB_FILE)
+            if archive_is_new and os.path.exists(METADATA_FILE):
+                # Einmalige Übernahme aus der JSON-Datei früherer Versionen. Danach ist das Archiv die einzige Quelle;
+                # die Datei wird umbenannt, damit ein später neu angelegtes Archiv keinen veralteten Stand übernimmt.
+                imported = self.image_archive.import_metadata_file(METADATA_FILE)
+                print(f"DEBUG: Bildarchiv erstellt, {imported} vorhandene Einträge übernommen.")
+                try:
+                    os.replace(METADATA_FILE, METADATA_FILE + ".importiert")
+                except OSError as e:
+                    print(f"FEHLER: Konnte {METADATA_FILE} nach der Übernahme nicht umbenennen: {e}")
+        except sqlite3.Error as e:
+            messagebox.showerror("Fehler beim Öffnen des Bildarchivs", f"Das Bildarchiv konnte nicht geöffnet werden: {ARCHIVE_DB_FILE}\nSuche und Galerie sind nicht verfügbar.\nFehler: {e}")
+            print(f"ERROR: Fehler beim Öffnen des Bildarchivs: {e}")
+
+        # Fusionierte LoRA-Kombinationen (Originalgewichte und LRU-Cache)
+        self.lora_manager = LoraManager()
+        # Rauschen, Kachel- und Dekodierpuffer, die über die Bilder eines Durchlaufs wiederverwendet werden
+        self.tensor_pool = TensorPool()
+        # Auftrags-Warteschlange: kompatible Aufträge werden zu einem UNet-Stapel zusammengefasst
+        self.job_queue = []
+        self.job_queue_condition = threading.Condition()
+        self.job_queue_thread = None
+        self.job_batch_limits = (int(JOB_BATCH_DEFAULT_SIZE), float(JOB_BATCH_DEFAULT_WAIT)) # Beim Einreihen aus der Oberfläche übernommen
+
+        # Ergebnis-Cache für wiederholte, identische Generierungen
+        self.result_cache = None
+        try:
+            self.result_cache = ResultCache(RESULT_CACHE_FILE)
+        except (sqlite3.Error, OSError) as e:
+            print(f"ERROR: Ergebnis-Cache konnte nicht geöffnet werden, Generierung ohne Cache: {e}")
+
         # Stellt sicher, dass der Modelle-Ordner existiert
         try:
             os.makedirs(MODELS_DIR, exist_ok=True)
@@ -93,14 +2346,28 @@ class ImageGeneratorApp(ctk.CTk):
             messagebox.showerror("Fehler beim Erstellen des Modelle-Verzeichnisses", f"Konnte das Modelle-Verzeichnis nicht erstellen: {MODELS_DIR}\nBitte überprüfen Sie die Berechtigungen oder wählen Sie einen anderen Speicherort.\nFehler: {e}")
             print(f"ERROR: Fehler beim Erstellen des Modelle-Verzeichnisses: {e}")
 
+        # LoRA-Verzeichnis (z.B. LCM-LoRAs für den Few-Step-Modus)
+        try:
+            os.makedirs(LORA_DIR, exist_ok=True)
+        except OSError as e:
+            print(f"ERROR: Fehler beim Erstellen des LoRA-Verzeichnisses: {e}")
+
+        # Verzeichnis für optionale Super-Resolution-Modelle (ONNX)
+        try:
+            os.makedirs(UPSCALER_DIR, exist_ok=True)
+        except OSError as e:
+            print(f"ERROR: Fehler beim Erstellen des Upscaler-Verzeichnisses: {e}")
+
 
         # Konfiguriert das Gitter für das Hauptfenster
         self.grid_columnconfigure(0, weight=0) # Linke Spalte (fest/weniger Gewicht)
         self.grid_columnconfigure(1, weight=1) # Rechte Spalte (nimmt den Rest des Platzes ein)
         self.grid_rowconfigure(0, weight=1) # Nur eine Zeile für den Hauptinhalt
 
-        # Prompt-Verlauf (z.B. die letzten 10 Prompts)
+        # Prompt-Verlauf (z.B. die letzten 10 Prompts), wird aus dem Bildarchiv gefüllt
         self.prompt_history = deque(maxlen=10)
+        self.prompt_search_results = [] # Aktuelle Treffer der Prompt-Suche
+        self.prompt_search_after_id = None # Für die verzögerte Suche beim Tippen
         # _load_prompt_history wird jetzt später aufgerufen, nachdem das Widget erstellt wurde.
 
         # Event, um den Generierungs-Thread zu stoppen
@@ -139,9 +2406,9 @@ class ImageGeneratorApp(ctk.CTk):
         self.quantization_checkbox.grid(row=3, column=0, padx=20, pady=(5, 15), sticky="w")
         self.quantization_info_label = ctk.CTkLabel(self.left_panel, text="(Reduziert VRAM, macht langsamer)", font=ctk.CTkFont(size=10), text_color="gray")
         self.quantization_info_label.grid(row=3, column=0, padx=(220, 0), pady=(5, 15), sticky="w")
-        if not torch.cuda.is_available() or self.force_cpu: # Deaktivieren, wenn keine GPU oder CPU-Modus erzwungen
-            self.quantization_checkbox.configure(state="disabled")
-            self.quantization_info_label.configure(text="(Nur für NVIDIA GPUs verfügbar)")
+        if not torch.cuda.is_available() or self.force_cpu: # Auf der CPU: dynamische int8-Quantisierung statt bitsandbytes
+            self.quantization_checkbox.configure(text="8-Bit-Quantisierung aktivieren (CPU: int8)")
+            self.quantization_info_label.configure(text="(Kleiner und schneller auf der CPU)")
 
 
         self.prompt_label = ctk.CTkLabel(self.left_panel, text="Bildbeschreibung (Prompt):", font=ctk.CTkFont(size=16, weight="bold"))
@@ -167,11 +2434,13 @@ class ImageGeneratorApp(ctk.CTk):
         self.generate_button.grid(row=8, column=1, padx=(0, 20), pady=(0, 15), sticky="e")
         self.generate_button.configure(state="disabled")
 
-        # Prompt-Verlauf Dropdown
-        self.prompt_history_label = ctk.CTkLabel(self.left_panel, text="Prompt-Verlauf:", font=ctk.CTkFont(size=14))
-        self.prompt_history_label.grid(row=9, column=0, padx=20, pady=(0, 5), sticky="w")
-        self.prompt_history_optionmenu = ctk.CTkOptionMenu(self.left_panel, values=["Kein Verlauf"], command=self._load_prompt_from_history, corner_radius=8)
-        self.prompt_history_optionmenu.grid(row=10, column=0, columnspan=2, padx=20, pady=(0, 15), sticky="ew")
+        # Prompt-Verlauf als Suchfeld über das Bildarchiv
+        self.prompt_history_label = ctk.CTkLabel(self.left_panel, text="Prompt-Verlauf / Suche (z.B. katze seed:42 size:512x512 date:2026-10):", font=ctk.CTkFont(size=14))
+        self.prompt_history_label.grid(row=9, column=0, columnspan=2, padx=20, pady=(0, 5), sticky="w")
+        self.prompt_history_combobox = ctk.CTkComboBox(self.left_panel, values=["Kein Verlauf"], command=self._load_prompt_from_history, corner_radius=8)
+        self.prompt_history_combobox.grid(row=10, column=0, columnspan=2, padx=20, pady=(0, 15), sticky="ew")
+        self.prompt_history_combobox.bind("<Return>", lambda event: self._search_prompt_history())
+        self.prompt_history_combobox.bind("<KeyRelease>", self._schedule_prompt_search)
         self._load_prompt_history() # HIERHER VERSCHOBEN
 
 
@@ -249,7 +2518,10 @@ class ImageGeneratorApp(ctk.CTk):
             "KDPM2",
             "KDPM2 Ancestral",
             "DEIS",
-            "UniPC"
+            "UniPC",
+            "LCM",
+            "Euler Trailing",
+            "Euler Ancestral Trailing"
         ]
         self.scheduler_map = { # Mapping von Namen zu Scheduler-Klassen
             "Euler": EulerDiscreteScheduler,
@@ -268,6 +2540,9 @@ class ImageGeneratorApp(ctk.CTk):
             "KDPM2 Ancestral": KDPM2AncestralDiscreteScheduler,
             "DEIS": DEISMultistepScheduler,
             "UniPC": UniPCMultistepScheduler,
+            "LCM": LCMScheduler, # Für LCM-Modelle und LCM-LoRAs
+            "Euler Trailing": EulerDiscreteScheduler, # Für Lightning/Hyper-Modelle
+            "Euler Ancestral Trailing": EulerAncestralDiscreteScheduler, # Für Turbo-Modelle
         }
         self.scheduler_label = ctk.CTkLabel(self.settings_frame, text="Scheduler:", font=ctk.CTkFont(size=13))
         self.scheduler_label.grid(row=5, column=2, padx=(15, 5), pady=(5, 0), sticky="w")
@@ -299,12 +2574,214 @@ class ImageGeneratorApp(ctk.CTk):
         self.num_images_entry.insert(0, "1")
         self.num_images_entry.configure(state="disabled")
 
+        # --- Gekachelte Generierung für sehr große Bildgrößen ---
+        self.tiled_checkbox = ctk.CTkCheckBox(self.settings_frame, text="Gekachelt generieren (große Bilder, begrenzter Speicher)", font=ctk.CTkFont(size=13))
+        self.tiled_checkbox.grid(row=9, column=0, columnspan=4, padx=15, pady=(0, 5), sticky="w")
+        self.tiled_checkbox.configure(state="disabled")
+
+        # --- Feature-Cache über Entrauschungsschritte (DeepCache), pro Generierung umschaltbar ---
+        self.deep_cache_checkbox = ctk.CTkCheckBox(self.settings_frame, text="Feature-Cache (DeepCache), voll alle", font=ctk.CTkFont(size=13))
+        self.deep_cache_checkbox.grid(row=10, column=0, columnspan=2, padx=15, pady=(0, 15), sticky="w")
+        self.deep_cache_checkbox.configure(state="disabled")
+        self.deep_cache_interval_optionmenu = ctk.CTkOptionMenu(self.settings_frame, values=DEEP_CACHE_INTERVALS, width=70, corner_radius=8)
+        self.deep_cache_interval_optionmenu.grid(row=10, column=2, padx=(15, 5), pady=(0, 15), sticky="w")
+        self.deep_cache_interval_optionmenu.set(DEEP_CACHE_DEFAULT_INTERVAL)
+        self.deep_cache_interval_optionmenu.configure(state="disabled")
+        self.deep_cache_steps_label = ctk.CTkLabel(self.settings_frame, text="Schritte", font=ctk.CTkFont(size=13))
+        self.deep_cache_steps_label.grid(row=10, column=3, padx=(0, 15), pady=(0, 15), sticky="w")
+
+        # --- Few-Step-Modus (LCM/Turbo): 1-8 Schritte mit passendem Scheduler ---
+        self.few_step_checkbox = ctk.CTkCheckBox(self.settings_frame, text="Wenige Schritte (LCM/Turbo)", command=self._toggle_few_step_mode, font=ctk.CTkFont(size=13))
+        self.few_step_checkbox.grid(row=11, column=0, columnspan=4, padx=15, pady=(0, 15), sticky="w")
+        self.few_step_checkbox.configure(state="disabled")
+
+        # --- CFG-Abschneiden: Guidance nur in den ersten Schritten, danach halbe UNet-Kosten ---
+        self.cfg_truncation_checkbox = ctk.CTkCheckBox(self.settings_frame, text="CFG nur in den ersten", font=ctk.CTkFont(size=13))
+        self.cfg_truncation_checkbox.grid(row=12, column=0, columnspan=2, padx=15, pady=(0, 15), sticky="w")
+        self.cfg_truncation_checkbox.configure(state="disabled")
+        self.cfg_truncation_optionmenu = ctk.CTkOptionMenu(self.settings_frame, values=CFG_TRUNCATION_PERCENTAGES, width=70, corner_radius=8)
+        self.cfg_truncation_optionmenu.grid(row=12, column=2, padx=(15, 5), pady=(0, 15), sticky="w")
+        self.cfg_truncation_optionmenu.set(CFG_TRUNCATION_DEFAULT)
+        self.cfg_truncation_optionmenu.configure(state="disabled")
+        self.cfg_truncation_label = ctk.CTkLabel(self.settings_frame, text="% der Schritte", font=ctk.CTkFont(size=13))
+        self.cfg_truncation_label.grid(row=12, column=3, padx=(0, 15), pady=(0, 15), sticky="w")
+
+        # --- Profiling (torch.profiler): Trace und Operator-Tabelle neben dem Bild bzw. Shard (Entrauschen und Dekodieren getrennt) ---
+        self.profile_skip_steps = PROFILE_SKIP_STEPS
+        self.profile_checkbox = ctk.CTkCheckBox(self.settings_frame, text="Profiling, aufzeichnen:", font=ctk.CTkFont(size=13))
+        self.profile_checkbox.grid(row=13, column=0, columnspan=2, padx=15, pady=(0, 15), sticky="w")
+        self.profile_optionmenu = ctk.CTkOptionMenu(self.settings_frame, values=PROFILE_RECORD_STEPS, width=70, corner_radius=8)
+        self.profile_optionmenu.grid(row=13, column=2, padx=(15, 5), pady=(0, 15), sticky="w")
+        self.profile_optionmenu.set(PROFILE_RECORD_DEFAULT)
+        self.profile_label = ctk.CTkLabel(self.settings_frame, text="Schritte", font=ctk.CTkFont(size=13))
+        self.profile_label.grid(row=13, column=3, padx=(0, 15), pady=(0, 15), sticky="w")
+        if profile_schedule:
+            # Per Kommandozeile (/profile bzw. /profile=ÜBERSPRINGEN:AUFZEICHNEN) vorausgewählt
+            self.profile_skip_steps, record_steps = profile_schedule
+            if str(record_steps) not in PROFILE_RECORD_STEPS:
+                self.profile_optionmenu.configure(values=sorted(PROFILE_RECORD_STEPS + [str(record_steps)], key=int))
+            self.profile_optionmenu.set(str(record_steps))
+            self.profile_checkbox.select()
+        self.profile_checkbox.configure(state="disabled")
+        self.profile_optionmenu.configure(state="disabled")
+
         # --- Live-Vorschau (entfernt, da es Generierung stark verlangsamt) ---
         # self.live_preview_checkbox = ctk.CTkCheckBox(self.settings_frame, text="Live-Vorschau anzeigen (verlangsamt Generierung)", font=ctk.CTkFont(size=13))
         # self.live_preview_checkbox.grid(row=9, column=0, columnspan=4, padx=15, pady=(5, 15), sticky="w")
         # self.live_preview_checkbox.configure(state="disabled")
 
 
+        # --- Erweiterte Optionen (scrollbar, nimmt den restlichen Platz im linken Panel ein) ---
+        self.advanced_frame = ctk.CTkScrollableFrame(self.left_panel, corner_radius=12, label_text="Erweiterte Optionen")
+        self.advanced_frame.grid(row=12, column=0, columnspan=2, padx=20, pady=(0, 20), sticky="nsew")
+        self.advanced_frame.grid_columnconfigure(0, weight=1)
+
+        # Cache für konvertierte Modelle
+        self.model_cache_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Konvertierte Modelle zwischenspeichern (schnelleres Laden)", font=ctk.CTkFont(size=13))
+        self.model_cache_checkbox.grid(row=0, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.model_cache_checkbox.select() # Standardmäßig aktiv
+        self.cache_info_label = ctk.CTkLabel(self.advanced_frame, text="Modell-Cache: 0.0 MB", font=ctk.CTkFont(size=10), text_color="gray")
+        self.cache_info_label.grid(row=1, column=0, padx=10, pady=(0, 5), sticky="w")
+        self.clear_cache_button = ctk.CTkButton(self.advanced_frame, text="Cache leeren", command=self._confirm_clear_model_cache, width=110, height=28, corner_radius=8)
+        self.clear_cache_button.grid(row=1, column=1, padx=10, pady=(0, 5), sticky="e")
+
+        # Geteilte, speicherabgebildete Gewichte für mehrere Generierungsprozesse auf einem Rechner
+        self.shared_weights_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Gewichte prozessübergreifend teilen (mmap, nur CPU)", font=ctk.CTkFont(size=13))
+        self.shared_weights_checkbox.grid(row=2, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        if self.device != "cpu": # Auf der GPU liegen die Gewichte ohnehin nicht im Hauptspeicher
+            self.shared_weights_checkbox.configure(state="disabled")
+        self.memory_info_label = ctk.CTkLabel(self.advanced_frame, text=format_memory_info(get_process_memory_info()), font=ctk.CTkFont(size=10), text_color="gray")
+        self.memory_info_label.grid(row=3, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+        # Ergebnis-Cache: identische Generierungen (Prompt, Seed, Größe, Schritte, CFG, Scheduler, Modell) nicht erneut rechnen
+        self.result_cache_bypass_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Ergebnis-Cache umgehen (immer neu generieren)", font=ctk.CTkFont(size=13))
+        self.result_cache_bypass_checkbox.grid(row=4, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.result_cache_info_label = ctk.CTkLabel(self.advanced_frame, text="", font=ctk.CTkFont(size=10), text_color="gray")
+        self.result_cache_info_label.grid(row=5, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+        if not self.result_cache:
+            self.result_cache_bypass_checkbox.select()
+            self.result_cache_bypass_checkbox.configure(state="disabled")
+
+        # Vorladen bei Modellauswahl und Aufwärmlauf nach dem Laden
+        self.preload_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Ausgewähltes Modell im Hintergrund vorladen", font=ctk.CTkFont(size=13))
+        self.preload_checkbox.grid(row=6, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.preload_checkbox.select() # Standardmäßig aktiv (nur bei ausreichend freiem Arbeitsspeicher)
+        self.warmup_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Aufwärmlauf nach dem Laden (schnellere erste Generierung)", font=ctk.CTkFont(size=13))
+        self.warmup_checkbox.grid(row=7, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.warmup_checkbox.select()
+
+        # Alternatives Ausführungs-Backend für reine CPU-Rechner
+        onnx_text = "ONNX Runtime als Backend verwenden (nur CPU, einmaliger Export)"
+        if ort is None:
+            onnx_text += " – onnxruntime nicht installiert"
+        self.onnx_checkbox = ctk.CTkCheckBox(self.advanced_frame, text=onnx_text, font=ctk.CTkFont(size=13))
+        self.onnx_checkbox.grid(row=8, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        if ort is None or self.device != "cpu":
+            self.onnx_checkbox.configure(state="disabled")
+
+        # Token Merging (ToMe): weniger Tokens in der Self-Attention der höchstaufgelösten Blöcke
+        self.tome_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Token Merging (ToMe, schneller bei großen Bildern)", command=self._toggle_token_merging, font=ctk.CTkFont(size=13))
+        self.tome_checkbox.grid(row=9, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.tome_ratio_label = ctk.CTkLabel(self.advanced_frame, text=f"Merge-Anteil: {TOME_DEFAULT_RATIO:.2f}", font=ctk.CTkFont(size=12))
+        self.tome_ratio_label.grid(row=10, column=0, padx=10, pady=(0, 5), sticky="w")
+        self.tome_ratio_slider = ctk.CTkSlider(self.advanced_frame, from_=0.1, to=TOME_MAX_RATIO, number_of_steps=13, command=self._update_tome_ratio, corner_radius=8)
+        self.tome_ratio_slider.grid(row=10, column=1, padx=10, pady=(0, 5), sticky="ew")
+        self.tome_ratio_slider.set(TOME_DEFAULT_RATIO)
+
+        # LoRAs aus dem LoRA-Ordner: werden vor der Generierung in die Gewichte fusioniert
+        self.lora_label = ctk.CTkLabel(self.advanced_frame, text=f"LoRAs (/{LORA_DIR} Ordner, Stärke):", font=ctk.CTkFont(size=13, weight="bold"))
+        self.lora_label.grid(row=11, column=0, padx=10, pady=(10, 0), sticky="w")
+        self.refresh_loras_button = ctk.CTkButton(self.advanced_frame, text="Aktualisieren", command=self._refresh_lora_list, width=110, height=28, corner_radius=8)
+        self.refresh_loras_button.grid(row=11, column=1, padx=10, pady=(10, 0), sticky="e")
+        self.lora_list_frame = ctk.CTkFrame(self.advanced_frame, fg_color="transparent")
+        self.lora_list_frame.grid(row=12, column=0, columnspan=2, padx=10, pady=(5, 0), sticky="ew")
+        self.lora_list_frame.grid_columnconfigure(0, weight=1)
+        self.lora_info_label = ctk.CTkLabel(self.advanced_frame, text="", font=ctk.CTkFont(size=10), text_color="gray")
+        self.lora_info_label.grid(row=13, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+        self.lora_widgets = {} # Dateiname -> (Checkbox, Stärke-Eingabefeld)
+        self._refresh_lora_list()
+
+        # Benchmark: volle CFG gegen CFG-Abschneiden und CFG 1.0 (Dauer und Bildabweichung)
+        self.cfg_benchmark_button = ctk.CTkButton(self.advanced_frame, text="CFG-Benchmark starten", command=self._start_cfg_benchmark, height=28, corner_radius=8)
+        self.cfg_benchmark_button.grid(row=14, column=0, columnspan=2, padx=10, pady=(10, 5), sticky="w")
+        self.cfg_benchmark_button.configure(state="disabled")
+
+        # Ausgabe als Tar-Shards statt einzelner PNG-Dateien (Datensatz-Generierung)
+        self.shard_output_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Als Tar-Shards speichern (WebDataset, für große Datensätze)", font=ctk.CTkFont(size=13))
+        self.shard_output_checkbox.grid(row=15, column=0, columnspan=2, padx=10, pady=(5, 5), sticky="w")
+        self.shard_info_label = ctk.CTkLabel(self.advanced_frame, text=f"Shards: {SHARD_DIR}, max. {SHARD_MAX_SAMPLES} Bilder bzw. {format_bytes(SHARD_MAX_BYTES)} pro Shard", font=ctk.CTkFont(size=10), text_color="gray")
+        self.shard_info_label.grid(row=16, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+        # Hochskalieren nach der Generierung (kachelweise, mehrere Threads)
+        self.upscale_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Nach der Generierung hochskalieren, Faktor:", command=self._refresh_upscaler_list, font=ctk.CTkFont(size=13))
+        self.upscale_checkbox.grid(row=17, column=0, padx=10, pady=(5, 5), sticky="w")
+        self.upscale_factor_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=UPSCALE_FACTORS, width=70, corner_radius=8)
+        self.upscale_factor_optionmenu.grid(row=17, column=1, padx=10, pady=(5, 5), sticky="w")
+        self.upscale_factor_optionmenu.set(UPSCALE_DEFAULT_FACTOR)
+        self.upscale_method_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=list_upscalers(), corner_radius=8)
+        self.upscale_method_optionmenu.grid(row=18, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+        self.upscale_method_optionmenu.set(UPSCALE_LANCZOS)
+
+        # Auftrags-Warteschlange: Prompts sammeln, kompatible Aufträge gemeinsam in einem Stapel generieren
+        self.job_queue_button = ctk.CTkButton(self.advanced_frame, text="Prompt zur Warteschlange hinzufügen", command=self.enqueue_job_event, height=28, corner_radius=8)
+        self.job_queue_button.grid(row=19, column=0, columnspan=2, padx=10, pady=(10, 5), sticky="w")
+        self.job_batch_size_label = ctk.CTkLabel(self.advanced_frame, text="Max. Aufträge pro Stapel:", font=ctk.CTkFont(size=12))
+        self.job_batch_size_label.grid(row=20, column=0, padx=10, pady=(0, 5), sticky="w")
+        self.job_batch_size_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=JOB_BATCH_SIZES, width=70, corner_radius=8)
+        self.job_batch_size_optionmenu.grid(row=20, column=1, padx=10, pady=(0, 5), sticky="w")
+        self.job_batch_size_optionmenu.set(JOB_BATCH_DEFAULT_SIZE)
+        self.job_batch_wait_label = ctk.CTkLabel(self.advanced_frame, text="Max. Wartezeit auf weitere Aufträge (s):", font=ctk.CTkFont(size=12))
+        self.job_batch_wait_label.grid(row=21, column=0, padx=10, pady=(0, 5), sticky="w")
+        self.job_batch_wait_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=JOB_BATCH_WAIT_SECONDS, width=70, corner_radius=8)
+        self.job_batch_wait_optionmenu.grid(row=21, column=1, padx=10, pady=(0, 5), sticky="w")
+        self.job_batch_wait_optionmenu.set(JOB_BATCH_DEFAULT_WAIT)
+        self.job_queue_info_label = ctk.CTkLabel(self.advanced_frame, text="Warteschlange: leer", font=ctk.CTkFont(size=10), text_color="gray")
+        self.job_queue_info_label.grid(row=22, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+        # Auto-Tuning: Ladeeinstellungen auf diesem Rechner messen und als Profil pro Modell speichern
+        self.autotune_button = ctk.CTkButton(self.advanced_frame, text="Auto-Tuning (Modell und Bildgröße)", command=self._start_autotune, height=28, corner_radius=8)
+        self.autotune_button.grid(row=23, column=0, columnspan=2, padx=10, pady=(10, 5), sticky="w")
+        self.autotune_button.configure(state="disabled")
+        self.tuning_profile_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="Tuning-Profil beim Laden anwenden", font=ctk.CTkFont(size=13))
+        self.tuning_profile_checkbox.grid(row=24, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+        self.tuning_profile_checkbox.select()
+        self.autotune_info_label = ctk.CTkLabel(self.advanced_frame, text="Kein Tuning-Profil aktiv", font=ctk.CTkFont(size=10), text_color="gray", wraplength=380, justify="left")
+        self.autotune_info_label.grid(row=25, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+        # SDXL-Refiner: übernimmt die letzten Schritte direkt im Latent-Raum (teilt VAE und zweiten Text-Encoder)
+        self.refiner_checkbox = ctk.CTkCheckBox(self.advanced_frame, text="SDXL-Refiner verwenden, Übergang bei:", font=ctk.CTkFont(size=13))
+        self.refiner_checkbox.grid(row=26, column=0, padx=10, pady=(10, 5), sticky="w")
+        self.refiner_switch_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=REFINER_SWITCH_FRACTIONS, width=70, corner_radius=8)
+        self.refiner_switch_optionmenu.grid(row=26, column=1, padx=10, pady=(10, 5), sticky="w")
+        self.refiner_switch_optionmenu.set(REFINER_DEFAULT_SWITCH)
+        self.refiner_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=["Keine Modelle gefunden"], corner_radius=8)
+        self.refiner_optionmenu.grid(row=27, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+
+        # Entwürfe: viele Seeds schnell in kleiner Auflösung, nur die ausgewählten werden final gerendert
+        self.draft_button = ctk.CTkButton(self.advanced_frame, text="Entwurfsraster erzeugen, Anzahl:", command=self._start_drafts, height=28, corner_radius=8)
+        self.draft_button.grid(row=28, column=0, padx=10, pady=(10, 5), sticky="w")
+        self.draft_button.configure(state="disabled")
+        self.draft_count_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=DRAFT_COUNTS, width=70, corner_radius=8)
+        self.draft_count_optionmenu.grid(row=28, column=1, padx=10, pady=(10, 5), sticky="w")
+        self.draft_count_optionmenu.set(DRAFT_DEFAULT_COUNT)
+        self.draft_info_label = ctk.CTkLabel(self.advanced_frame, text=f"Entwürfe: 1/{DRAFT_DOWNSCALE} Kantenlänge, max. {DRAFT_STEPS} Schritte, ein Prompt-Encoding", font=ctk.CTkFont(size=10), text_color="gray")
+        self.draft_info_label.grid(row=29, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+        # Attention-Backend: lässt sich ohne Neuladen umschalten, Auto wählt pro Bildgröße
+        self.attention_label = ctk.CTkLabel(self.advanced_frame, text="Attention-Backend:", font=ctk.CTkFont(size=13))
+        self.attention_label.grid(row=30, column=0, padx=10, pady=(10, 5), sticky="w")
+        self.attention_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=list(ATTENTION_BACKENDS), command=self._on_attention_backend_changed, corner_radius=8)
+        self.attention_optionmenu.grid(row=30, column=1, padx=10, pady=(10, 5), sticky="ew")
+        self.attention_optionmenu.set(ATTENTION_DEFAULT_BACKEND)
+        self.attention_slice_label = ctk.CTkLabel(self.advanced_frame, text="Köpfe pro Scheibe:", font=ctk.CTkFont(size=12))
+        self.attention_slice_label.grid(row=31, column=0, padx=10, pady=(0, 5), sticky="w")
+        self.attention_slice_optionmenu = ctk.CTkOptionMenu(self.advanced_frame, values=ATTENTION_SLICE_SIZES, command=self._on_attention_backend_changed, width=70, corner_radius=8)
+        self.attention_slice_optionmenu.grid(row=31, column=1, padx=10, pady=(0, 5), sticky="w")
+        self.attention_slice_optionmenu.set(ATTENTION_SLICE_SIZES[0])
+        self.attention_info_label = ctk.CTkLabel(self.advanced_frame, text="Aktiv: -", font=ctk.CTkFont(size=10), text_color="gray")
+        self.attention_info_label.grid(row=32, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="w")
+
+
         # --- Rechte Spalte: Bildanzeigebereich, Details und Buttons ---
         self.right_panel = ctk.CTkFrame(self, corner_radius=12, fg_color=("gray85", "gray15"))
         self.right_panel.grid(row=0, column=1, padx=20, pady=20, sticky="nsew")
@@ -370,19 +2847,46 @@ class ImageGeneratorApp(ctk.CTk):
 
         self.loading_animation_id = None # Für die Ladeanimation
         self.current_generated_image = None # Speichert das PIL-Image des zuletzt generierten Bildes
+        self.display_area = DEFAULT_DISPLAY_AREA # Zuletzt gemessene Anzeigefläche für das generierte Bild
+        self.thumbnail_cache = OrderedDict() # Dateipfad -> Galerie-Vorschaubild (LRU, nur im UI-Thread verwendet)
         self.current_generated_prompt = None # Speichert den Prompt des zuletzt generierten Bildes
         self.current_generated_negative_prompt = None # Speichert den negativen Prompt
+        self.current_generation_info = {} # Parameter des zuletzt generierten Bildes (für Metadaten und Archiv)
+        self.current_model_name = None # Dateiname (ohne Endung) des geladenen Modells
+        self.pipeline_variant = None # Gerät, Datentyp und Quantisierung des geladenen Modells (Teil des Cache-Schlüssels)
+        self.metadata_lock = threading.Lock() # Schützt die Metadatendatei beim Speichern aus Worker-Threads
         self.pipe = None # Das geladene Stable Diffusion Pipeline-Objekt
         self.generation_thread = None # Referenz auf den Generierungs-Thread
+        self.current_model_hash = None # SHA-256 der geladenen Modelldatei (erst berechnet, wenn ein Cache ihn braucht)
+        self.current_model_path = None
+        self.int8_report = None # float32/int8-Vergleich des geladenen Modells (nur CPU-Quantisierung)
+        self.onnx_report = None # PyTorch/ONNX-Vergleich des geladenen Modells (nur ONNX-Backend)
+        self.token_merging_ratio = None # Aktiver ToMe-Merge-Anteil (None = aus)
+        self.tuning_profile = None # Beim Laden angewendetes Tuning-Profil (None = feste Standard-Optimierungen)
+        self.refiner_state = None # Geladener SDXL-Refiner: {"path", "pipe", "base_offload_forced", "model_hash", "name"} (teilt VAE und Text-Encoder 2 mit self.pipe)
+        self.few_step_mode = None # Aktiver Few-Step-Modus: {"kind", "lora", "scheduler"} oder None
+        self.normal_sampling_settings = None # Schritte, CFG und Scheduler vor dem Einschalten des Few-Step-Modus
+        self.base_scheduler_config = None # Unveränderte Scheduler-Konfiguration des geladenen Modells
+        self.active_loras = [] # In die Pipeline fusionierte LoRAs: [(Dateiname, Stärke), ...] (ohne LCM-LoRA)
+        self.current_converted_cache_path = None # Cache-Verzeichnis des geladenen Modells (falls verwendet)
+        self.preload_state = None # Laufendes oder abgeschlossenes Vorladen (siehe _start_preload)
+        self.preload_lock = threading.Lock()
 
         # Initialisiere das Galerie-Fenster als None
         self.gallery_window_instance = None
 
         # Rufen Sie _populate_model_list HIER auf, nachdem alle Widgets initialisiert wurden
         self._populate_model_list()
+        self._update_cache_info_label()
+        self._update_result_cache_info_label()
+        self._update_lora_info_label()
 
     def on_closing(self):
         """Wird aufgerufen, wenn das Fenster geschlossen wird."""
+        with self.preload_lock:
+            preload, self.preload_state = self.preload_state, None
+        if preload:
+            self._cancel_preload(preload)
         if self.generation_thread and self.generation_thread.is_alive():
             self.stop_event.set() # Signalisiert dem Thread, dass er anhalten soll
             self.update_status("Generierung wird abgebrochen...", "orange")
@@ -442,39 +2946,327 @@ class ImageGeneratorApp(ctk.CTk):
         """Aktualisiert das Label für die CFG-Skala."""
         self.cfg_value_label.configure(text=f"{value:.1f}")
 
-    def _set_random_seed(self):
-        """Setzt einen zufälligen Seed im Eingabefeld."""
-        self.seed_entry.delete(0, ctk.END)
-        self.seed_entry.insert(0, str(random.randint(0, 2**32 - 1))) # Zufällige 32-Bit Ganzzahl
+    def _update_tome_ratio(self, value):
+        """Aktualisiert das Label des ToMe-Reglers und wendet den neuen Anteil sofort an."""
+        if self.tome_checkbox.get() and self._job_queue_busy():
+            # Die Aufträge eines Stapels lesen den Anteil erst beim Speichern, er darf sich also nicht ändern
+            if self.token_merging_ratio is not None:
+                self.tome_ratio_slider.set(self.token_merging_ratio)
+                value = self.token_merging_ratio
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, Merge-Anteil danach änderbar.", "orange")
+        elif self.tome_checkbox.get():
+            self._apply_token_merging()
+        self.tome_ratio_label.configure(text=f"Merge-Anteil: {value:.2f}")
+
+    def _toggle_token_merging(self):
+        """Checkbox-Callback: schaltet Token Merging um, außer während die Warteschlange abgearbeitet wird."""
+        if self._job_queue_busy():
+            if self.tome_checkbox.get():
+                self.tome_checkbox.deselect()
+            else:
+                self.tome_checkbox.select()
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, Token Merging danach umschaltbar.", "orange")
+            return
+        self._apply_token_merging()
 
-    def _update_size_options(self, value):
-        """Callback für Größen-Optionen (falls Logik für Abhängigkeiten nötig wäre)."""
-        # Aktuell keine spezielle Logik nötig, aber der Callback muss existieren.
-        pass
+    def _apply_token_merging(self):
+        """Wendet Token Merging gemäß Checkbox und Regler auf das geladene UNet an oder entfernt es (ohne Neuladen)."""
+        self.token_merging_ratio = None
+        if self.pipe is None:
+            return
+        if isinstance(self.pipe.unet, OnnxComponent):
+            if self.tome_checkbox.get():
+                self.after(0, self.update_status, "Token Merging ist mit dem ONNX-Backend nicht verfügbar.", "orange")
+            return
+        if not self.tome_checkbox.get():
+            if remove_token_merging(self.pipe.unet):
+                print("DEBUG: Token Merging deaktiviert.")
+            return
+        ratio = round(self.tome_ratio_slider.get(), 2)
+        wrapped_count = apply_token_merging(self.pipe.unet, ratio)
+        if wrapped_count:
+            self.token_merging_ratio = ratio
+        print(f"DEBUG: Token Merging aktiv (Anteil {ratio:.2f}) in {wrapped_count} Self-Attention-Schichten.")
 
-    def _set_settings_state(self, state):
-        """Setzt den Zustand der Einstellungswidgets (normal/disabled)."""
-        self.width_optionmenu.configure(state=state)
-        self.height_optionmenu.configure(state=state)
-        self.steps_slider.configure(state=state)
-        self.seed_entry.configure(state=state)
-        self.random_seed_button.configure(state=state)
-        self.cfg_slider.configure(state=state)
-        self.scheduler_optionmenu.configure(state=state)
-        self.prompt_entry.configure(state=state) # Prompt-Feld
-        self.negative_prompt_entry.configure(state=state) # Negativer Prompt-Feld
-        self.clear_prompt_button.configure(state=state) # Clear-Button
-        self.custom_width_entry.configure(state=state) # Eigene Größe
-        self.custom_height_entry.configure(state=state) # Eigene Größe
-        self.use_custom_size_checkbox.configure(state=state) # Eigene Größe Checkbox
-        self.num_images_entry.configure(state=state) # Anzahl Bilder
-        # self.live_preview_checkbox.configure(state=state) # Live-Vorschau Checkbox (entfernt)
-        # 8-Bit Checkbox bleibt aktiv, wenn GPU verfügbar ist, da sie das Laden beeinflusst
-        if torch.cuda.is_available() and not self.force_cpu: # Nur aktivieren, wenn GPU verfügbar und nicht CPU-Modus
-            self.quantization_checkbox.configure(state="normal" if state == "normal" else "disabled")
-        else:
-            self.quantization_checkbox.configure(state="disabled") # Immer deaktiviert, wenn CPU-Modus
+    def _select_attention_backend(self, width, height, batch_size):
+        """
+        Wendet das gewählte Attention-Backend an; Auto entscheidet anhand von Bildgröße und Batch (inkl. CFG) eines
+        UNet-Aufrufs. Ein nicht verfügbares Backend fällt auf SDPA zurück. Gibt die Bezeichnung des aktiven Backends zurück.
+        """
+        if self.pipe is None or isinstance(self.pipe.unet, OnnxComponent):
+            return None
+        unet = self.pipe.unet
+        previous = getattr(unet, "_attention_backend", None)
+        scale_factor = self.pipe.vae_scale_factor
+        matrix_bytes, tokens, batch_heads = attention_matrix_bytes(unet, height // scale_factor, width // scale_factor, batch_size)
+        budget_bytes = attention_memory_budget(self.device)
+        backend = ATTENTION_BACKENDS.get(self.attention_optionmenu.get())
+        if backend is None: # Auto
+            preferred = self.tuning_profile["settings"].get("attention", "sdpa") if self.tuning_profile else default_load_settings(self.device)["attention"]
+            backend = choose_attention_backend(self.device, "sliced" if preferred == "slicing" else preferred, matrix_bytes, budget_bytes)
+        slice_size = None
+        if backend == "sliced":
+            slice_choice = self.attention_slice_optionmenu.get()
+            slice_size = int(slice_choice) if slice_choice.isdigit() else attention_slice_size(tokens, batch_heads, unet.dtype.itemsize, budget_bytes)
+        try:
+            label = apply_attention_backend(self.pipe, backend, slice_size)
+        except Exception as e: # z.B. xformers nicht installiert
+            print(f"FEHLER: Attention-Backend '{backend}' nicht verfügbar: {e}")
+            self.after(0, self.update_status, f"Attention-Backend '{backend}' nicht verfügbar, verwende SDPA.", "orange")
+            label = apply_attention_backend(self.pipe, "sdpa")
+        if label != previous:
+            print(f"DEBUG: Attention-Backend {label} für {width}x{height} (Batch {batch_size}, größte Attention-Matrix {format_bytes(matrix_bytes)}).")
+        self.after(0, lambda: self.attention_info_label.configure(text=f"Aktiv: {label} (zuletzt für {width}x{height})"))
+        return label
+
+    def _apply_attention_choice(self):
+        """Wendet das gewählte Attention-Backend sofort für die eingestellte Bildgröße an (nach dem Laden und beim Umschalten)."""
+        if self.pipe is None:
+            return
+        try:
+            width, height, _ = self._read_image_size()
+        except ValueError:
+            width = height = self.pipe.unet.config.sample_size * self.pipe.vae_scale_factor
+        self._select_attention_backend(width, height, 2) # Mit CFG: bedingter und unbedingter Durchlauf
+
+    def _on_attention_backend_changed(self, value=None):
+        """Option-Menü-Callback: schaltet das Attention-Backend ohne Neuladen um (laufende Generierungen erst beim nächsten Durchlauf)."""
+        if self._job_queue_busy() or (self.generation_thread and self.generation_thread.is_alive()):
+            self.update_status("Das Attention-Backend wird ab der nächsten Generierung verwendet.", "blue")
+            return
+        self._apply_attention_choice()
+
+    def _toggle_few_step_mode(self):
+        """Checkbox-Callback: begrenzt die Regler sofort und lädt bzw. entfernt das LCM-LoRA im Hintergrund."""
+        if self._job_queue_busy(): # Das LoRA darf nicht während eines Stapels fusioniert werden
+            if self.few_step_checkbox.get():
+                self.few_step_checkbox.deselect()
+            else:
+                self.few_step_checkbox.select()
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, Few-Step-Modus danach umschaltbar.", "orange")
+            return
+        self._update_few_step_sliders()
+        if self.pipe is None:
+            return
+        self.generate_button.configure(state="disabled")
+        self.few_step_checkbox.configure(state="disabled")
+        threading.Thread(target=self._few_step_mode_thread, daemon=True).start()
+
+    def _few_step_mode_thread(self):
+        """Wendet den Few-Step-Modus an, ohne die Oberfläche zu blockieren."""
+        try:
+            self._apply_few_step_mode()
+        finally:
+            self.after(0, lambda: self.generate_button.configure(state="normal"))
+            self.after(0, lambda: self.few_step_checkbox.configure(state="normal"))
+
+    def _update_few_step_sliders(self):
+        """Begrenzt Schritte (1-8) und CFG (1-2) im Few-Step-Modus und stellt die vorherigen Werte danach wieder her."""
+        if self.few_step_checkbox.get():
+            if self.normal_sampling_settings is None:
+                self.normal_sampling_settings = (self.steps_slider.get(), self.cfg_slider.get(), self.scheduler_optionmenu.get())
+            self.steps_slider.configure(from_=1, to=FEW_STEP_MAX_STEPS, number_of_steps=FEW_STEP_MAX_STEPS - 1)
+            self.steps_slider.set(FEW_STEP_DEFAULT_STEPS)
+            self.cfg_slider.configure(from_=1.0, to=FEW_STEP_MAX_CFG, number_of_steps=10)
+            self.cfg_slider.set(1.0)
+        else:
+            self.steps_slider.configure(from_=10, to=100, number_of_steps=90)
+            self.cfg_slider.configure(from_=1.0, to=20.0, number_of_steps=190)
+            if self.normal_sampling_settings is not None:
+                steps, cfg, scheduler_name = self.normal_sampling_settings
+                self.steps_slider.set(steps)
+                self.cfg_slider.set(cfg)
+                self.scheduler_optionmenu.set(scheduler_name)
+                self.normal_sampling_settings = None
+        self._update_steps_label(self.steps_slider.get())
+        self._update_cfg_label(self.cfg_slider.get())
+
+    def _apply_few_step_mode(self):
+        """
+        Schaltet den Few-Step-Modus gemäß Checkbox auf der geladenen Pipeline ein oder aus (ohne Neuladen).
+        Destillierte Checkpoints brauchen nur den passenden Scheduler, andere Modelle bekommen zusätzlich
+        zu den gewählten LoRAs ein LCM-LoRA fusioniert.
+        """
+        if self.pipe is None:
+            self.few_step_mode = None
+            return
+        enabled = bool(self.few_step_checkbox.get())
+        if self.few_step_mode is not None:
+            if enabled:
+                return # Bereits aktiv
+            lcm_lora = self.few_step_mode["lora"]
+            self.few_step_mode = None
+            if lcm_lora and self._apply_loras(self.active_loras):
+                print(f"DEBUG: LCM-LoRA '{lcm_lora}' entfernt.")
+            self.after(0, self.update_status, "Few-Step-Modus deaktiviert.", "green")
+            return
+        if not enabled:
+            return
+
+        kind = detect_distilled_model(self.current_model_name, self.pipe.unet)
+        if kind:
+            self.few_step_mode = {"kind": kind, "lora": None, "scheduler": FEW_STEP_SCHEDULERS[kind]}
+            description = f"destilliertes {kind.upper()}-Modell"
+        else:
+            lora_path = find_lcm_lora(isinstance(self.pipe, StableDiffusionXLPipeline))
+            if lora_path is None:
+                self.after(0, self.update_status, f"Kein passendes LCM-LoRA in '{LORA_DIR}' gefunden (Dateiname mit 'lcm', für SDXL zusätzlich 'xl').", "orange")
+                return
+            self.few_step_mode = {"kind": "lcm", "lora": os.path.basename(lora_path), "scheduler": "LCM"}
+            if not self._apply_loras(self.active_loras): # Fusioniert das LCM-LoRA zusammen mit den gewählten LoRAs
+                self.few_step_mode = None
+                return
+            description = f"LCM-LoRA {self.few_step_mode['lora']}"
+        print(f"DEBUG: Few-Step-Modus aktiv ({description}, Scheduler {self.few_step_mode['scheduler']}).")
+        self.after(0, self.scheduler_optionmenu.set, self.few_step_mode["scheduler"])
+        self.after(0, self.update_status, f"Few-Step-Modus aktiv: {description}, Scheduler {self.few_step_mode['scheduler']}.", "green")
+
+    def _refresh_lora_list(self):
+        """Liest das LoRA-Verzeichnis neu ein und baut die Auswahlliste auf (Auswahl und Stärken bleiben erhalten)."""
+        previous = {filename: (checkbox.get(), weight_entry.get()) for filename, (checkbox, weight_entry) in self.lora_widgets.items()}
+        for child in self.lora_list_frame.winfo_children():
+            child.destroy()
+        self.lora_widgets = {}
+        loras = list_loras()
+        if not loras:
+            ctk.CTkLabel(self.lora_list_frame, text="Keine LoRAs gefunden.", font=ctk.CTkFont(size=12), text_color="gray").grid(row=0, column=0, sticky="w")
+            return
+        for row, info in enumerate(loras):
+            checkbox = ctk.CTkCheckBox(self.lora_list_frame, text=f"{info['name']} ({format_lora_info(info)})", font=ctk.CTkFont(size=12))
+            checkbox.grid(row=row, column=0, pady=2, sticky="w")
+            weight_entry = ctk.CTkEntry(self.lora_list_frame, width=50, corner_radius=8)
+            weight_entry.grid(row=row, column=1, padx=(5, 0), pady=2, sticky="e")
+            selected, weight = previous.get(info["filename"], (0, "1.0"))
+            weight_entry.insert(0, weight)
+            if selected:
+                checkbox.select()
+            self.lora_widgets[info["filename"]] = (checkbox, weight_entry)
+        print(f"DEBUG: {len(loras)} LoRA(s) in '{LORA_DIR}' gefunden.")
+
+    def _selected_loras(self):
+        """Gewählte LoRAs mit ihren Stärken aus der Liste: [(Dateiname, Stärke), ...]."""
+        selected = []
+        for filename, (checkbox, weight_entry) in self.lora_widgets.items():
+            if not checkbox.get():
+                continue
+            try:
+                weight = float(weight_entry.get().replace(",", "."))
+            except ValueError:
+                raise ValueError(f"Ungültige LoRA-Stärke für {filename}")
+            if weight != 0:
+                selected.append((filename, round(weight, 3)))
+        return selected
+
+    def _apply_loras(self, loras):
+        """
+        Fusioniert die gewählten LoRAs (plus ggf. das LCM-LoRA des Few-Step-Modus) in die geladene Pipeline.
+        Läuft in einem Hintergrund-Thread. Gibt False zurück, wenn das Anwenden fehlgeschlagen ist.
+        """
+        combination = [(os.path.join(LORA_DIR, filename), weight) for filename, weight in loras]
+        if self.few_step_mode and self.few_step_mode["lora"]:
+            combination.append((os.path.join(LORA_DIR, self.few_step_mode["lora"]), 1.0))
+        if combination and self.pipeline_variant and self.pipeline_variant.split("/")[-1] in ("int8", "8bit", "onnx"):
+            self.after(0, self.update_status, "LoRAs sind mit quantisierten Modellen und dem ONNX-Backend nicht verfügbar.", "orange")
+            return False
+        start_time = time.time()
+        try:
+            result = self.lora_manager.apply(self.pipe, combination)
+        except Exception as e:
+            print(f"FEHLER: LoRAs konnten nicht angewendet werden: {e}")
+            traceback.print_exc()
+            self.active_loras = [] # Der Manager hat die Originalgewichte wiederhergestellt
+            self.after(0, self.update_status, f"LoRAs konnten nicht angewendet werden: {e}", "red")
+            self.after(0, self._update_lora_info_label)
+            return False
+        self.active_loras = list(loras)
+        if result != "unchanged":
+            print(f"DEBUG: LoRA-Kombination hergestellt ({result}, {len(combination)} LoRA(s)) in {time.time() - start_time:.2f} s.")
+        self.after(0, self._update_lora_info_label)
+        return True
+
+    def _update_lora_info_label(self):
+        """Zeigt Größe und Trefferquote des Caches fusionierter LoRA-Kombinationen an."""
+        self.lora_info_label.configure(text=self.lora_manager.summary())
+
+    def _lora_labels(self):
+        """Aktive LoRAs für Spezifikation und Metadaten, z.B. ["stil:0.8"]."""
+        return [f"{os.path.splitext(filename)[0]}:{weight:g}" for filename, weight in self.active_loras]
+
+    def _few_step_label(self):
+        """Kurzbeschreibung des aktiven Few-Step-Modus für Spezifikation und Metadaten (None = aus)."""
+        if not self.few_step_mode:
+            return None
+        if self.few_step_mode["lora"]:
+            return f"lcm-lora:{os.path.splitext(self.few_step_mode['lora'])[0]}"
+        return self.few_step_mode["kind"]
+
+    def _set_random_seed(self):
+        """Setzt einen zufälligen Seed im Eingabefeld."""
+        self.seed_entry.delete(0, ctk.END)
+        self.seed_entry.insert(0, str(random.randint(0, 2**32 - 1))) # Zufällige 32-Bit Ganzzahl
+
+    def _update_size_options(self, value):
+        """Callback für Größen-Optionen (falls Logik für Abhängigkeiten nötig wäre)."""
+        # Aktuell keine spezielle Logik nötig, aber der Callback muss existieren.
+        pass
+
+    def _set_settings_state(self, state):
+        """Setzt den Zustand der Einstellungswidgets (normal/disabled)."""
+        self.width_optionmenu.configure(state=state)
+        self.height_optionmenu.configure(state=state)
+        self.steps_slider.configure(state=state)
+        self.seed_entry.configure(state=state)
+        self.random_seed_button.configure(state=state)
+        self.cfg_slider.configure(state=state)
+        self.scheduler_optionmenu.configure(state=state)
+        self.prompt_entry.configure(state=state) # Prompt-Feld
+        self.negative_prompt_entry.configure(state=state) # Negativer Prompt-Feld
+        self.clear_prompt_button.configure(state=state) # Clear-Button
+        self.custom_width_entry.configure(state=state) # Eigene Größe
+        self.custom_height_entry.configure(state=state) # Eigene Größe
+        self.use_custom_size_checkbox.configure(state=state) # Eigene Größe Checkbox
+        self.num_images_entry.configure(state=state) # Anzahl Bilder
+        self.tiled_checkbox.configure(state=state) # Gekachelte Generierung
+        self.deep_cache_checkbox.configure(state=state) # Feature-Cache (DeepCache)
+        self.deep_cache_interval_optionmenu.configure(state=state)
+        self.few_step_checkbox.configure(state=state) # Few-Step-Modus
+        self.cfg_truncation_checkbox.configure(state=state) # CFG-Abschneiden
+        self.cfg_truncation_optionmenu.configure(state=state)
+        self.cfg_benchmark_button.configure(state=state)
+        self.autotune_button.configure(state=state) # Auto-Tuning
+        self.refiner_checkbox.configure(state=state) # SDXL-Refiner
+        self.refiner_switch_optionmenu.configure(state=state)
+        self.refiner_optionmenu.configure(state=state)
+        self.draft_button.configure(state=state) # Entwürfe
+        self.draft_count_optionmenu.configure(state=state)
+        self.attention_optionmenu.configure(state=state) # Attention-Backend
+        self.attention_slice_optionmenu.configure(state=state)
+        self.tuning_profile_checkbox.configure(state=state)
+        self.profile_checkbox.configure(state=state) # Profiling
+        self.profile_optionmenu.configure(state=state)
+        self.shard_output_checkbox.configure(state=state)
+        self.upscale_checkbox.configure(state=state) # Hochskalieren
+        self.upscale_factor_optionmenu.configure(state=state)
+        self.upscale_method_optionmenu.configure(state=state)
+        self.refresh_loras_button.configure(state=state) # LoRA-Auswahl
+        for checkbox, weight_entry in self.lora_widgets.values():
+            checkbox.configure(state=state)
+            weight_entry.configure(state=state)
+        # self.live_preview_checkbox.configure(state=state) # Live-Vorschau Checkbox (entfernt)
+        # 8-Bit Checkbox: bitsandbytes auf der GPU, dynamische int8-Quantisierung auf der CPU
+        self.quantization_checkbox.configure(state="normal" if state == "normal" else "disabled")
         self.is_sdxl_checkbox.configure(state="normal" if state == "normal" else "disabled") # SDXL-Checkbox auch steuern
+        self.model_cache_checkbox.configure(state=state) # Modell-Cache beeinflusst nur das Laden
+        if self.device == "cpu":
+            self.shared_weights_checkbox.configure(state=state)
+        if self.result_cache:
+            self.result_cache_bypass_checkbox.configure(state=state)
+        self.preload_checkbox.configure(state=state)
+        self.warmup_checkbox.configure(state=state)
+        if ort is not None and self.device == "cpu":
+            self.onnx_checkbox.configure(state=state)
+        self.tome_checkbox.configure(state=state) # Token Merging lässt sich ohne Neuladen umschalten
+        self.tome_ratio_slider.configure(state=state)
 
 
     def _toggle_quantization_info(self):
@@ -502,8 +3294,10 @@ class ImageGeneratorApp(ctk.CTk):
         self.negative_prompt_entry.delete(0, ctk.END)
 
     def _load_prompt_history(self):
-        """Lädt den Prompt-Verlauf aus einer Datei."""
-        if os.path.exists(PROMPT_HISTORY_FILE):
+        """Lädt den Prompt-Verlauf aus dem Bildarchiv (bzw. einmalig aus der alten Verlaufsdatei)."""
+        if self.image_archive:
+            self.prompt_history.extend(self.image_archive.recent_prompts(self.prompt_history.maxlen))
+        if not self.prompt_history and os.path.exists(PROMPT_HISTORY_FILE):
             try:
                 with open(PROMPT_HISTORY_FILE, "r", encoding="utf-8") as f:
                     history_list = json.load(f)
@@ -512,35 +3306,62 @@ class ImageGeneratorApp(ctk.CTk):
                 pass # Datei ist leer oder korrupt
         self._update_prompt_history_options()
 
-    def _save_prompt_history(self):
-        """Speichert den aktuellen Prompt-Verlauf in einer Datei."""
-        with open(PROMPT_HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(self.prompt_history), f, indent=4, ensure_ascii=False)
-
     def _add_to_prompt_history(self, prompt, negative_prompt):
-        """Fügt einen Prompt zum Verlauf hinzu."""
+        """Fügt einen Prompt zum Verlauf hinzu (persistent ist er über das Bildarchiv)."""
         entry = {"prompt": prompt, "negative_prompt": negative_prompt}
-        if entry not in self.prompt_history: # Vermeide Duplikate
-            self.prompt_history.appendleft(entry) # Fügt am Anfang hinzu
-            self._update_prompt_history_options()
-            self._save_prompt_history()
-
-    def _update_prompt_history_options(self):
-        """Aktualisiert die Optionen im Prompt-Verlauf Dropdown-Menü."""
-        if not self.prompt_history:
-            self.prompt_history_optionmenu.configure(values=["Kein Verlauf"])
-            self.prompt_history_optionmenu.set("Kein Verlauf")
-            self.prompt_history_optionmenu.configure(state="disabled")
+        if entry in self.prompt_history: # Vermeide Duplikate, aber nach vorne holen
+            self.prompt_history.remove(entry)
+        self.prompt_history.appendleft(entry) # Fügt am Anfang hinzu
+        self._update_prompt_history_options()
+
+    def _update_prompt_history_options(self, entries=None):
+        """Aktualisiert die Vorschläge im Prompt-Suchfeld (Verlauf oder Suchtreffer)."""
+        if entries is None:
+            entries = list(self.prompt_history)
+            self.prompt_search_results = []
+        if not entries:
+            self.prompt_history_combobox.configure(values=["Kein Verlauf"])
+            self.prompt_history_combobox.set("")
         else:
             # Zeige nur den positiven Prompt im Menü an
-            options = [entry["prompt"] for entry in self.prompt_history]
-            self.prompt_history_optionmenu.configure(values=options)
-            self.prompt_history_optionmenu.set(options[0]) # Setze den neuesten als Standard
-            self.prompt_history_optionmenu.configure(state="normal")
+            options = [entry["prompt"] for entry in entries]
+            self.prompt_history_combobox.configure(values=options)
+
+    def _schedule_prompt_search(self, event=None):
+        """Startet die Suche kurz nach der letzten Tastatureingabe (statt bei jedem Tastendruck)."""
+        if event is not None and event.keysym in ("Return", "Up", "Down", "Escape"):
+            return
+        if self.prompt_search_after_id:
+            self.after_cancel(self.prompt_search_after_id)
+        self.prompt_search_after_id = self.after(250, self._search_prompt_history)
+
+    def _search_prompt_history(self):
+        """Durchsucht das Bildarchiv mit dem Text aus dem Prompt-Suchfeld."""
+        self.prompt_search_after_id = None
+        query = self.prompt_history_combobox.get().strip()
+        if not query or not self.image_archive:
+            self._update_prompt_history_options()
+            return
+
+        start_time = time.perf_counter()
+        results = []
+        seen = set()
+        for row in self.image_archive.search(query, limit=PROMPT_SEARCH_LIMIT * 5):
+            key = (row["prompt"], row["negative_prompt"] or "")
+            if key not in seen: # Gleiche Prompts nur einmal vorschlagen
+                seen.add(key)
+                results.append({"prompt": row["prompt"], "negative_prompt": row["negative_prompt"] or ""})
+            if len(results) >= PROMPT_SEARCH_LIMIT:
+                break
+        duration_ms = (time.perf_counter() - start_time) * 1000
+
+        self.prompt_search_results = results
+        self._update_prompt_history_options(results)
+        self.update_status(f"{len(results)} Prompts gefunden ({duration_ms:.1f} ms).", "gray")
 
     def _load_prompt_from_history(self, selected_prompt_text):
         """Lädt einen ausgewählten Prompt aus dem Verlauf in die Eingabefelder."""
-        for entry in self.prompt_history:
+        for entry in self.prompt_search_results + list(self.prompt_history):
             if entry["prompt"] == selected_prompt_text:
                 self.prompt_entry.delete(0, ctk.END)
                 self.prompt_entry.insert(0, entry["prompt"])
@@ -677,6 +3498,8 @@ class ImageGeneratorApp(ctk.CTk):
             else:
                 self.model_optionmenu.configure(values=model_files)
                 self.model_optionmenu.set(model_files[0]) # Wähle das erste Modell standardmäßig aus
+                self.refiner_optionmenu.configure(values=model_files)
+                self.refiner_optionmenu.set(next((name for name in model_files if "refiner" in name.lower()), model_files[0]))
                 self.model_optionmenu.configure(state="normal")
                 self._on_model_select(model_files[0]) # Automatische Erkennung für das erste Modell ausführen
                 self.update_status(f"{len(model_files)} Modelle im '{MODELS_DIR}' Ordner gefunden.", "gray")
@@ -709,9 +3532,157 @@ class ImageGeneratorApp(ctk.CTk):
             self.height_optionmenu.set("512")
             self.update_status(f"Modell ausgewählt: {selected_model_name}. Standard SD-Modell erkannt. Standardauflösung auf 512x512 gesetzt.", "gray")
 
+        # Spekulativ im Hintergrund vorladen, damit "Modell laden" danach kaum noch warten muss
+        self._start_preload(model_full_path, is_sdxl_detected)
+
+    def _start_preload(self, model_path, is_sdxl):
+        """Bricht ein laufendes Vorladen ab und startet es für die neue Auswahl."""
+        with self.preload_lock:
+            previous, self.preload_state = self.preload_state, None
+        if previous:
+            self._cancel_preload(previous)
+
+        if not self.preload_checkbox.get() or not os.path.exists(model_path):
+            return
+        if self.pipe is not None and self.current_model_name == os.path.splitext(os.path.basename(model_path))[0]:
+            return # Bereits geladen
+
+        torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
+        preload = {
+            "key": (os.path.abspath(model_path), bool(is_sdxl), str(torch_dtype)),
+            "cancel": threading.Event(),
+            "done": threading.Event(),
+            # Quantisierte und geteilte Ladevarianten nur vorlesen, nicht vorladen
+            "full_load": not self.quantization_checkbox.get() and not (self.shared_weights_checkbox.get() and self.device == "cpu"),
+            "pipe": None,
+        }
+        with self.preload_lock:
+            self.preload_state = preload
+        threading.Thread(target=self._preload_model_thread, args=(preload, model_path, is_sdxl, torch_dtype), daemon=True).start()
+
+    def _cancel_preload(self, preload):
+        """Bricht ein Vorladen ab und gibt eine bereits vorgeladene Pipeline frei."""
+        preload["cancel"].set()
+        if preload["done"].is_set() and preload.get("pipe") is not None:
+            preload["pipe"] = None
+            gc.collect()
+            print(f"DEBUG: Vorgeladenes Modell verworfen: {os.path.basename(preload['key'][0])}")
+
+    def _take_preloaded_pipeline(self, preload_key):
+        """
+        Übernimmt das Ergebnis des Vorladens, wenn es zur angeforderten Ladung passt (wartet ggf. auf dessen Ende).
+        Passt es nicht, wird es abgebrochen. Gibt das Vorlade-Dict mit Pipeline zurück oder None.
+        """
+        with self.preload_lock:
+            preload, self.preload_state = self.preload_state, None
+        if preload is None:
+            return None
+        if preload["key"] != preload_key or not preload["full_load"]:
+            self._cancel_preload(preload)
+            return None
+        if not preload["done"].is_set():
+            self.after(0, self.update_status, "Warte auf das Vorladen im Hintergrund...", "blue")
+            preload["done"].wait()
+        return preload if preload.get("pipe") is not None else None
+
+    def _preload_model_thread(self, preload, model_path, is_sdxl, torch_dtype):
+        """
+        Spekulatives Vorladen nach der Modellauswahl (Hintergrund-Thread):
+        1. Hash berechnen und die zu ladenden Dateien in den Page-Cache lesen,
+        2. bei ausreichend freiem Arbeitsspeicher die Pipeline vollständig laden,
+        3. auf der CPU einen kurzen Aufwärmlauf ausführen.
+        Abgebrochen wird zwischen den Stufen und beim Lesen; eine bereits laufende Pipeline-Ladung
+        wird zu Ende geführt und danach verworfen.
+        """
+        cancel_event = preload["cancel"]
+        model_name = os.path.basename(model_path)
+        start_time = time.time()
+        try:
+            # Der Hash ist nur Schlüssel des konvertierten Caches; ohne ihn wird die Datei nicht zusätzlich gelesen
+            model_hash = None
+            if self.model_cache_checkbox.get():
+                model_hash = compute_model_hash(model_path, cancel_event=cancel_event)
+                if model_hash is None or cancel_event.is_set():
+                    return
+            preload["model_hash"] = model_hash
+
+            cache_path = converted_cache_path(model_hash, torch_dtype, is_sdxl) if model_hash else None
+            has_cache = cache_path is not None and os.path.exists(os.path.join(cache_path, "model_index.json"))
+            files = list_files(cache_path if has_cache else model_path)
+            file_bytes = sum(os.path.getsize(path) for path in files)
+            # Ein fp16-Checkpoint belegt als float32 etwa doppelt so viel Speicher wie auf der Festplatte
+            estimated_bytes = file_bytes * (2 if torch_dtype == torch.float32 and not has_cache else 1)
+            available_bytes = get_available_memory()
+
+            if available_bytes is None or file_bytes <= available_bytes: # Größere Dateien würden sich selbst wieder aus dem Page-Cache verdrängen
+                if preread_files(files, cancel_event) is None:
+                    return
+                print(f"DEBUG: {model_name} in den Page-Cache gelesen ({format_bytes(file_bytes)}, {time.time() - start_time:.1f} s).")
+
+            generation_running = self.generation_thread is not None and self.generation_thread.is_alive()
+            if available_bytes is None or estimated_bytes > available_bytes * PRELOAD_MEMORY_FRACTION:
+                print(f"DEBUG: Vollständiges Vorladen übersprungen: ca. {format_bytes(estimated_bytes)} benötigt, Budget {format_bytes(int((available_bytes or 0) * PRELOAD_MEMORY_FRACTION))}.")
+                preload["full_load"] = False
+            if not preload["full_load"] or generation_running or cancel_event.is_set():
+                return
+
+            self.after(0, self.update_status, f"Lade {model_name} im Hintergrund vor...", "gray")
+            pipeline_class = StableDiffusionXLPipeline if is_sdxl else StableDiffusionPipeline
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                if has_cache:
+                    pipe = pipeline_class.from_pretrained(cache_path, torch_dtype=torch_dtype, use_safetensors=True, low_cpu_mem_usage=True)
+                else:
+                    pipe = pipeline_class.from_single_file(model_path, torch_dtype=torch_dtype, low_cpu_mem_usage=True)
+            if cancel_event.is_set():
+                del pipe
+                gc.collect()
+                print(f"DEBUG: Vorladen von {model_name} abgebrochen, Pipeline verworfen.")
+                return
+
+            # Auf der GPU wird erst nach dem Verschieben aufgewärmt (im Lade-Thread)
+            if self.device == "cpu" and self.warmup_checkbox.get():
+                self._warmup_pipeline(pipe)
+                preload["warmed_up"] = True
+
+            preload["cache_path"] = cache_path if has_cache else None
+            preload["pipe"] = pipe
+            print(f"DEBUG: {model_name} in {time.time() - start_time:.1f} s im Hintergrund vorgeladen.")
+            self.after(0, self.update_status, f"{model_name} vorgeladen. 'Modell laden' ist jetzt sofort bereit.", "gray")
+        except Exception as e:
+            # Vorladen ist nur eine Beschleunigung: Fehler zeigen sich beim eigentlichen Laden erneut
+            print(f"FEHLER: Vorladen von {model_name} fehlgeschlagen: {e}")
+            traceback.print_exc()
+            preload["full_load"] = False
+        finally:
+            if cancel_event.is_set():
+                preload["pipe"] = None
+            preload["done"].set()
+
+    def _warmup_pipeline(self, pipe):
+        """
+        Kurzer Aufwärmlauf (kleines Bild, wenige Schritte), damit einmalige Initialisierungskosten
+        (Kernel-Auswahl, Speicherpools, Lazy-Init) nicht bei der ersten echten Generierung anfallen.
+        """
+        start_time = time.time()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            pipe(
+                prompt="warmup",
+                width=WARMUP_SIZE,
+                height=WARMUP_SIZE,
+                num_inference_steps=WARMUP_STEPS,
+                guidance_scale=5.0, # CFG > 1, damit derselbe Batch-Pfad wie bei echten Generierungen läuft
+                generator=torch.Generator(device="cpu").manual_seed(0),
+            )
+        print(f"DEBUG: Aufwärmlauf in {time.time() - start_time:.2f} Sekunden abgeschlossen.")
+
 
     def load_model(self):
         """Lädt das Stable Diffusion Modell in einem separaten Thread."""
+        if self._job_queue_busy():
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, Modellwechsel danach möglich.", "orange")
+            return
         selected_display_name = self.model_optionmenu.get()
         if selected_display_name == "Keine Modelle gefunden" or not selected_display_name:
             self.update_status("Bitte zuerst ein Modell auswählen!", "orange")
@@ -747,6 +3718,9 @@ class ImageGeneratorApp(ctk.CTk):
                 print("DEBUG: Entlade vorheriges Modell aus dem Speicher...")
                 del self.pipe
                 self.pipe = None
+                self.lora_manager.reset() # Gesicherte Originalgewichte freigeben
+                self.tensor_pool.clear()
+                self.refiner_state = None # Teilt Komponenten mit der alten Pipeline
                 if torch.cuda.is_available():
                     torch.cuda.empty_cache() # Leere GPU-Speicher
                 gc.collect() # Python Garbage Collector aufrufen
@@ -768,22 +3742,66 @@ class ImageGeneratorApp(ctk.CTk):
             # --- Ende Diagnose ---
 
             load_in_8bit = self.quantization_checkbox.get() and device == "cuda"
+            cpu_int8 = self.quantization_checkbox.get() and device == "cpu" # Dynamische int8-Quantisierung für die CPU
+            use_onnx = bool(self.onnx_checkbox.get()) and ort is not None and device == "cpu"
+            if use_onnx and cpu_int8:
+                print("DEBUG: ONNX-Backend gewählt, int8-Quantisierung wird dafür übersprungen.")
+                cpu_int8 = False
             is_sdxl = self.is_sdxl_checkbox.get() # SDXL-Checkbox-Status abrufen
 
             if load_in_8bit:
                 self.update_status("Lade Modell mit 8-Bit-Quantisierung...", "blue")
+            elif cpu_int8:
+                self.update_status("Lade Modell mit int8-Quantisierung für die CPU...", "blue")
             
             # Wähle die richtige Pipeline-Klasse basierend auf der SDXL-Checkbox
             pipeline_class = StableDiffusionXLPipeline if is_sdxl else StableDiffusionPipeline
 
-            # Lade das Stable Diffusion Pipeline aus der safetensors-Datei
-            self.pipe = pipeline_class.from_single_file(
-                model_path,
-                torch_dtype=torch.float16 if device == "cuda" and not load_in_8bit else torch.float32,
-                low_cpu_mem_usage=True, # Hilft beim Laden großer Modelle in den Hauptspeicher
-                load_in_8bit=load_in_8bit # Parameter für 8-Bit-Quantisierung
-            )
-            
+            # Lade das Stable Diffusion Pipeline aus der safetensors-Datei (oder aus dem Cache)
+            load_start_time = time.time()
+            # Ein gespeichertes Tuning-Profil legt auch den Datentyp fest (nur für die unquantisierte PyTorch-Pipeline)
+            self.tuning_profile = None
+            if self.tuning_profile_checkbox.get() and not (load_in_8bit or cpu_int8 or use_onnx):
+                self.tuning_profile = self._find_tuning_profile(model_path, is_sdxl)
+            if self.tuning_profile:
+                torch_dtype = getattr(torch, self.tuning_profile["settings"]["dtype"])
+            else:
+                torch_dtype = torch.float16 if device == "cuda" and not load_in_8bit else torch.float32
+            shared_weights = bool(self.shared_weights_checkbox.get()) and device == "cpu"
+            self.current_model_path = model_path
+            self.current_model_hash = None
+            preloaded = None
+            if not (load_in_8bit or cpu_int8 or shared_weights):
+                preloaded = self._take_preloaded_pipeline((os.path.abspath(model_path), bool(is_sdxl), str(torch_dtype)))
+            else:
+                self._take_preloaded_pipeline(None) # Passt nicht zur gewählten Ladevariante
+            if preloaded:
+                # Im Hintergrund vorgeladene Pipeline übernehmen
+                self.pipe = preloaded["pipe"]
+                self.current_model_hash = preloaded["model_hash"]
+                self.current_converted_cache_path = preloaded["cache_path"]
+                self.int8_report = None
+                if preloaded["cache_path"] is None and self.model_cache_checkbox.get():
+                    self._save_converted_cache(self.pipe, converted_cache_path(self._model_hash(), torch_dtype, is_sdxl))
+                print("DEBUG: Vorgeladene Pipeline übernommen.")
+            else:
+                self.pipe = self._load_pipeline(
+                    model_path,
+                    pipeline_class,
+                    torch_dtype=torch_dtype,
+                    load_in_8bit=load_in_8bit,
+                    is_sdxl=is_sdxl,
+                    cpu_int8=cpu_int8,
+                )
+            self.onnx_report = None
+            onnx_failed = False
+            if use_onnx:
+                self.pipe = self._finish_onnx(self.pipe, self._model_hash(), is_sdxl)
+                # Bei einem Fehler läuft die Pipeline unverändert mit PyTorch weiter
+                onnx_failed = self.onnx_report is None
+                use_onnx = not onnx_failed
+            print(f"DEBUG: Pipeline in {time.time() - load_start_time:.2f} Sekunden geladen.")
+
             # --- Zusätzlicher Post-Load-Check für SDXL-Komponenten ---
             if is_sdxl and not hasattr(self.pipe, 'text_encoder_2'):
                 self.after(0, self.update_status, "WARNUNG: SDXL-Modell geladen, aber 'text_encoder_2' nicht gefunden. Möglicherweise ist das Modell inkompatibel oder beschädigt. Generierung könnte fehlschlagen.", "orange")
@@ -791,14 +3809,11 @@ class ImageGeneratorApp(ctk.CTk):
             # --- Ende Post-Load-Check ---
 
             # --- Optimierungen anwenden ---
-            if device == "cuda":
-                # Aktiviere speichereffiziente Attention, falls xformers verfügbar ist
-                try:
-                    import xformers
-                    self.pipe.enable_xformers_memory_efficient_attention()
-                    self.update_status("xFormers aktiviert (falls verfügbar).", "blue")
-                except ImportError:
-                    self.update_status("xFormers nicht gefunden, Generierung ohne Speicheroptimierung.", "orange")
+            if self.tuning_profile:
+                apply_pipeline_settings(self.pipe, self.tuning_profile["settings"], device)
+                self.update_status(f"Tuning-Profil angewendet ({self.tuning_profile['width']}x{self.tuning_profile['height']}): {describe_load_settings(self.tuning_profile['settings'])}", "blue")
+            elif device == "cuda":
+                # Die Attention (xformers, SDPA oder in Scheiben) setzt _select_attention_backend, siehe unten
                 
                 # Kompiliere das Modell für schnellere Inferenz (PyTorch 2.0+)
                 # Der try-except-block um torch.compile ist wichtig, da Triton-Installation fehlschlagen kann
@@ -835,8 +3850,38 @@ class ImageGeneratorApp(ctk.CTk):
                 self.pipe.to(device)
             # --- Ende Optimierungen ---
 
+            self._apply_attention_choice() # Gewähltes Attention-Backend für die eingestellte Bildgröße
+            self._apply_token_merging() # ToMe-Einstellung auf das neue UNet übertragen
+
+            # Aufwärmlauf auf dem endgültigen Gerät (entfällt, wenn schon beim Vorladen aufgewärmt wurde)
+            if self.warmup_checkbox.get() and not (preloaded and preloaded.get("warmed_up")):
+                self.after(0, self.update_status, "Aufwärmlauf...", "blue")
+                try:
+                    self._warmup_pipeline(self.pipe)
+                except Exception as e:
+                    # Ein fehlgeschlagener Aufwärmlauf verhindert das Laden nicht
+                    print(f"FEHLER: Aufwärmlauf fehlgeschlagen: {e}")
+                    traceback.print_exc()
+
+            self.after(0, self._update_cache_info_label)
+            self.after(0, self._update_memory_info_label)
+            self.after(0, self._update_autotune_info_label)
             self.after(0, self.stop_loading_animation)
-            self.after(0, self.update_status, "Modell erfolgreich geladen!", "green")
+            self.current_model_name = os.path.splitext(os.path.basename(model_path))[0]
+            self.pipeline_variant = f"{device}/{self.pipe.unet.dtype}/{'int8' if cpu_int8 else ('8bit' if load_in_8bit else ('onnx' if use_onnx else 'full'))}"
+            load_message = "Modell erfolgreich geladen!"
+            if cpu_int8:
+                load_message += " " + format_int8_report(self.int8_report)
+            if use_onnx:
+                load_message += " " + format_onnx_report(self.onnx_report)
+            if onnx_failed:
+                load_message += " ONNX-Backend nicht verfügbar, verwende PyTorch (Details in der Konsole)."
+            self.after(0, self.update_status, load_message, "orange" if onnx_failed else "green")
+            self.base_scheduler_config = dict(self.pipe.scheduler.config)
+            self.few_step_mode = None # Gehörte zur vorherigen Pipeline
+            self.active_loras = []
+            self.lora_manager.reset(f"{self.current_model_hash or os.path.abspath(model_path)}/{self.pipeline_variant}")
+            self._apply_few_step_mode() # LCM-LoRA bzw. passenden Scheduler für das neue Modell übernehmen
             self.after(0, lambda: self.load_model_button.configure(state="normal", text="Modell laden"))
             self.after(0, lambda: self.model_optionmenu.configure(state="normal")) # Aktiviere Modellauswahl wieder
             self.after(0, lambda: self.prompt_entry.configure(state="normal"))
@@ -876,6 +3921,250 @@ class ImageGeneratorApp(ctk.CTk):
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
 
+    def _load_pipeline(self, model_path, pipeline_class, torch_dtype, load_in_8bit, is_sdxl, cpu_int8=False):
+        """
+        Lädt die Pipeline für eine Modelldatei.
+        Ist der Modell-Cache aktiv, wird die Single-File-Konvertierung nur einmal durchgeführt und
+        als Diffusers-Layout (eine safetensors-Datei pro Komponente) gespeichert. Spätere Ladevorgänge
+        lesen dieses Layout direkt per Memory-Mapping ein.
+        Mit cpu_int8 werden UNet und Text-Encoder nach dem Laden int8-quantisiert.
+        """
+        self.current_converted_cache_path = None
+        self.int8_report = None
+
+        # Geteilte Gewichte werden aus dem konvertierten Cache abgebildet und setzen ihn daher voraus
+        shared_weights = bool(self.shared_weights_checkbox.get()) and self.device == "cpu" and not load_in_8bit
+
+        # Der Hash ist nur Schlüssel der Caches (konvertiertes Modell, int8-Vergleich); ohne sie wird er nicht berechnet
+        model_hash = None
+        if cpu_int8 or (not load_in_8bit and (self.model_cache_checkbox.get() or shared_weights)):
+            self.after(0, self.update_status, "Berechne Modell-Hash (nur beim ersten Laden langsam)...", "blue")
+            model_hash = self._model_hash()
+
+        # 8-Bit-Modelle werden von bitsandbytes beim Laden quantisiert und daher nicht zwischengespeichert
+        if load_in_8bit or not (self.model_cache_checkbox.get() or shared_weights):
+            pipe = pipeline_class.from_single_file(
+                model_path,
+                torch_dtype=torch_dtype,
+                low_cpu_mem_usage=True, # Hilft beim Laden großer Modelle in den Hauptspeicher
+                load_in_8bit=load_in_8bit, # Parameter für 8-Bit-Quantisierung
+            )
+            return self._finish_cpu_int8(pipe, model_hash, is_sdxl) if cpu_int8 else pipe
+
+        cache_path = converted_cache_path(model_hash, torch_dtype, is_sdxl)
+        if os.path.exists(os.path.join(cache_path, "model_index.json")):
+            pipe = self._load_cached_pipeline(cache_path, pipeline_class, torch_dtype, shared_weights)
+            return self._finish_cpu_int8(pipe, model_hash, is_sdxl) if cpu_int8 else pipe
+
+        pipe = pipeline_class.from_single_file(
+            model_path,
+            torch_dtype=torch_dtype,
+            low_cpu_mem_usage=True,
+        )
+
+        if not self._save_converted_cache(pipe, cache_path):
+            return self._finish_cpu_int8(pipe, model_hash, is_sdxl) if cpu_int8 else pipe
+
+        if shared_weights:
+            # Die privat geladene Kopie verwerfen und die gerade geschriebenen Dateien geteilt abbilden
+            del pipe
+            gc.collect()
+            pipe = self._load_cached_pipeline(cache_path, pipeline_class, torch_dtype, shared_weights)
+        return self._finish_cpu_int8(pipe, model_hash, is_sdxl) if cpu_int8 else pipe
+
+    def _model_hash(self):
+        """
+        Gibt den Hash des geladenen Modells zurück und berechnet ihn beim ersten Bedarf (Caches, Ergebnis-Cache,
+        Tuning-Profile). Ohne geladenes Modell None.
+        """
+        if self.current_model_hash is None and self.current_model_path:
+            try:
+                self.current_model_hash = compute_model_hash(self.current_model_path)
+            except OSError as e:
+                print(f"FEHLER: Modell-Hash konnte nicht berechnet werden: {e}")
+        return self.current_model_hash
+
+    def _save_converted_cache(self, pipe, cache_path):
+        """Speichert eine geladene Pipeline als konvertiertes Diffusers-Layout im Cache. Gibt True bei Erfolg zurück."""
+        # Konvertiertes Layout zuerst in ein temporäres Verzeichnis schreiben,
+        # damit ein abgebrochener Schreibvorgang keinen halben Cache-Eintrag hinterlässt
+        self.after(0, self.update_status, "Speichere konvertiertes Modell im Cache...", "blue")
+        temp_path = cache_path + ".tmp"
+        try:
+            if os.path.exists(temp_path):
+                shutil.rmtree(temp_path)
+            pipe.save_pretrained(temp_path, safe_serialization=True)
+            os.rename(temp_path, cache_path)
+            self.current_converted_cache_path = cache_path
+            print(f"DEBUG: Konvertiertes Modell gespeichert: {cache_path} ({format_bytes(get_directory_size(cache_path))})")
+            prune_converted_cache(max_bytes=int(CONVERTED_CACHE_MAX_GB * 1024**3), keep=(cache_path,))
+            return True
+        except Exception as e:
+            # Ein Fehler beim Schreiben des Caches darf das Laden nicht verhindern
+            print(f"FEHLER: Konnte konvertiertes Modell nicht im Cache speichern: {e}")
+            traceback.print_exc()
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return False
+
+    def _load_cached_pipeline(self, cache_path, pipeline_class, torch_dtype, shared_weights):
+        """
+        Lädt eine Pipeline aus dem konvertierten Cache.
+        Mit shared_weights zeigen die Gewichte von UNet, VAE und Text-Encodern direkt auf die
+        speicherabgebildeten Cache-Dateien, sodass mehrere Prozesse dieselben Seiten im Page-Cache nutzen.
+        """
+        print(f"DEBUG: Lade konvertiertes Modell aus dem Cache: {cache_path} (geteilt: {shared_weights})")
+        self.after(0, self.update_status, "Lade Modell aus dem Cache" + (" (geteilte Gewichte)..." if shared_weights else "..."), "blue")
+        os.utime(cache_path) # Als zuletzt benutzt markieren (für das Aufräumen)
+
+        shared_components = {}
+        if shared_weights:
+            with open(os.path.join(cache_path, "model_index.json"), "r", encoding="utf-8") as f:
+                model_index = json.load(f)
+            for component_name, spec in model_index.items():
+                if component_name.startswith("_") or not isinstance(spec, list) or spec[0] not in ("diffusers", "transformers"):
+                    continue
+                component_dir = os.path.join(cache_path, component_name)
+                if os.path.isdir(component_dir) and any(filename.endswith(".safetensors") for filename in os.listdir(component_dir)):
+                    shared_components[component_name] = load_component_shared(component_dir, spec[0], spec[1])
+                    print(f"DEBUG: Komponente '{component_name}' mit geteilten Gewichten geladen.")
+
+        pipe = pipeline_class.from_pretrained(
+            cache_path,
+            torch_dtype=torch_dtype,
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+            **shared_components # Bereits geladene Komponenten werden nicht erneut gelesen
+        )
+        self.current_converted_cache_path = cache_path
+        return pipe
+
+    def _finish_onnx(self, pipe, model_hash, is_sdxl):
+        """
+        Schaltet eine Float32-Pipeline auf das ONNX-Runtime-Backend um. Beim ersten Mal werden Text-Encoder,
+        UNet und VAE-Decoder exportiert, pro Modell-Hash zwischengespeichert und mit PyTorch verglichen.
+        Die Scheduler bleiben unverändert in PyTorch (die Pipeline steuert weiterhin die Schleife).
+        Schlagen Export oder Laden fehl, bleibt die Pipeline in PyTorch, der unvollständige Export wird
+        entfernt und self.onnx_report bleibt None.
+        """
+        export_dir = onnx_cache_dir(model_hash, is_sdxl)
+        report = load_onnx_report(model_hash, is_sdxl)
+        if report is None:
+            self.after(0, self.update_status, "Exportiere Modell nach ONNX und messe Vergleich zu PyTorch (einmalig, dauert einige Minuten)...", "blue")
+            report = {"benchmark_size": INT8_BENCHMARK_SIZE}
+            try:
+                report["torch_unet_seconds"] = benchmark_unet(pipe.unet, INT8_BENCHMARK_SIZE, INT8_BENCHMARK_SIZE)
+            except Exception as e:
+                print(f"FEHLER: PyTorch-Benchmark fehlgeschlagen: {e}")
+            export_start_time = time.time()
+            shutil.rmtree(export_dir, ignore_errors=True) # Reste eines abgebrochenen Exports entfernen
+            try:
+                export_pipeline_onnx(pipe, export_dir, is_sdxl)
+                report["export_seconds"] = round(time.time() - export_start_time, 1)
+                report["onnx_bytes"] = get_directory_size(export_dir)
+                apply_onnx_backend(pipe, export_dir)
+            except Exception as e:
+                return self._abort_onnx(pipe, export_dir, f"ONNX-Export fehlgeschlagen: {e}")
+            try:
+                report["onnx_unet_seconds"] = benchmark_unet(pipe.unet, INT8_BENCHMARK_SIZE, INT8_BENCHMARK_SIZE)
+            except Exception as e:
+                print(f"FEHLER: ONNX-Benchmark fehlgeschlagen: {e}")
+            # Der Bericht wird zuletzt geschrieben und markiert damit einen vollständigen Export
+            try:
+                with open(os.path.join(export_dir, "report.json"), "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=4)
+            except OSError as e:
+                # Ohne Bericht gilt der Export als unvollständig und wird beim nächsten Laden wiederholt
+                print(f"FEHLER: Konnte ONNX-Bericht nicht speichern: {e}")
+            print(f"DEBUG: ONNX-Export in {report['export_seconds']} s ({format_bytes(report['onnx_bytes'])}): {export_dir}")
+        else:
+            self.after(0, self.update_status, "Lade ONNX-Graphen aus dem Cache...", "blue")
+            try:
+                apply_onnx_backend(pipe, export_dir)
+            except Exception as e:
+                return self._abort_onnx(pipe, export_dir, f"ONNX-Graphen aus dem Cache nicht ladbar: {e}")
+        self.onnx_report = report
+        print(f"DEBUG: {format_onnx_report(report)}")
+        return pipe
+
+    def _abort_onnx(self, pipe, export_dir, message):
+        """Verwirft einen fehlgeschlagenen oder beschädigten ONNX-Export und lässt die Pipeline in PyTorch weiterlaufen."""
+        print(f"FEHLER: {message}")
+        traceback.print_exc()
+        shutil.rmtree(export_dir, ignore_errors=True)
+        self.onnx_report = None
+        self.after(0, self.update_status, f"{message} – verwende PyTorch.", "orange")
+        return pipe
+
+    def _finish_cpu_int8(self, pipe, model_hash, is_sdxl):
+        """
+        Quantisiert UNet und Text-Encoder einer frisch geladenen Float32-Pipeline dynamisch auf int8.
+        Beim ersten Mal werden Geschwindigkeit und Größe mit float32 verglichen und der Bericht gespeichert.
+        Die quantisierten Gewichte selbst werden nicht zwischengespeichert: quantize_dynamic braucht ohnehin
+        die geladenen Float-Module als Vorlage, ein Gewichts-Cache würde das Laden also nicht verkürzen.
+        """
+        report = load_int8_report(model_hash, is_sdxl)
+        if report is None:
+            self.after(0, self.update_status, "Quantisiere Modell auf int8 und messe Vergleich zu float32 (einmalig)...", "blue")
+            report = {"benchmark_size": INT8_BENCHMARK_SIZE}
+            try:
+                report["float32_unet_seconds"] = benchmark_unet(pipe.unet, INT8_BENCHMARK_SIZE, INT8_BENCHMARK_SIZE)
+            except Exception as e:
+                print(f"FEHLER: Float32-Benchmark fehlgeschlagen: {e}")
+            report["float32_bytes"] = sum(module_size_bytes(getattr(pipe, name)) for name in INT8_COMPONENTS if getattr(pipe, name, None) is not None)
+            measure = True
+        else:
+            self.after(0, self.update_status, "Quantisiere Modell auf int8...", "blue")
+            measure = False
+
+        for name in INT8_COMPONENTS:
+            if getattr(pipe, name, None) is not None:
+                setattr(pipe, name, quantize_module_int8(getattr(pipe, name)))
+        gc.collect()
+
+        if measure:
+            try:
+                report["int8_unet_seconds"] = benchmark_unet(pipe.unet, INT8_BENCHMARK_SIZE, INT8_BENCHMARK_SIZE)
+            except Exception as e:
+                print(f"FEHLER: int8-Benchmark fehlgeschlagen: {e}")
+            report["int8_bytes"] = sum(state_dict_size_bytes(getattr(pipe, name)) for name in INT8_COMPONENTS if getattr(pipe, name, None) is not None)
+            try:
+                save_int8_report(model_hash, is_sdxl, report)
+            except OSError as e:
+                # Ohne Bericht wird beim nächsten Laden einfach erneut gemessen
+                print(f"FEHLER: Konnte int8-Vergleich nicht speichern: {e}")
+        self.int8_report = report
+        print(f"DEBUG: {format_int8_report(report)}")
+        return pipe
+
+    def _update_memory_info_label(self):
+        """Zeigt den vom Prozess tatsächlich belegten Arbeitsspeicher an (resident, privat, geteilt)."""
+        memory_text = format_memory_info(get_process_memory_info())
+        self.memory_info_label.configure(text=memory_text)
+        print(f"DEBUG: {memory_text}")
+
+    def _update_result_cache_info_label(self):
+        """Zeigt Anzahl der Einträge und Treffer des Ergebnis-Caches an."""
+        if not self.result_cache:
+            self.result_cache_info_label.configure(text="Ergebnis-Cache nicht verfügbar.")
+            return
+        self.result_cache_info_label.configure(text=f"Ergebnis-Cache: {self.result_cache.count()} Einträge | Treffer in dieser Sitzung: {self.result_cache.hits}/{self.result_cache.hits + self.result_cache.misses}")
+
+    def _update_cache_info_label(self):
+        """Zeigt die aktuelle Größe des Modell-Caches an."""
+        cache_size = get_directory_size(CONVERTED_MODELS_DIR)
+        self.cache_info_label.configure(text=f"Modell-Cache: {format_bytes(cache_size)}")
+
+    def _confirm_clear_model_cache(self):
+        """Fragt nach, ob der Cache für konvertierte Modelle geleert werden soll."""
+        response = messagebox.askyesno(
+            "Modell-Cache leeren",
+            "Möchten Sie alle zwischengespeicherten, konvertierten Modelle löschen?\n\nDas aktuell geladene Modell bleibt erhalten. Die Originaldateien im 'models' Ordner werden nicht verändert."
+        )
+        if response:
+            freed_bytes = prune_converted_cache(keep=(self.current_converted_cache_path,))
+            self._update_cache_info_label()
+            self.update_status(f"Modell-Cache geleert ({format_bytes(freed_bytes)} freigegeben).", "green")
+
     def _reset_ui_on_load_error(self):
         """Setzt die UI-Elemente nach einem Ladefehler zurück."""
         self.pipe = None
@@ -891,14 +4180,16 @@ class ImageGeneratorApp(ctk.CTk):
         self.clear_prompt_button.configure(state="normal") # Clear-Button aktivieren
         self.generate_button.configure(state="disabled")
         self._set_settings_state("normal") # Hier auf "normal" setzen, um Eingaben wieder zu ermöglichen
-        # Die 8-Bit-Checkbox sollte ihren Zustand beibehalten, wenn die GPU verfügbar ist
-        if torch.cuda.is_available():
-            self.quantization_checkbox.configure(state="normal")
+        self.quantization_checkbox.configure(state="normal") # 8-Bit-Checkbox (GPU und CPU) wieder aktivieren
         self.is_sdxl_checkbox.configure(state="normal") # SDXL-Checkbox auch wieder aktivieren
 
 
-    def generate_image_event(self, event=None):
-        """Startet den Bildgenerierungsprozess in einem separaten Thread."""
+    def generate_image_event(self, event=None, seeds=None, draft=None):
+        """
+        Startet den Bildgenerierungsprozess in einem separaten Thread.
+        Mit seeds werden genau diese Seeds gerendert (ein Bild pro Seed), draft beschreibt dann das Entwurfsraster,
+        aus dem sie ausgewählt wurden (landet in den Metadaten).
+        """
         if not self.pipe:
             self.update_status("Bitte zuerst ein Modell laden!", "orange")
             return
@@ -910,26 +4201,65 @@ class ImageGeneratorApp(ctk.CTk):
             self.update_status("Bitte eine Bildbeschreibung eingeben!", "orange")
             return
 
+        if self.few_step_checkbox.get() and self.few_step_mode is None:
+            self.update_status("Few-Step-Modus aktiv, aber weder ein destilliertes Modell noch ein LCM-LoRA geladen.", "orange")
+            return
+
+        if self._job_queue_busy():
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, bitte warten oder weitere Prompts einreihen.", "orange")
+            return
+
+        if self.refiner_checkbox.get() and not isinstance(self.pipe, StableDiffusionXLPipeline):
+            self.update_status("Der Refiner setzt ein geladenes SDXL-Modell voraus.", "orange")
+            return
+
         # Einstellungen auslesen
         try:
-            # Überprüfe, ob "Eigene Größe verwenden" aktiv ist
-            if self.use_custom_size_checkbox.get():
-                width = int(self.custom_width_entry.get())
-                height = int(self.custom_height_entry.get())
-                if width <= 0 or height <= 0:
-                    raise ValueError("Breite und Höhe müssen positive Zahlen sein.")
-            else:
-                width = int(self.width_optionmenu.get())
-                height = int(self.height_optionmenu.get())
+            tiled = bool(self.tiled_checkbox.get())
+            width, height, size_note = self._read_image_size(tiled)
+            use_result_cache = not self.result_cache_bypass_checkbox.get()
+            shard_output = bool(self.shard_output_checkbox.get())
+            upscale = (int(self.upscale_factor_optionmenu.get()), self.upscale_method_optionmenu.get()) if self.upscale_checkbox.get() else None
+            profile_steps = int(self.profile_optionmenu.get()) if self.profile_checkbox.get() else None
+            if profile_steps:
+                use_result_cache = False # Ein Treffer würde nichts aufzeichnen
+            refiner = None
+            if self.refiner_checkbox.get():
+                if tiled:
+                    print("DEBUG: Refiner wird bei gekachelter Generierung nicht verwendet.")
+                else:
+                    refiner = (os.path.join(MODELS_DIR, self.refiner_optionmenu.get() + ".safetensors"), float(self.refiner_switch_optionmenu.get()))
+            if shard_output:
+                use_result_cache = False # Der Ergebnis-Cache verweist auf einzelne Bilddateien
+            deep_cache_interval = int(self.deep_cache_interval_optionmenu.get()) if self.deep_cache_checkbox.get() else None
+            if deep_cache_interval and tiled:
+                # Bei Kacheln gehören aufeinanderfolgende UNet-Aufrufe zu verschiedenen Bildausschnitten
+                print("DEBUG: Feature-Cache wird bei gekachelter Generierung nicht verwendet.")
+                deep_cache_interval = None
+            if deep_cache_interval and isinstance(self.pipe.unet, OnnxComponent):
+                print("DEBUG: Feature-Cache ist mit dem ONNX-Backend nicht verfügbar.")
+                deep_cache_interval = None
 
             num_inference_steps = int(self.steps_slider.get())
             guidance_scale = float(self.cfg_slider.get())
             seed_str = self.seed_entry.get().strip()
             seed = int(seed_str) if seed_str and seed_str != "-1" else -1
             selected_scheduler_name = self.scheduler_optionmenu.get()
-            num_images = int(self.num_images_entry.get()) # Anzahl der Bilder auslesen
+            if self.few_step_mode:
+                # Few-Step-Modus: Schritte und CFG auf den sinnvollen Bereich begrenzen, passenden Scheduler erzwingen
+                num_inference_steps = max(1, min(num_inference_steps, FEW_STEP_MAX_STEPS))
+                guidance_scale = max(1.0, min(guidance_scale, FEW_STEP_MAX_CFG))
+                selected_scheduler_name = self.few_step_mode["scheduler"]
+                self.scheduler_optionmenu.set(selected_scheduler_name)
+            num_images = len(seeds) if seeds else int(self.num_images_entry.get()) # Anzahl der Bilder auslesen
             if num_images <= 0:
                 raise ValueError("Anzahl der Bilder muss positiv sein.")
+            loras = self._selected_loras()
+            cfg_truncation = int(self.cfg_truncation_optionmenu.get()) / 100 if self.cfg_truncation_checkbox.get() else None
+            if guidance_scale <= 1.0:
+                # Bei CFG <= 1 entfällt der unbedingte Durchlauf ohnehin vollständig, es gibt nichts abzuschneiden
+                guidance_scale = 1.0
+                cfg_truncation = None
 
         except ValueError as e:
             self.update_status(f"Fehler in den Einstellungen: {e}. Bitte gültige Zahlen eingeben.", "red")
@@ -946,13 +4276,15 @@ class ImageGeneratorApp(ctk.CTk):
         self.clear_prompt_button.configure(state="disabled") # Clear-Button deaktivieren
         self._set_settings_state("disabled")
 
-        self.image_label.configure(image=None, text="Generiere Bild...\nDies kann je nach Hardware einige Zeit dauern.", font=ctk.CTkFont(size=16), text_color="yellow")
+        self.image_label.configure(image=None, text="Generiere Bild...\nDies kann je nach Hardware einige Zeit dauern." + size_note, font=ctk.CTkFont(size=16), text_color="yellow")
         self.start_loading_animation(base_message="Generiere Bild", mode="determinate")
 
         # Erstelle Generator für den Seed
         # Der Generator muss auf dem richtigen Gerät sein
         generator = torch.Generator(device=self.pipe.device if hasattr(self.pipe, 'device') else "cpu") 
-        if seed != -1:
+        if seeds:
+            generator = generator.manual_seed(seeds[0]) # Die Schleife verwendet die Seed-Liste
+        elif seed != -1:
             generator = generator.manual_seed(seed)
         else:
             random_seed = random.randint(0, 2**32 - 1)
@@ -961,30 +4293,216 @@ class ImageGeneratorApp(ctk.CTk):
             self.seed_entry.insert(0, str(random_seed))
 
         # Setze den ausgewählten Scheduler für die Pipeline
-        if selected_scheduler_name in self.scheduler_map:
-            # Hier müssen wir die Konfiguration des aktuellen Schedulers abrufen
-            # und dann den neuen Scheduler mit dieser Konfiguration und ggf. Karras-Optionen erstellen.
-            current_scheduler_config = self.pipe.scheduler.config
-            new_scheduler_config = dict(current_scheduler_config) # Kopie erstellen
-
-            if "Karras" in selected_scheduler_name:
-                new_scheduler_config["use_karras_sigmas"] = True
-            else:
-                # Sicherstellen, dass use_karras_sigmas auf False gesetzt ist, wenn es keine Karras-Variante ist
-                if "use_karras_sigmas" in new_scheduler_config:
-                    new_scheduler_config["use_karras_sigmas"] = False
+        self._set_pipeline_scheduler(selected_scheduler_name)
+
+        self.generation_thread = threading.Thread(target=self._generate_images_thread_loop, 
+                                                  args=(prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, generator, num_images, tiled, use_result_cache, deep_cache_interval, loras, cfg_truncation, shard_output, profile_steps, upscale, refiner, seeds, draft))
+        self.generation_thread.start()
 
-            self.pipe.scheduler = self.scheduler_map[selected_scheduler_name].from_config(new_scheduler_config)
+    def _read_image_size(self, tiled=False):
+        """
+        Liest die gewählte Bildgröße, prüft sie und rundet auf die Latent-Schrittweite. Gibt (Breite, Höhe, Hinweistext) zurück.
+        Ohne Kachelung (tiled=False) sind höchstens MAX_UNTILED_IMAGE_SIDE Pixel pro Kante erlaubt.
+        """
+        # Überprüfe, ob "Eigene Größe verwenden" aktiv ist
+        if self.use_custom_size_checkbox.get():
+            width = int(self.custom_width_entry.get())
+            height = int(self.custom_height_entry.get())
+            if width <= 0 or height <= 0:
+                raise ValueError("Breite und Höhe müssen positive Zahlen sein.")
         else:
+            width = int(self.width_optionmenu.get())
+            height = int(self.height_optionmenu.get())
+
+        # Größe vorab prüfen und auf die Latent-Schrittweite runden, statt in der Pipeline zu scheitern
+        requested_size = (width, height)
+        width, height = snap_to_latent_stride(width), snap_to_latent_stride(height)
+        if min(width, height) < MIN_IMAGE_SIDE or max(width, height) > MAX_IMAGE_SIDE:
+            raise ValueError(f"Breite und Höhe müssen zwischen {MIN_IMAGE_SIDE} und {MAX_IMAGE_SIDE} Pixeln liegen.")
+        if not tiled and max(width, height) > MAX_UNTILED_IMAGE_SIDE:
+            raise ValueError(f"Über {MAX_UNTILED_IMAGE_SIDE} Pixel pro Kante bitte die Kachelung aktivieren.")
+        size_note = ""
+        if (width, height) != requested_size:
+            size_note = f"\n(Größe auf {width}x{height} angepasst, Vielfaches von {LATENT_STRIDE})"
+            print(f"DEBUG: Bildgröße von {requested_size[0]}x{requested_size[1]} auf {width}x{height} gerundet.")
+        return width, height, size_note
+
+    def _set_pipeline_scheduler(self, selected_scheduler_name):
+        """Setzt den gewählten Scheduler für die Pipeline (ausgehend von der Originalkonfiguration des Modells)."""
+        if selected_scheduler_name not in self.scheduler_map:
             self.update_status(f"Unbekannter Scheduler: {selected_scheduler_name}. Verwende Standard-Scheduler.", "orange")
+            return
+        # Hier müssen wir die Konfiguration des aktuellen Schedulers abrufen
+        # und dann den neuen Scheduler mit dieser Konfiguration und ggf. Karras-Optionen erstellen.
+        # Ausgangspunkt ist die Originalkonfiguration des Modells, damit z.B. "trailing" nicht hängen bleibt.
+        current_scheduler_config = self.base_scheduler_config or self.pipe.scheduler.config
+        new_scheduler_config = dict(current_scheduler_config) # Kopie erstellen
+
+        if "Karras" in selected_scheduler_name:
+            new_scheduler_config["use_karras_sigmas"] = True
+        else:
+            # Sicherstellen, dass use_karras_sigmas auf False gesetzt ist, wenn es keine Karras-Variante ist
+            if "use_karras_sigmas" in new_scheduler_config:
+                new_scheduler_config["use_karras_sigmas"] = False
+        if "Trailing" in selected_scheduler_name:
+            # Turbo- und Lightning-Modelle sind auf die letzten Zeitschritte destilliert
+            new_scheduler_config["timestep_spacing"] = "trailing"
 
-        self.generation_thread = threading.Thread(target=self._generate_images_thread_loop, 
-                                                  args=(prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, generator, num_images))
-        self.generation_thread.start()
+        self.pipe.scheduler = self.scheduler_map[selected_scheduler_name].from_config(new_scheduler_config)
+
+    def _job_queue_busy(self):
+        return self.job_queue_thread is not None and self.job_queue_thread.is_alive()
+
+    def enqueue_job_event(self):
+        """
+        Reiht den aktuellen Prompt mit den Grundeinstellungen (Größe, Schritte, CFG, Scheduler, Seed, LoRAs) ein,
+        ein Auftrag pro Bild. Kachelung, Feature-Cache, CFG-Abschneiden, Profiling, Hochskalieren, Shards und
+        der SDXL-Refiner gelten nur für "Bild generieren".
+        """
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        prompt = self.prompt_entry.get().strip()
+        negative_prompt = self.negative_prompt_entry.get().strip()
+        if not prompt:
+            self.update_status("Bitte eine Bildbeschreibung eingeben!", "orange")
+            return
+        try:
+            width, height, _ = self._read_image_size()
+            num_inference_steps = int(self.steps_slider.get())
+            guidance_scale = max(1.0, float(self.cfg_slider.get()))
+            seed_str = self.seed_entry.get().strip()
+            seed = int(seed_str) if seed_str and seed_str != "-1" else -1
+            num_images = int(self.num_images_entry.get())
+            if num_images <= 0:
+                raise ValueError("Anzahl der Bilder muss positiv sein.")
+        except ValueError as e:
+            self.update_status(f"Fehler in den Einstellungen: {e}. Bitte gültige Zahlen eingeben.", "red")
+            return
+        scheduler_name = self.scheduler_optionmenu.get()
+        if self.few_step_mode:
+            num_inference_steps = max(1, min(num_inference_steps, FEW_STEP_MAX_STEPS))
+            guidance_scale = max(1.0, min(guidance_scale, FEW_STEP_MAX_CFG))
+            scheduler_name = self.few_step_mode["scheduler"]
+        loras = self._selected_loras()
+        base_seed = seed if seed != -1 else random.randint(0, 2**32 - 1)
+
+        with self.job_queue_condition:
+            self.job_batch_limits = (int(self.job_batch_size_optionmenu.get()), float(self.job_batch_wait_optionmenu.get()))
+            for i in range(num_images):
+                self.job_queue.append({
+                    "prompt": prompt,
+                    "negative_prompt": negative_prompt,
+                    "width": width,
+                    "height": height,
+                    "steps": num_inference_steps,
+                    "cfg": guidance_scale,
+                    "scheduler": scheduler_name,
+                    "loras": loras,
+                    "seed": (base_seed + i) % 2**32,
+                    # Nur Aufträge mit gleichem Schlüssel passen in denselben UNet-Stapel. SDXL setzt die Negativ-Embeddings
+                    # nur bei None auf Null, leere und gesetzte Negativ-Prompts dürfen daher nicht gemischt werden.
+                    "batch_key": (width, height, num_inference_steps, round(guidance_scale, 4), scheduler_name, tuple(loras), bool(negative_prompt)),
+                    "queued_at": time.monotonic(),
+                })
+            pending = len(self.job_queue)
+            self.job_queue_condition.notify()
+            if not self._job_queue_busy():
+                self.job_queue_thread = threading.Thread(target=self._job_queue_worker, daemon=True)
+                self.job_queue_thread.start()
+        self.generate_button.configure(state="disabled")
+        self.job_queue_info_label.configure(text=f"Warteschlange: {pending} Auftrag/Aufträge wartend")
+        self.update_status(f"{num_images} Auftrag/Aufträge eingereiht ({pending} wartend).", "blue")
+
+    def _job_queue_worker(self):
+        """Arbeitet die Warteschlange ab: plant Stapel kompatibler Aufträge und generiert sie gemeinsam."""
+        while True:
+            with self.job_queue_condition:
+                while True:
+                    max_batch_size, max_wait_seconds = self.job_batch_limits
+                    batch, wait_seconds = plan_job_batch(self.job_queue, max_batch_size, max_wait_seconds, time.monotonic())
+                    if batch:
+                        self.job_queue = [job for job in self.job_queue if not any(job is batch_job for batch_job in batch)]
+                        pending = len(self.job_queue)
+                        break
+                    if wait_seconds is None:
+                        self.job_queue_thread = None # Leer: der nächste eingereihte Auftrag startet einen neuen Worker
+                        self.after(0, lambda: self.job_queue_info_label.configure(text="Warteschlange: leer"))
+                        self.after(0, lambda: self.generate_button.configure(state="normal"))
+                        return
+                    self.job_queue_condition.wait(timeout=wait_seconds)
+            self.after(0, lambda count=len(batch), pending=pending: self.job_queue_info_label.configure(text=f"Warteschlange: Stapel mit {count} Auftrag/Aufträgen läuft, {pending} wartend"))
+            if self.generation_thread and self.generation_thread.is_alive():
+                self.generation_thread.join() # Nie gleichzeitig mit "Bild generieren" auf der Pipeline rechnen
+            try:
+                self._run_job_batch(batch)
+            except Exception as e:
+                print(f"FEHLER: Stapel mit {len(batch)} Aufträgen fehlgeschlagen: {e}")
+                traceback.print_exc()
+                self.after(0, self.update_status, f"Fehler im Warteschlangen-Stapel: {e}", "red")
+            self.after(0, self._update_gallery_if_open)
+
+    def _run_job_batch(self, batch):
+        """
+        Generiert einen Stapel kompatibler Aufträge mit einem Pipeline-Aufruf: Prompts und Negativ-Prompts werden
+        als Liste übergeben, jeder Auftrag behält seinen eigenen Generator (gleiches Startrauschen wie einzeln).
+        Die Latents werden danach aufgeteilt, einzeln dekodiert und wie gewohnt gespeichert.
+        Reicht der Speicher nicht, wird der Stapel halbiert.
+        """
+        first = batch[0]
+        self._set_pipeline_scheduler(first["scheduler"])
+        if first["loras"] != self.active_loras and not self._apply_loras(first["loras"]):
+            return
+        generator_device = self.pipe.device if hasattr(self.pipe, 'device') else "cpu"
+        generators = [torch.Generator(device=generator_device).manual_seed(job["seed"]) for job in batch]
+        attention_backend = self._select_attention_backend(first["width"], first["height"], len(batch) * (2 if first["cfg"] > 1.0 else 1))
+        self.after(0, self.update_status, f"Generiere Stapel mit {len(batch)} Auftrag/Aufträgen...", "blue")
+        start_time = time.time()
+        try:
+            pipeline_output = self.pipe(
+                prompt=[job["prompt"] for job in batch],
+                negative_prompt=[job["negative_prompt"] for job in batch] if first["negative_prompt"] else None, # Wie einzeln: leer -> None
+                width=first["width"],
+                height=first["height"],
+                num_inference_steps=first["steps"],
+                guidance_scale=first["cfg"],
+                generator=generators,
+                output_type="latent",
+                callback_on_step_end=self._make_step_callback(0, 1),
+            )
+        except torch.cuda.OutOfMemoryError:
+            if len(batch) == 1:
+                raise
+            print(f"DEBUG: Stapel mit {len(batch)} Aufträgen passt nicht in den Speicher, wird halbiert.")
+            torch.cuda.empty_cache()
+            half = len(batch) // 2
+            self._run_job_batch(batch[:half])
+            self._run_job_batch(batch[half:])
+            return
+        denoise_seconds = (time.time() - start_time) / len(batch)
+        print(f"DEBUG: Stapel mit {len(batch)} Aufträgen in {time.time() - start_time:.2f} s entrauscht.")
+
+        for index, (job, latents) in enumerate(zip(batch, pipeline_output.images.split(1))):
+            decode_start_time = time.time()
+            pixels = self._decode_latents(latents, output_type="np")[0]
+            finished_job = {
+                "index": index, "seed": job["seed"], "spec": None, "cache_key": None, "owns_cache_key": False,
+                "cached_filepath": None, "pixels": pixels, "image": None,
+                "denoise_seconds": denoise_seconds, "decode_seconds": time.time() - decode_start_time,
+                "deep_cache_summary": None, "profile_files": [],
+            }
+            run = {
+                "prompt": job["prompt"], "negative_prompt": job["negative_prompt"], "width": job["width"], "height": job["height"],
+                "steps": job["steps"], "cfg": job["cfg"], "cfg_guided_steps": job["steps"] if job["cfg"] > 1.0 else 0,
+                "scheduler": job["scheduler"], "tiled": False, "deep_cache": None, "num_images": len(batch),
+                "shard_writer": None, "upscale_factor": None, "upscaler": None, "batch_size": len(batch), "attention": attention_backend, "completed": 0,
+            }
+            self._finish_job(finished_job, run)
+        self.after(0, self._update_progress_bar, 1.0, "100% (Fertig)")
 
     def _progress_callback(self, pipeline_instance, step, timestep, callback_kwargs): # Angepasste Signatur
         """Callback-Funktion für den Fortschritt der Bildgenerierung."""
-        total_steps_per_image = int(self.steps_slider.get())
+        total_steps_per_image = callback_kwargs.get("total_steps") or int(self.steps_slider.get())
         
         # Extract context from callback_kwargs
         current_image_index = callback_kwargs.get("current_image_index", 0)
@@ -1024,135 +4542,1206 @@ class ImageGeneratorApp(ctk.CTk):
         
         return callback_kwargs # Wichtig: Rückgabe von callback_kwargs
 
+    def _make_step_callback(self, image_index, total_images, guided_steps=None, step_offset=0, total_steps=None):
+        """
+        Erstellt den Schritt-Callback für ein Bild: meldet den Fortschritt und schaltet nach guided_steps
+        Schritten die CFG ab. Dazu wird die Guidance-Skala der Pipeline auf 0 gesetzt und nur noch die
+        bedingte Hälfte der Embeddings weitergegeben, sodass jeder weitere Schritt nur einen UNet-Durchlauf braucht.
+        step_offset verschiebt die Fortschrittsanzeige (Refiner: Schritte nach denen des Basismodells), total_steps
+        ersetzt die Schrittzahl des Reglers, wenn tatsächlich weniger Schritte laufen (Inpainting mit Stärke < 1).
+        """
+        def step_callback(pipeline_instance, step, timestep, callback_kwargs):
+            self._progress_callback(pipeline_instance, step + step_offset, timestep, {"current_image_index": image_index, "total_images": total_images, "total_steps": total_steps})
+            outputs = {}
+            if guided_steps is not None and step + 1 == guided_steps and pipeline_instance.do_classifier_free_guidance:
+                pipeline_instance._guidance_scale = 0.0
+                for name in ("prompt_embeds", "add_text_embeds", "add_time_ids"):
+                    if name in callback_kwargs:
+                        outputs[name] = callback_kwargs[name].chunk(2)[-1] # Reihenfolge in den Pipelines: [unbedingt, bedingt]
+            return outputs
+        return step_callback
+
+    def _step_callback_tensor_inputs(self, guided_steps):
+        """Tensoren, die der Schritt-Callback für das CFG-Abschneiden ersetzen muss."""
+        if guided_steps is None:
+            return ["latents"]
+        if isinstance(self.pipe, StableDiffusionXLPipeline):
+            return ["latents", "prompt_embeds", "add_text_embeds", "add_time_ids"]
+        return ["latents", "prompt_embeds"]
+
+    def _start_cfg_benchmark(self):
+        """
+        Vergleicht mit den aktuellen Einstellungen (Prompt, Größe, Schritte, CFG, Seed) volle CFG, CFG-Abschneiden
+        und CFG 1.0: Dauer und Abweichung zum Bild mit voller CFG. Der Bericht landet in output/benchmarks.
+        """
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        prompt = self.prompt_entry.get().strip()
+        if not prompt:
+            self.update_status("Bitte eine Bildbeschreibung eingeben!", "orange")
+            return
+        guidance_scale = float(self.cfg_slider.get())
+        if guidance_scale <= 1.0:
+            self.update_status("Der CFG-Benchmark braucht eine CFG-Skala größer als 1.", "orange")
+            return
+        if self._job_queue_busy():
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, CFG-Benchmark danach möglich.", "orange")
+            return
+        try:
+            width, height, _ = self._read_image_size() # Eigene Größe, Grenzen und Latent-Schrittweite wie beim Generieren
+        except ValueError as e:
+            self.update_status(f"Fehler in den Einstellungen: {e}", "red")
+            return
+        seed_str = self.seed_entry.get().strip()
+        seed = int(seed_str) if seed_str.lstrip("-").isdigit() and seed_str != "-1" else 0
+        fraction = int(self.cfg_truncation_optionmenu.get()) / 100
 
-    def _generate_images_thread_loop(self, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, generator, num_images):
-        """Schleife für die Generierung mehrerer Bilder."""
-        # generated_images_data wird hier nicht mehr benötigt, da Bilder direkt gespeichert werden
-        # generated_images_data = [] 
+        self.generate_button.configure(state="disabled")
+        self._set_settings_state("disabled")
+        self.start_loading_animation(base_message="CFG-Benchmark", mode="determinate")
+        self.generation_thread = threading.Thread(target=self._cfg_benchmark_thread, daemon=True,
+                                                  args=(prompt, self.negative_prompt_entry.get().strip(), width, height, int(self.steps_slider.get()), guidance_scale, seed, fraction))
+        self.generation_thread.start()
 
-        for i in range(num_images):
-            if self.stop_event.is_set():
-                self.after(0, self.update_status, f"Generierung von Bild {i+1}/{num_images} abgebrochen.", "orange")
-                break
+    def _cfg_benchmark_thread(self, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, seed, fraction):
+        """Führt die drei CFG-Varianten mit festem Seed aus und schreibt den Bericht."""
+        guided_steps = guided_step_count(num_inference_steps, fraction)
+        variants = [
+            ("voll", guidance_scale, None),
+            (f"abgeschnitten nach {guided_steps}/{num_inference_steps} Schritten", guidance_scale, guided_steps),
+            ("CFG 1.0 (ohne unbedingten Durchlauf)", 1.0, None),
+        ]
+        results = []
+        reference = None
+        try:
+            # Aufwärmlauf, damit die erste Variante nicht die Initialisierung mitmisst
+            self.pipe(prompt=prompt, negative_prompt=negative_prompt or None, width=width, height=height, num_inference_steps=1, guidance_scale=guidance_scale, output_type="np")
+            for index, (name, cfg, variant_guided_steps) in enumerate(variants):
+                generator = torch.Generator(device=self.pipe.device if hasattr(self.pipe, 'device') else "cpu").manual_seed(seed)
+                start_time = time.perf_counter()
+                image = self.pipe(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt or None,
+                    width=width,
+                    height=height,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=cfg,
+                    generator=generator,
+                    output_type="np",
+                    callback_on_step_end=self._make_step_callback(index, len(variants), variant_guided_steps),
+                    callback_on_step_end_tensor_inputs=self._step_callback_tensor_inputs(variant_guided_steps),
+                ).images[0]
+                seconds = time.perf_counter() - start_time
+                if reference is None:
+                    reference = image
+                mean_abs_diff, psnr = image_difference(image, reference)
+                results.append({
+                    "variant": name,
+                    "cfg": cfg,
+                    "cfg_guided_steps": variant_guided_steps if variant_guided_steps is not None else (num_inference_steps if cfg > 1.0 else 0),
+                    "seconds": round(seconds, 3),
+                    "speedup": round(results[0]["seconds"] / seconds, 3) if results else 1.0,
+                    "mean_abs_diff": round(mean_abs_diff, 5),
+                    "psnr_db": round(psnr, 2) if psnr != float("inf") else None,
+                })
+                print(f"DEBUG: CFG-Benchmark {name}: {seconds:.2f}s, Abweichung {mean_abs_diff:.4f}, PSNR {psnr:.1f} dB")
+        except StopIteration:
+            self.after(0, self.update_status, "CFG-Benchmark abgebrochen.", "orange")
+        except Exception as e:
+            traceback.print_exc()
+            self.after(0, self.update_status, f"CFG-Benchmark fehlgeschlagen: {e}", "red")
+        else:
+            report = {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "model": self.current_model_name,
+                "pipeline": self.pipeline_variant,
+                "prompt": prompt,
+                "width": width,
+                "height": height,
+                "steps": num_inference_steps,
+                "seed": seed,
+                "results": results,
+            }
+            try:
+                os.makedirs(BENCHMARK_DIR, exist_ok=True)
+                report_path = os.path.join(BENCHMARK_DIR, f"cfg_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+                with open(report_path, "w", encoding="utf-8") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=4)
+            except OSError as e:
+                print(f"FEHLER: CFG-Benchmark-Bericht konnte nicht gespeichert werden: {e}")
+            summary = " | ".join(f"{result['variant']}: {result['seconds']:.1f}s" + (f" ({result['speedup']:.2f}x, PSNR {result['psnr_db']:.1f} dB)" if result["psnr_db"] is not None else "") for result in results[1:])
+            self.after(0, self.update_status, f"CFG-Benchmark (voll: {results[0]['seconds']:.1f}s) – {summary}", "green")
+        finally:
+            self.after(0, self.stop_loading_animation)
+            self.after(0, lambda: self.generate_button.configure(state="normal"))
+            self.after(0, lambda: self._set_settings_state("normal"))
 
-            self.after(0, lambda idx=i, total=num_images: self.image_label.configure(text=f"Generiere Bild {idx+1} von {total}...")) # Zeigt im Bildbereich an, Korrektur des lambda
-            self.after(0, self._update_progress_bar, (i / num_images), f"{int((i / num_images) * 100)}%") # Setze Fortschritt für jedes neue Bild zurück auf den Beginn des aktuellen Bildes
-            self.after(0, lambda: self.image_label.configure(image=None)) # Leere das Bildfeld vor neuer Generierung
+    def _find_tuning_profile(self, model_path, is_sdxl):
+        """Sucht das Tuning-Profil des Modells für die gewählte Bildgröße (sonst das zuletzt gemessene)."""
+        if not load_tuning_profiles():
+            return None # Ohne Profile muss auch kein Hash berechnet werden
+        model_hash = compute_model_hash(model_path)
+        try:
+            width, height, _ = self._read_image_size()
+        except ValueError:
+            width = height = None
+        profile = find_tuning_profile(tuning_profile_key(model_hash, self.device, is_sdxl), width, height)
+        if profile:
+            print(f"DEBUG: Tuning-Profil für {profile['width']}x{profile['height']} gefunden: {describe_load_settings(profile['settings'])}")
+        return profile
+
+    def _update_autotune_info_label(self):
+        """Zeigt das beim Laden angewendete Tuning-Profil an."""
+        if self.tuning_profile:
+            profile = self.tuning_profile
+            self.autotune_info_label.configure(text=f"Profil {profile['width']}x{profile['height']} aktiv ({profile['speedup']:.2f}x): {describe_load_settings(profile['settings'])}")
+        else:
+            self.autotune_info_label.configure(text="Kein Tuning-Profil aktiv")
 
-            current_seed = generator.initial_seed() # Den aktuellen Seed für dieses Bild abrufen
-            current_generator = torch.Generator(device=generator.device).manual_seed(current_seed) # Neuen Generator mit diesem Seed erstellen
+    def _start_autotune(self):
+        """
+        Misst für das geladene Modell und die gewählte Bildgröße verschiedene Einstellungen (Threads, Attention,
+        channels_last, Offloading, VAE-Slicing/-Tiling, torch.compile, Datentyp) und speichert die schnellste,
+        die in den Speicher passt, als Profil. Danach wird das Modell mit diesem Profil neu geladen.
+        """
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        if self._job_queue_busy():
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, Auto-Tuning danach möglich.", "orange")
+            return
+        if not self.pipeline_variant.endswith("/full"):
+            self.update_status("Auto-Tuning ist nur ohne Quantisierung und ohne ONNX-Backend möglich.", "orange")
+            return
+        if getattr(self.pipe.unet, "_compiled_by_settings", False):
+            self.update_status("Das UNet ist per Tuning-Profil kompiliert. Bitte ohne Tuning-Profil neu laden und dann tunen.", "orange")
+            return
+        try:
+            width, height, _ = self._read_image_size()
+        except ValueError as e:
+            self.update_status(f"Ungültige Bildgröße: {e}", "red")
+            return
 
-            start_time = time.time() # Startzeit für Generierungsdauer
+        self.generate_button.configure(state="disabled")
+        self.load_model_button.configure(state="disabled")
+        self.model_optionmenu.configure(state="disabled")
+        self._set_settings_state("disabled")
+        self.start_loading_animation(base_message="Auto-Tuning", mode="determinate")
+        self.generation_thread = threading.Thread(target=self._autotune_thread, args=(width, height, bool(self.is_sdxl_checkbox.get())), daemon=True)
+        self.generation_thread.start()
+
+    def _autotune_thread(self, width, height, is_sdxl):
+        """
+        Koordinatensuche: ausgehend von den Standard-Optimierungen wird jede Einstellung einzeln variiert und der
+        beste Wert beibehalten. Kandidaten mit Fehler (z.B. zu wenig Speicher), zu hohem VRAM-Bedarf oder
+        abweichendem Testbild scheiden aus.
+        """
+        device = self.device
+        settings = default_load_settings(device)
+        settings["threads"] = torch.get_num_threads()
+        settings["dtype"] = str(self.pipe.unet.dtype).replace("torch.", "")
+        candidates = autotune_candidates(device)
+        total_trials = 1 + sum(len([value for value in values if value != settings[name]]) for name, values in candidates)
+        memory_budget = torch.cuda.get_device_properties(0).total_memory * AUTOTUNE_MEMORY_FRACTION if device == "cuda" else None
+        results = []
+        # torch.compile wird als Hülle um das UNet gemessen, die unkompilierte Referenz bleibt für den Rückweg erhalten
+        uncompiled_unet = self.pipe.unet
+        compiled_unet = None
+
+        def use_compiled_unet(compiled):
+            nonlocal compiled_unet
+            if compiled and compiled_unet is None:
+                compiled_unet = torch.compile(uncompiled_unet)
+            self.pipe.unet = compiled_unet if compiled else uncompiled_unet
 
+        try:
+            if remove_token_merging(self.pipe.unet): # ToMe würde die Messungen verfälschen
+                self.token_merging_ratio = None
+            apply_pipeline_settings(self.pipe, settings, device)
+            best_seconds, peak_bytes, reference = measure_pipeline_speed(self.pipe, width, height)
+            baseline_seconds = best_seconds
+            best_peak_bytes = peak_bytes
+            results.append({"settings": dict(settings), "seconds": round(best_seconds, 3), "peak_bytes": peak_bytes, "psnr_db": None, "status": "Ausgangszustand"})
+            print(f"DEBUG: Auto-Tuning Ausgangszustand: {best_seconds:.2f}s ({describe_load_settings(settings)})")
+            self.after(0, self._update_progress_bar, 1 / total_trials, f"1/{total_trials}")
+
+            for name, values in candidates:
+                current_value = settings[name] # Schon gemessen
+                for value in values:
+                    if value == current_value:
+                        continue
+                    if self.stop_event.is_set():
+                        raise StopIteration
+                    trial = dict(settings, **{name: value})
+                    try:
+                        if name == "dtype":
+                            self.pipe.to(dtype=getattr(torch, value))
+                        use_compiled_unet(trial["compile"])
+                        apply_pipeline_settings(self.pipe, dict(trial, compile=False), device)
+                        seconds, peak_bytes, image = measure_pipeline_speed(self.pipe, width, height)
+                    except Exception as e:
+                        print(f"FEHLER: Auto-Tuning {name}={value} fehlgeschlagen: {e}")
+                        results.append({"settings": trial, "seconds": None, "peak_bytes": None, "psnr_db": None, "status": f"Fehler: {e}"})
+                        if torch.cuda.is_available():
+                            torch.cuda.empty_cache()
+                    else:
+                        _, psnr = image_difference(image, reference)
+                        if memory_budget is not None and peak_bytes > memory_budget:
+                            status = "zu viel Speicher"
+                        elif psnr < AUTOTUNE_MIN_PSNR:
+                            status = "Bild weicht ab"
+                        elif seconds < best_seconds * (1 - AUTOTUNE_MIN_GAIN):
+                            status = "schneller"
+                            settings, best_seconds, best_peak_bytes = trial, seconds, peak_bytes
+                        else:
+                            status = "nicht schneller"
+                        results.append({"settings": trial, "seconds": round(seconds, 3), "peak_bytes": peak_bytes, "psnr_db": round(psnr, 2) if psnr != float("inf") else None, "status": status})
+                        print(f"DEBUG: Auto-Tuning {name}={value}: {seconds:.2f}s, PSNR {psnr:.1f} dB -> {status}")
+                    self.after(0, self._update_progress_bar, len(results) / total_trials, f"{len(results)}/{total_trials}")
+                if name != "dtype": # Nach dem Datentyp wird ohnehin neu geladen
+                    use_compiled_unet(settings["compile"])
+                    apply_pipeline_settings(self.pipe, dict(settings, compile=False), device)
+        except StopIteration:
+            self.after(0, self.update_status, "Auto-Tuning abgebrochen.", "orange")
+        except Exception as e:
+            traceback.print_exc()
+            self.after(0, self.update_status, f"Auto-Tuning fehlgeschlagen: {e}", "red")
+        else:
+            profile = {
+                "settings": settings,
+                "width": width,
+                "height": height,
+                "seconds": round(best_seconds, 3),
+                "baseline_seconds": round(baseline_seconds, 3),
+                "speedup": round(baseline_seconds / best_seconds, 3),
+                "peak_bytes": best_peak_bytes,
+                "steps": AUTOTUNE_STEPS,
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "model": self.current_model_name,
+                "device_name": autotune_device_name(device),
+                "torch": torch.__version__,
+            }
             try:
-                pipeline_output = self.pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt if negative_prompt else None, # Übergebe None, wenn leer
-                    width=width,
-                    height=height,
-                    num_inference_steps=num_inference_steps,
+                save_tuning_profile(tuning_profile_key(self._model_hash(), device, is_sdxl), profile)
+                os.makedirs(BENCHMARK_DIR, exist_ok=True)
+                report_path = os.path.join(BENCHMARK_DIR, f"autotune_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+                with open(report_path, "w", encoding="utf-8") as f:
+                    json.dump(dict(profile, results=results), f, ensure_ascii=False, indent=4)
+            except OSError as e:
+                print(f"FEHLER: Tuning-Profil konnte nicht gespeichert werden: {e}")
+            self.after(0, self.update_status, f"Auto-Tuning: {baseline_seconds:.2f}s -> {best_seconds:.2f}s ({profile['speedup']:.2f}x) mit {describe_load_settings(settings)}. Lade Modell neu...", "green")
+        finally:
+            # Die Messungen haben die Pipeline verändert (Datentyp, ToMe): neu laden, dabei greift das gespeicherte Profil
+            self.after(0, self._reload_after_autotune)
+
+    def _reload_after_autotune(self):
+        """Lädt das gerade getunte Modell neu."""
+        self.stop_loading_animation()
+        self.model_optionmenu.set(self.current_model_name)
+        self.load_model()
+
+
+    def _start_drafts(self):
+        """
+        Erzeugt ein Raster schneller Entwürfe (wenige Schritte, kleine Auflösung) für mehrere Seeds mit dem
+        aktuellen Prompt. Ausgewählte Entwürfe werden danach mit allen Einstellungen und ihren Seeds final gerendert.
+        """
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        if isinstance(self.pipe.unet, OnnxComponent):
+            self.update_status("Entwürfe sind mit dem ONNX-Backend nicht verfügbar.", "orange")
+            return
+        prompt = self.prompt_entry.get().strip()
+        if not prompt:
+            self.update_status("Bitte eine Bildbeschreibung eingeben!", "orange")
+            return
+        if self._job_queue_busy():
+            self.update_status("Die Warteschlange wird gerade abgearbeitet, bitte warten.", "orange")
+            return
+        try:
+            width, height, _ = self._read_image_size()
+        except ValueError as e:
+            self.update_status(f"Fehler in den Einstellungen: {e}", "red")
+            return
+        guidance_scale = max(1.0, float(self.cfg_slider.get()))
+        scheduler_name = self.scheduler_optionmenu.get()
+        if self.few_step_mode:
+            guidance_scale = min(guidance_scale, FEW_STEP_MAX_CFG)
+            scheduler_name = self.few_step_mode["scheduler"]
+        draft_steps = max(1, min(int(self.steps_slider.get()), DRAFT_STEPS))
+        seed_str = self.seed_entry.get().strip()
+        base_seed = int(seed_str) if seed_str.lstrip("-").isdigit() and seed_str != "-1" else random.randint(0, 2**32 - 1)
+        seeds = [(base_seed + i) % 2**32 for i in range(int(self.draft_count_optionmenu.get()))]
+        self._set_pipeline_scheduler(scheduler_name)
+
+        self.generate_button.configure(state="disabled")
+        self._set_settings_state("disabled")
+        self.start_loading_animation(base_message="Entwürfe", mode="determinate")
+        self.generation_thread = threading.Thread(target=self._draft_thread, daemon=True,
+                                                  args=(prompt, self.negative_prompt_entry.get().strip(), width, height, draft_steps, guidance_scale, seeds, scheduler_name))
+        self.generation_thread.start()
+
+    def _draft_thread(self, prompt, negative_prompt, width, height, draft_steps, guidance_scale, seeds, scheduler_name):
+        """
+        Entrauscht die Entwürfe in Stapeln mit einmal kodiertem Prompt. Das Startrauschen jedes Entwurfs ist das
+        verkleinerte Rauschen des finalen Bildes mit demselben Seed, damit die Bildaufteilung erhalten bleibt.
+        """
+        start_time = time.time()
+        try:
+            pipe = self.pipe
+            device = pipe._execution_device
+            dtype = self._prompt_dtype()
+            generator_device = pipe.device if hasattr(pipe, 'device') else "cpu"
+            scale_factor = pipe.vae_scale_factor
+            latent_shape = (1, pipe.unet.config.in_channels, height // scale_factor, width // scale_factor)
+            attention_backend = self._select_attention_backend(width // DRAFT_DOWNSCALE, height // DRAFT_DOWNSCALE, min(DRAFT_BATCH_SIZE, len(seeds)) * (2 if guidance_scale > 1.0 else 1))
+
+            # Prompt einmal kodieren, alle Stapel verwenden die Embeddings wieder
+            with torch.no_grad():
+                encoded = pipe.encode_prompt(prompt=prompt, device=device, num_images_per_prompt=1, do_classifier_free_guidance=guidance_scale > 1.0, negative_prompt=negative_prompt or None)
+            embeddings = {"prompt_embeds": encoded[0], "negative_prompt_embeds": encoded[1]}
+            if len(encoded) == 4: # SDXL: zusätzlich die gepoolten Embeddings
+                embeddings.update({"pooled_prompt_embeds": encoded[2], "negative_pooled_prompt_embeds": encoded[3]})
+
+            images = []
+            for start in range(0, len(seeds), DRAFT_BATCH_SIZE):
+                if self.stop_event.is_set():
+                    raise StopIteration
+                batch_seeds = seeds[start:start + DRAFT_BATCH_SIZE]
+                generators, noises = [], []
+                for seed in batch_seeds:
+                    generator = torch.Generator(device=generator_device).manual_seed(seed)
+                    noises.append(downscale_noise(randn_tensor(latent_shape, generator=generator, device=device, dtype=dtype), DRAFT_DOWNSCALE))
+                    generators.append(generator) # Weiter wie im finalen Lauf (Rauschen für Ancestral-Sampler)
+                latents = torch.cat(noises)
+                pipeline_output = pipe(
+                    width=latents.shape[-1] * scale_factor,
+                    height=latents.shape[-2] * scale_factor,
+                    num_inference_steps=draft_steps,
                     guidance_scale=guidance_scale,
-                    generator=current_generator, # Verwende den spezifischen Generator
-                    callback_on_step_end=self._progress_callback,
-                    callback_on_step_end_user_data={"callback_steps": 1, "current_image_index": i, "total_images": num_images} # Pass context data
+                    num_images_per_prompt=len(batch_seeds),
+                    generator=generators,
+                    latents=latents,
+                    output_type="latent",
+                    **embeddings,
                 )
-                
-                end_time = time.time() # Endzeit für Generierungsdauer
-                generation_duration = end_time - start_time
-
-                if pipeline_output and hasattr(pipeline_output, 'images') and \
-                   isinstance(pipeline_output.images, list) and len(pipeline_output.images) > 0 and \
-                   isinstance(pipeline_output.images[0], Image.Image): # Überprüfe, ob es ein PIL-Bild ist
-                    
-                    image = pipeline_output.images[0]
-                    self.current_generated_image = image # Speichert das PIL-Image
-                    self.current_image_seed = current_seed # Speichere den tatsächlichen Seed
-                    self.after(0, self._display_generated_image, image) # Zeige das finale Bild an
-                    self.after(0, self.update_status, f"Bild {i+1}/{num_images} erfolgreich generiert!", "green")
-                    # Der Fortschrittsbalken wird bereits durch den Callback auf den korrekten Wert gesetzt.
-                    # Dies stellt sicher, dass er am Ende des Bildes auf den korrekten Gesamtprozentsatz springt.
-                    # self.after(0, self._update_progress_bar, 1.0, "100%") # DIESE ZEILE ENTFERNEN
-
-                    # Automatisch das Bild speichern
-                    self.after(0, self.save_current_image_to_default_folder) # Rufe die automatische Speicherfunktion auf
-                    
-                    # Aktualisiere die Details unter dem Bild
-                    self.after(0, lambda: self.details_prompt_label.configure(text=f"Prompt: {prompt}"))
-                    self.after(0, lambda: self.details_negative_prompt_label.configure(text=f"Negativ: {negative_prompt if negative_prompt else 'Kein negativer Prompt'}"))
-                    self.after(0, lambda: self.details_params_label.configure(text=f"Größe: {width}x{height} | Schritte: {num_inference_steps} | CFG: {guidance_scale:.1f} | Seed: {self.current_image_seed} | Scheduler: {self.scheduler_optionmenu.get()}"))
-                    self.after(0, lambda: self.details_generation_time_label.configure(text=f"Dauer: {generation_duration:.2f} Sekunden")) # Anzeige der Dauer
-
-                    # Füge den Prompt zum Verlauf hinzu
-                    self.after(0, self._add_to_prompt_history, prompt, negative_prompt)
+                images.extend(Image.fromarray(pixels) for pixels in self._decode_latents(pipeline_output.images, output_type="np"))
+                self.after(0, self._update_progress_bar, len(images) / len(seeds), f"{len(images)}/{len(seeds)} Entwürfe")
+            duration = time.time() - start_time
+
+            grid = make_image_grid(images, labels=seeds)
+            draft_width, draft_height = images[0].size
+            grid_info = {
+                "seed": None,
+                "width": draft_width,
+                "height": draft_height,
+                "steps": draft_steps,
+                "cfg": round(guidance_scale, 2),
+                "scheduler": scheduler_name,
+                "model": self.current_model_name,
+                "model_hash": self.current_model_hash[:16] if self.current_model_hash else None,
+                "few_step": self._few_step_label(),
+                "loras": self._lora_labels(),
+                "attention": attention_backend,
+                "draft_seeds": seeds,
+                "draft_final_size": [width, height],
+                "duration": round(duration, 2),
+            }
+            grid_filename, _ = self._save_generated_image(grid, prompt, negative_prompt, grid_info)
+            draft = {"draft_grid": grid_filename, "draft_steps": draft_steps, "draft_size": [draft_width, draft_height]}
+            print(f"DEBUG: {len(seeds)} Entwürfe ({draft_width}x{draft_height}, {draft_steps} Schritte) in {duration:.2f} s, Raster: {grid_filename}")
+            self.after(0, self.update_status, f"{len(seeds)} Entwürfe in {duration:.1f} s erzeugt ({draft_width}x{draft_height}, {draft_steps} Schritte). Bitte auswählen.", "green")
+            self.after(0, self._show_draft_grid, images, seeds, prompt, negative_prompt, draft)
+            self.after(0, self._update_gallery_if_open)
+        except StopIteration:
+            self.after(0, self.update_status, "Entwürfe abgebrochen.", "orange")
+        except Exception as e:
+            traceback.print_exc()
+            self.after(0, self.update_status, f"Entwürfe fehlgeschlagen: {e}", "red")
+        finally:
+            self._reset_ui_after_generation()
+
+    def _show_draft_grid(self, images, seeds, prompt, negative_prompt, draft):
+        """Zeigt die Entwürfe zur Auswahl an; die ausgewählten Seeds werden mit den aktuellen Einstellungen final gerendert."""
+        window = ctk.CTkToplevel(self)
+        window.title(f"Entwürfe: {prompt[:60]}")
+        window.transient(self)
+        grid_frame = ctk.CTkScrollableFrame(window, width=min(DRAFT_GRID_COLUMNS, len(images)) * (THUMBNAIL_SIZE + 20), height=2 * (THUMBNAIL_SIZE + 50))
+        grid_frame.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
+        checkboxes = []
+        for index, (image, seed) in enumerate(zip(images, seeds)):
+            preview = image.copy()
+            preview.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            tk_image = ctk.CTkImage(light_image=preview, dark_image=preview, size=preview.size)
+            label = ctk.CTkLabel(grid_frame, image=tk_image, text="")
+            label.image = tk_image
+            label.grid(row=2 * (index // DRAFT_GRID_COLUMNS), column=index % DRAFT_GRID_COLUMNS, padx=5, pady=(5, 0))
+            checkbox = ctk.CTkCheckBox(grid_frame, text=f"Seed {seed}", font=ctk.CTkFont(size=11))
+            checkbox.grid(row=2 * (index // DRAFT_GRID_COLUMNS) + 1, column=index % DRAFT_GRID_COLUMNS, padx=5, pady=(0, 5))
+            label.bind("<Button-1>", lambda event, checkbox=checkbox: checkbox.toggle()) # Klick aufs Bild wählt es aus
+            checkboxes.append((seed, checkbox))
+
+        def finalize():
+            selected = [seed for seed, checkbox in checkboxes if checkbox.get()]
+            if not selected:
+                self.update_status("Bitte mindestens einen Entwurf auswählen.", "orange")
+                return
+            if self.generation_thread and self.generation_thread.is_alive():
+                self.update_status("Es läuft bereits eine Generierung, bitte warten.", "orange")
+                return
+            # Finale Bilder mit dem Prompt der Entwürfe, auch wenn das Eingabefeld inzwischen geändert wurde
+            self.prompt_entry.delete(0, ctk.END)
+            self.prompt_entry.insert(0, prompt)
+            self.negative_prompt_entry.delete(0, ctk.END)
+            self.negative_prompt_entry.insert(0, negative_prompt)
+            window.destroy()
+            self.generate_image_event(seeds=selected, draft=draft)
+
+        ctk.CTkButton(window, text="Ausgewählte final rendern", command=finalize, corner_radius=8).grid(row=1, column=0, padx=10, pady=10, sticky="e")
+        ctk.CTkButton(window, text="Verwerfen", command=window.destroy, fg_color="gray", corner_radius=8).grid(row=1, column=1, padx=10, pady=10, sticky="w")
+
+    def _decode_latents(self, latents, tiled=False, output_type="pil"):
+        """
+        Dekodiert Latents mit dem VAE der Pipeline zu PIL-Bildern (tiled: gekacheltes VAE für große Bilder).
+        Mit output_type="np" kommt stattdessen ein schreibgeschützter uint8-Puffer (N, H, W, 3) zurück.
+        """
+        vae = self.pipe.vae
+        needs_upcasting = vae.dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+        if needs_upcasting: # Der SDXL-VAE läuft in float16 über
+            vae.to(dtype=torch.float32)
+        latents = latents.to(dtype=vae.dtype)
+
+        latents_mean = getattr(vae.config, "latents_mean", None)
+        latents_std = getattr(vae.config, "latents_std", None)
+        if latents_mean is not None and latents_std is not None:
+            latents_mean = torch.tensor(latents_mean).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            latents_std = torch.tensor(latents_std).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            latents = latents * latents_std / vae.config.scaling_factor + latents_mean
+        else:
+            latents = latents / vae.config.scaling_factor
 
-                else:
-                    self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: Keine gültigen Bilder von der Pipeline erhalten. Speicher oder Modell inkompatibel.", "red")
-                    self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images} (keine Bilder)."))
-                    self.current_generated_image = None
-                    self.current_image_seed = -1
-                    self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
-                    self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
-                    self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
-                    self.after(0, lambda: self.details_generation_time_label.configure(text="Dauer: N/A")) # Dauer bei Fehler N/A
-
-            except StopIteration:
-                self.after(0, self.update_status, f"Generierung von Bild {i+1}/{num_images} abgebrochen.", "orange")
-                self.after(0, lambda: self.image_label.configure(text=f"Generierung von Bild {i+1}/{num_images} abgebrochen."))
-                self.current_generated_image = None
-                self.current_image_seed = -1
-                self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
-                self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
-                self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
-                self.after(0, lambda: self.details_generation_time_label.configure(text="Dauer: Abgebrochen")) # Dauer bei Abbruch
-                break # Abbruch der Schleife bei StopIteration
-            except torch.cuda.OutOfMemoryError:
-                self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: GPU-Speicher (VRAM) nicht ausreichend. Versuchen Sie kleinere Bildgrößen oder weniger Schritte.", "red")
-                self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}: GPU-Speicher nicht ausreichend."))
+        # Gekacheltes Dekodieren begrenzt auch den Speicherbedarf des VAE
+        vae_was_tiled = getattr(vae, "use_tiling", False)
+        if tiled:
+            vae.enable_tiling()
+        try:
+            with torch.no_grad():
+                image = vae.decode(latents, return_dict=False)[0]
+        finally:
+            if tiled and not vae_was_tiled:
+                vae.disable_tiling()
+        if needs_upcasting:
+            vae.to(dtype=torch.float16)
+        if output_type == "np":
+            return self._decoded_to_array(image)
+        return [Image.fromarray(array) for array in self._decoded_to_array(image)]
+
+    def _decoded_to_array(self, image):
+        """
+        Wandelt die VAE-Ausgabe (Werte -1..1, NCHW) in einen zusammenhängenden uint8-Puffer (N, H, W, 3) um.
+        Rechnet genau wie image_processor.postprocess, aber ohne Zwischentensoren: normiert und quantisiert
+        wird in-place auf dem Gerät, danach folgt eine einzige Kopie in den Host-Puffer. Der Puffer gehört
+        dem Aufrufer (er wird von Anzeige, Speichern und Vorschaubild gemeinsam gelesen) und ist schreibgeschützt.
+        """
+        if image.shape[1] != 3 or not self.pipe.image_processor.config.do_normalize:
+            array = np.stack([np.asarray(pil_image.convert("RGB")) for pil_image in self.pipe.image_processor.postprocess(image, output_type="pil")])
+        else:
+            image = image.div_(2).add_(0.5).clamp_(0, 1)
+            image = image.float().mul_(255).round_()
+            batch_size, channels, height, width = image.shape
+            host_buffer = torch.empty((batch_size, height, width, channels), dtype=torch.uint8)
+            host_buffer.copy_(image.permute(0, 2, 3, 1))
+            array = host_buffer.numpy()
+        array.flags.writeable = False
+        return array
+
+    def _prompt_dtype(self):
+        """Datentyp der Prompt-Embeddings, in dem die Pipelines ihr Startrauschen erzeugen."""
+        text_encoder = getattr(self.pipe, "text_encoder_2", None) or self.pipe.text_encoder
+        return getattr(text_encoder, "dtype", None) or self.pipe.unet.dtype
+
+    def _pooled_noise(self, shape, generator, dtype, device):
+        """Startrauschen wie randn_tensor (gleiche Werte beim gleichen Generator), aber in wiederverwendeten Puffern."""
+        noise = self.tensor_pool.get("noise", shape, dtype, generator.device)
+        torch.randn(shape, generator=generator, out=noise)
+        if noise.device.type != torch.device(device).type: # CPU-Generator, Pipeline auf der GPU
+            device_noise = self.tensor_pool.get("noise_device", shape, dtype, device)
+            device_noise.copy_(noise)
+            return device_noise
+        return noise
+
+    def _generate_tiled(self, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, generator, image_index, total_images, guided_steps=None, output_type="pil"):
+        """
+        Gekachelte Generierung im Stil von MultiDiffusion: Das Latent wird in überlappende Kacheln
+        in nativer Modellauflösung zerlegt, die pro Schritt stapelweise entrauscht werden. Die
+        Rauschvorhersagen werden gewichtet zusammengeführt und ein einziger Scheduler-Schritt auf
+        das ganze Latent angewendet. Dekodiert wird mit gekacheltem VAE.
+        Mit guided_steps wird die CFG nach so vielen Schritten abgeschaltet, mit output_type="latent"
+        werden die Latents statt der dekodierten Bilder zurückgegeben.
+        """
+        pipe = self.pipe
+        device = pipe._execution_device
+        is_sdxl = isinstance(pipe, StableDiffusionXLPipeline)
+        do_cfg = guidance_scale > 1.0
+        vae_scale_factor = pipe.vae_scale_factor
+        unet_config = pipe.unet.config
+
+        # Prompt nur einmal kodieren
+        with torch.no_grad():
+            if is_sdxl:
+                prompt_embeds, negative_prompt_embeds, pooled_embeds, negative_pooled_embeds = pipe.encode_prompt(
+                    prompt=prompt, device=device, num_images_per_prompt=1,
+                    do_classifier_free_guidance=do_cfg, negative_prompt=negative_prompt or None)
+            else:
+                prompt_embeds, negative_prompt_embeds = pipe.encode_prompt(
+                    prompt, device, 1, do_cfg, negative_prompt or None)
+
+        latent_height, latent_width = height // vae_scale_factor, width // vae_scale_factor
+        tile_size = unet_config.sample_size # Native Auflösung des Modells im Latent-Raum (64 bzw. 128)
+        overlap = tile_size // 4
+        tiles = [(y, x) for y in compute_tile_starts(latent_height, tile_size, overlap)
+                 for x in compute_tile_starts(latent_width, tile_size, overlap)]
+        tile_height, tile_width = min(tile_size, latent_height), min(tile_size, latent_width)
+        print(f"DEBUG: Gekachelte Generierung mit {len(tiles)} Kacheln à {tile_width * vae_scale_factor}x{tile_height * vae_scale_factor} Pixel.")
+
+        scheduler = pipe.scheduler
+        scheduler.set_timesteps(num_inference_steps, device=device)
+        latent_shape = (1, unet_config.in_channels, latent_height, latent_width)
+        latents = self._pooled_noise(latent_shape, generator, prompt_embeds.dtype, device)
+        latents = latents * scheduler.init_noise_sigma
+        extra_step_kwargs = pipe.prepare_extra_step_kwargs(generator, 0.0)
+        weights = tile_blend_weights(tile_height, tile_width, device, latents.dtype)
+        # Die Gewichtssumme ist für alle Schritte gleich, die Summe der Vorhersagen wird pro Schritt geleert
+        weight_sum = self.tensor_pool.get("tile_weight_sum", (1, 1, latent_height, latent_width), latents.dtype, device).zero_()
+        for y, x in tiles:
+            weight_sum[:, :, y:y + tile_height, x:x + tile_width] += weights
+        noise_pred_sum = self.tensor_pool.get("tile_noise_pred_sum", latent_shape, latents.dtype, device)
+
+        for step_index, t in enumerate(scheduler.timesteps):
+            if guided_steps is not None and step_index == guided_steps:
+                do_cfg = False # CFG-Abschneiden: ab hier nur noch der bedingte Durchlauf
+            noise_pred_sum.zero_()
+
+            for batch_start in range(0, len(tiles), TILE_BATCH_SIZE):
+                batch_tiles = tiles[batch_start:batch_start + TILE_BATCH_SIZE]
+                tile_count = len(batch_tiles)
+                tile_latents = torch.cat([latents[:, :, y:y + tile_height, x:x + tile_width] for y, x in batch_tiles])
+                latent_input = torch.cat([tile_latents] * 2) if do_cfg else tile_latents
+                latent_input = scheduler.scale_model_input(latent_input, t)
+
+                encoder_states = prompt_embeds.repeat(tile_count, 1, 1)
+                if do_cfg:
+                    encoder_states = torch.cat([negative_prompt_embeds.repeat(tile_count, 1, 1), encoder_states])
+
+                added_cond_kwargs = None
+                if is_sdxl:
+                    # Jede Kachel wird als Ausschnitt (crop) des Gesamtbildes konditioniert
+                    time_ids = torch.tensor([[height, width, y * vae_scale_factor, x * vae_scale_factor,
+                                              tile_height * vae_scale_factor, tile_width * vae_scale_factor]
+                                             for y, x in batch_tiles], device=device, dtype=prompt_embeds.dtype)
+                    text_embeds = pooled_embeds.repeat(tile_count, 1)
+                    if do_cfg:
+                        time_ids = torch.cat([time_ids, time_ids])
+                        text_embeds = torch.cat([negative_pooled_embeds.repeat(tile_count, 1), text_embeds])
+                    added_cond_kwargs = {"text_embeds": text_embeds, "time_ids": time_ids}
+
+                with torch.no_grad():
+                    noise_pred = pipe.unet(latent_input, t, encoder_hidden_states=encoder_states,
+                                           added_cond_kwargs=added_cond_kwargs, return_dict=False)[0]
+                if do_cfg:
+                    noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                    noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
+
+                for k, (y, x) in enumerate(batch_tiles):
+                    noise_pred_sum[:, :, y:y + tile_height, x:x + tile_width] += noise_pred[k:k + 1] * weights
+
+            latents = scheduler.step(noise_pred_sum / weight_sum, t, latents, **extra_step_kwargs, return_dict=False)[0]
+            self._progress_callback(pipe, step_index + 1, t, {"current_image_index": image_index, "total_images": total_images})
+
+        if output_type == "latent":
+            return latents
+        return self._decode_latents(latents, tiled=True)
+
+    def _build_generation_spec(self, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, seed, tiled, deep_cache_interval=None, guided_steps=None, upscale=None, refiner=None, attention=None):
+        """
+        Alle Parameter, die das Ergebnisbild bestimmen (Grundlage des Ergebnis-Cache-Schlüssels). Dazu gehört auch das
+        Attention-Backend: Die Kernel (SDPA, xformers, in Scheiben) rechnen in unterschiedlicher Reihenfolge und
+        liefern daher nicht bitgleiche Bilder.
+        """
+        spec = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt or "",
+            "width": width,
+            "height": height,
+            "steps": num_inference_steps,
+            "cfg": round(guidance_scale, 4),
+            "cfg_guided_steps": guided_steps,
+            "seed": seed,
+            "scheduler": self.scheduler_optionmenu.get(),
+            "tiled": tiled,
+            "model_hash": self.current_model_hash,
+            "pipeline": self.pipeline_variant,
+            "token_merging": self.token_merging_ratio,
+            "deep_cache": deep_cache_interval,
+            "few_step": self._few_step_label(),
+            "loras": self._lora_labels(),
+            "attention": attention,
+        }
+        if upscale:
+            spec["upscale"] = list(upscale) # Nur dann, damit bestehende Cache-Schlüssel gültig bleiben
+        if refiner:
+            spec["refiner"] = {"model_hash": refiner[0], "switch": refiner[1]}
+        return spec
+
+    def _get_refiner(self, model_path):
+        """
+        Lädt den SDXL-Refiner (oder übernimmt den bereits geladenen). VAE und zweiter Text-Encoder kommen aus der
+        Basis-Pipeline, nur UNet und Scheduler werden aus der Datei gelesen. Ist der VRAM knapp, laufen Basis und
+        Refiner mit Modell-Offloading, sodass immer nur eines der beiden UNets auf der GPU liegt (bis der Refiner
+        wieder freigegeben wird, siehe _release_refiner).
+        """
+        state = self.refiner_state
+        if state and state["path"] == os.path.abspath(model_path):
+            return state
+        self._release_refiner()
+        self.after(0, self.update_status, f"Lade Refiner {os.path.basename(model_path)}...", "blue")
+        load_start_time = time.time()
+        refiner = StableDiffusionXLImg2ImgPipeline.from_single_file(
+            model_path,
+            text_encoder_2=self.pipe.text_encoder_2,
+            vae=self.pipe.vae,
+            torch_dtype=self.pipe.unet.dtype,
+            low_cpu_mem_usage=True,
+        )
+        refiner.set_progress_bar_config(disable=True)
+        base_offload_forced = False
+        if self.device == "cuda":
+            base_offloaded = bool(getattr(self.pipe, "_all_hooks", None))
+            memory_tight = torch.cuda.mem_get_info()[0] < module_size_bytes(refiner.unet) * REFINER_VRAM_HEADROOM
+            if base_offloaded or memory_tight:
+                if not base_offloaded:
+                    print("DEBUG: Zu wenig VRAM für zwei UNets, Basis-Pipeline wechselt auf Modell-Offloading.")
+                    self.after(0, self.update_status, "Zu wenig VRAM für Basis und Refiner: Basis-Pipeline läuft mit Modell-Offloading, solange der Refiner verwendet wird.", "orange")
+                    self.pipe.enable_model_cpu_offload()
+                    base_offload_forced = True
+                refiner.enable_model_cpu_offload()
+            else:
+                refiner.to(self.device)
+        self.refiner_state = {
+            "path": os.path.abspath(model_path),
+            "pipe": refiner,
+            "base_offload_forced": base_offload_forced, # Die Basis lag vorher vollständig auf der GPU
+            "model_hash": compute_model_hash(model_path),
+            "name": os.path.splitext(os.path.basename(model_path))[0],
+        }
+        print(f"DEBUG: Refiner in {time.time() - load_start_time:.2f} Sekunden geladen (UNet {format_bytes(module_size_bytes(refiner.unet))}).")
+        return self.refiner_state
+
+    def _release_refiner(self):
+        """
+        Gibt den geladenen Refiner frei. Hatte er die Basis-Pipeline auf Modell-Offloading umgestellt,
+        liegt diese danach wieder vollständig auf der GPU.
+        """
+        state = self.refiner_state
+        self.refiner_state = None
+        if state is None:
+            return
+        base_offload_forced = state["base_offload_forced"]
+        del state
+        gc.collect()
+        if base_offload_forced and self.pipe is not None:
+            self.pipe.remove_all_hooks() # Entfernt auch die Hooks des Refiners an den geteilten Komponenten
+            self.pipe.to(self.device)
+            print("DEBUG: Refiner freigegeben, Basis-Pipeline wieder ohne Modell-Offloading auf der GPU.")
+            self.after(0, self.update_status, "Refiner freigegeben, Basis-Pipeline wieder vollständig auf der GPU.", "blue")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _match_refiner_unet(self, refiner):
+        """Überträgt Attention-Backend und Token Merging der Basis-Pipeline auf das Refiner-UNet."""
+        label = getattr(self.pipe.unet, "_attention_backend", None)
+        if label:
+            backend, _, slice_size = label.partition(":")
+            apply_attention_backend(refiner, backend, int(slice_size) if slice_size else None)
+        token_merging = getattr(refiner.unet, "_token_merging", None)
+        if not self.token_merging_ratio:
+            remove_token_merging(refiner.unet)
+        elif token_merging is None or token_merging["state"]["ratio"] != min(self.token_merging_ratio, TOME_MAX_RATIO):
+            apply_token_merging(refiner.unet, self.token_merging_ratio)
+
+    def _refine_latents(self, refiner, latents, prompt, negative_prompt, num_inference_steps, guidance_scale, generator, image_index, total_images, guided_steps, switch):
+        """
+        Übergibt die bis denoising_end entrauschten Latents des Basismodells direkt an den Refiner, der die
+        restlichen Schritte übernimmt (ohne Dekodieren und erneutes Kodieren dazwischen).
+        """
+        base_steps = int(round(num_inference_steps * switch))
+        refiner_guidance_scale = guidance_scale
+        refiner_guided_steps = None
+        if guided_steps is not None:
+            if guided_steps <= base_steps:
+                refiner_guidance_scale = 1.0 # CFG wurde schon im Basismodell abgeschaltet
+            else:
+                refiner_guided_steps = guided_steps - base_steps
+        refiner.scheduler = self.pipe.scheduler.__class__.from_config(self.pipe.scheduler.config) # Gleicher Sampler wie die Basis
+        self._match_refiner_unet(refiner)
+        return refiner(
+            prompt=prompt,
+            negative_prompt=negative_prompt if negative_prompt else None,
+            image=latents,
+            num_inference_steps=num_inference_steps,
+            denoising_start=switch,
+            guidance_scale=refiner_guidance_scale,
+            generator=generator,
+            output_type="latent",
+            callback_on_step_end=self._make_step_callback(image_index, total_images, refiner_guided_steps, step_offset=base_steps),
+            callback_on_step_end_tensor_inputs=self._step_callback_tensor_inputs(refiner_guided_steps),
+        ).images
+
+    def _generate_images_thread_loop(self, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, generator, num_images, tiled=False, use_result_cache=True, deep_cache_interval=None, loras=None, cfg_truncation=None, shard_output=False, profile_steps=None, upscale=None, refiner=None, seeds=None, draft=None):
+        """
+        Schleife für die Generierung mehrerer Bilder als gestaffelte Pipeline: Dieser Thread entrauscht,
+        ein Dekodier-Thread wandelt die Latents mit dem VAE in Bilder um und ein Schreib-Thread speichert
+        und zeigt sie an. So wird Bild i dekodiert und gespeichert, während Bild i+1 schon entrauscht wird.
+        Begrenzte Warteschlangen zwischen den Stufen halten den Speicherbedarf klein (Gegendruck).
+        Mit shard_output schreibt die letzte Stufe in Tar-Shards statt in einzelne Dateien.
+        Mit profile_steps wird jeder Pipeline-Aufruf mit torch.profiler aufgezeichnet, das Dekodieren in eigenen .decode-Dateien (nicht bei Kachelung).
+        Mit upscale = (Faktor, Verfahren) vergrößert die Schreibstufe jedes Bild vor dem Speichern.
+        Mit refiner = (Modellpfad, Übergang) entrauscht das SDXL-Basismodell bis zum Übergang, den Rest der Refiner.
+        Mit seeds wird statt fortlaufender Seeds genau diese Liste gerendert (finale Fassung ausgewählter Entwürfe).
+        """
+        guided_steps = guided_step_count(num_inference_steps, cfg_truncation) if cfg_truncation else None
+        if guided_steps is not None and guided_steps >= num_inference_steps:
+            guided_steps = None # Kein Schritt ohne CFG übrig
+        cfg_guided_steps = 0 if guidance_scale <= 1.0 else (guided_steps if guided_steps is not None else num_inference_steps)
+        if loras is not None and loras != self.active_loras:
+            # Gewählte LoRA-Kombination einmal vor dem Durchlauf fusionieren (bzw. aus dem Cache übernehmen)
+            self.after(0, self.update_status, "Wende LoRAs an...", "blue")
+            if not self._apply_loras(loras):
+                self.after(0, self._reset_ui_after_generation)
+                return
+        use_result_cache = use_result_cache and self.result_cache is not None and self._model_hash() is not None
+        shard_writer = None
+        if shard_output:
+            try:
+                shard_writer = ShardWriter()
+            except OSError as e:
+                self.after(0, self.update_status, f"Shard-Verzeichnis konnte nicht geöffnet werden: {e}", "red")
+                self.after(0, self._reset_ui_after_generation)
+                return
+        upscaler = None
+        if upscale:
+            try:
+                upscaler = TiledUpscaler(upscale[1])
+            except Exception as e:
+                print(f"FEHLER: Hochskalierer '{upscale[1]}' konnte nicht geladen werden: {e}")
+                self.after(0, self.update_status, f"Hochskalierer '{upscale[1]}' konnte nicht geladen werden: {e}", "red")
+                self.after(0, self._reset_ui_after_generation)
+                if shard_writer:
+                    shard_writer.close()
+                return
+        refiner_state = None
+        if not refiner and self.refiner_state and self.refiner_state["base_offload_forced"]:
+            self._release_refiner() # Die Basis-Pipeline braucht das Offloading ohne Refiner nicht mehr
+        if refiner:
+            try:
+                refiner_state = self._get_refiner(refiner[0])
+            except Exception as e:
                 traceback.print_exc()
-                self.current_generated_image = None
-                self.current_image_seed = -1
-                self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
-                self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
-                self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
-                self.after(0, lambda: self.details_generation_time_label.configure(text="Dauer: Fehler")) # Dauer bei Fehler
-                break # Abbruch der Schleife bei OOM-Fehler
-            except RuntimeError as e:
-                if "out of memory" in str(e).lower() or "cuda" in str(e).lower():
-                    self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: Speicher nicht ausreichend. Versuchen Sie kleinere Bildgrößen oder weniger Schritte. ({e})", "red")
-                    self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}: Speicher nicht ausreichend."))
-                else:
+                self.after(0, self.update_status, f"Refiner '{os.path.basename(refiner[0])}' konnte nicht geladen werden: {e}", "red")
+                self.after(0, self._reset_ui_after_generation)
+                if shard_writer:
+                    shard_writer.close()
+                if upscaler:
+                    upscaler.close()
+                return
+        deep_cache = DeepCacheController(self.pipe.unet, deep_cache_interval) if deep_cache_interval else None
+        cfg_batch = 2 if guidance_scale > 1.0 else 1
+        if tiled: # Das UNet sieht nur Kacheln in nativer Auflösung, TILE_BATCH_SIZE pro Aufruf
+            native_size = self.pipe.unet.config.sample_size * self.pipe.vae_scale_factor
+            attention_backend = self._select_attention_backend(native_size, native_size, TILE_BATCH_SIZE * cfg_batch)
+        else:
+            attention_backend = self._select_attention_backend(width, height, cfg_batch)
+
+        # Gemeinsame Parameter des Durchlaufs für die nachgelagerten Stufen
+        run = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "width": width,
+            "height": height,
+            "steps": num_inference_steps,
+            "cfg": guidance_scale,
+            "cfg_guided_steps": cfg_guided_steps,
+            "tiled": tiled,
+            "deep_cache": deep_cache_interval,
+            "scheduler": self.scheduler_optionmenu.get(),
+            "num_images": num_images,
+            "shard_writer": shard_writer,
+            "upscale_factor": upscale[0] if upscale else None,
+            "upscaler": upscaler,
+            "refiner": refiner_state["name"] if refiner_state else None,
+            "refiner_switch": refiner[1] if refiner_state else None,
+            "draft": draft, # Herkunft aus einem Entwurfsraster (für die Metadaten)
+            "attention": attention_backend,
+            "completed": 0,
+        }
+        # Mit Modell-Offloading verschiebt accelerate die Komponenten bei jedem Aufruf auf die GPU und zurück,
+        # UNet und VAE dürfen dann nicht gleichzeitig laufen: dekodiert wird dann in diesem Thread. Ebenso beim
+        # Profiling, da torch.profiler nur eine Aufzeichnung gleichzeitig erlaubt.
+        overlap_decode = not getattr(self.pipe, "_all_hooks", None) and not profile_steps
+        decode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        write_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        abort_event = threading.Event() # Ein Fehler in einer Stufe beendet den ganzen Durchlauf
+        stage_threads = [
+            threading.Thread(target=self._decode_stage, args=(decode_queue, write_queue, abort_event), daemon=True),
+            threading.Thread(target=self._write_stage, args=(write_queue, abort_event, run), daemon=True),
+        ]
+        for stage_thread in stage_threads:
+            stage_thread.start()
+        run_start_time = time.time()
+
+        try:
+            for i in range(num_images):
+                if self.stop_event.is_set():
+                    self.after(0, self.update_status, f"Generierung von Bild {i+1}/{num_images} abgebrochen.", "orange")
+                    break
+                if abort_event.is_set():
+                    break
+
+                if i == 0: # Danach bleibt das jeweils letzte fertige Bild sichtbar, während das nächste entsteht
+                    self.after(0, lambda total=num_images: self.image_label.configure(text=f"Generiere Bild 1 von {total}..."))
+                    self.after(0, lambda: self.image_label.configure(image=None)) # Leere das Bildfeld vor neuer Generierung
+                self.after(0, self._update_progress_bar, (i / num_images), f"{int((i / num_images) * 100)}%") # Setze Fortschritt für jedes neue Bild zurück auf den Beginn des aktuellen Bildes
+
+                current_seed = seeds[i] if seeds else (generator.initial_seed() + i) % 2**32 # Jedes Bild eines Durchlaufs bekommt einen eigenen, reproduzierbaren Seed
+                current_generator = torch.Generator(device=generator.device).manual_seed(current_seed) # Neuen Generator mit diesem Seed erstellen
+
+                # Vollständige Spezifikation dieses Bildes: identische Spezifikation -> identisches Bild
+                generation_spec = self._build_generation_spec(prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, current_seed, tiled, deep_cache_interval, guided_steps, upscale,
+                                                              (refiner_state["model_hash"], refiner[1]) if refiner_state else None, attention_backend)
+                job = {
+                    "index": i,
+                    "seed": current_seed,
+                    "spec": generation_spec,
+                    "cache_key": generation_spec_key(generation_spec) if use_result_cache else None,
+                    "owns_cache_key": False,
+                    "cached_filepath": None,
+                    "latents": None,
+                    "pixels": None, # Dekodiertes Bild als schreibgeschützter uint8-Puffer (H, W, 3)
+                    "image": None, # Nur bei Ergebnis-Cache-Treffern: aus der Datei geladenes Bild
+                    "tiled": tiled,
+                    "denoise_seconds": 0.0,
+                    "decode_seconds": 0.0,
+                    "deep_cache_summary": None,
+                    "profile_files": [],
+                    "profile_base": None, # Vorläufiger Pfad der Profil-Dateien (ohne Endung)
+                }
+
+                start_time = time.time() # Startzeit für Generierungsdauer
+
+                try:
+                    if job["cache_key"]:
+                        job["cached_filepath"], job["owns_cache_key"] = self.result_cache.acquire(job["cache_key"], self.stop_event)
+                        if self.stop_event.is_set():
+                            raise StopIteration
+
+                    if job["cached_filepath"]:
+                        # Treffer: gespeichertes Bild direkt übernehmen, keine Entrauschung nötig
+                        print(f"DEBUG: Ergebnis-Cache-Treffer für Bild {i+1}/{num_images}: {job['cached_filepath']}")
+                        with Image.open(job["cached_filepath"]) as cached_image:
+                            job["image"] = cached_image.copy()
+                        self.after(0, self._update_progress_bar, (i + 1) / num_images, f"{int(((i + 1) / num_images) * 100)}%")
+                    elif tiled:
+                        # Überlappende Latent-Kacheln entrauschen, Speicherbedarf hängt nur von der Kachelgröße ab
+                        job["latents"] = self._generate_tiled(prompt, negative_prompt, width, height, num_inference_steps, guidance_scale, current_generator, i, num_images, guided_steps, output_type="latent")
+                    else:
+                        if deep_cache:
+                            deep_cache.reset()
+                        step_callback = self._make_step_callback(i, num_images, guided_steps) # Fortschritt (und ggf. CFG-Abschneiden) pro Bild
+                        profiler = PipelineProfiler(self.pipe, num_inference_steps, self.profile_skip_steps, profile_steps) if profile_steps else None
+                        if profiler:
+                            pipeline_step_callback = step_callback
+                            def step_callback(pipeline_instance, step, timestep, callback_kwargs, pipeline_step_callback=pipeline_step_callback, profiler=profiler):
+                                outputs = pipeline_step_callback(pipeline_instance, step, timestep, callback_kwargs)
+                                profiler.step()
+                                return outputs
+                        # Startrauschen selbst im Puffer-Pool erzeugen (dieselben Werte wie in der Pipeline)
+                        noise = self._pooled_noise((1, self.pipe.unet.config.in_channels, height // self.pipe.vae_scale_factor, width // self.pipe.vae_scale_factor),
+                                                   current_generator, self._prompt_dtype(), self.pipe._execution_device)
+                        with profiler if profiler else contextlib.nullcontext():
+                            pipeline_output = self.pipe(
+                                prompt=prompt,
+                                negative_prompt=negative_prompt if negative_prompt else None, # Übergebe None, wenn leer
+                                width=width,
+                                height=height,
+                                num_inference_steps=num_inference_steps,
+                                guidance_scale=guidance_scale,
+                                generator=current_generator, # Verwende den spezifischen Generator
+                                latents=noise,
+                                output_type="latent", # Dekodiert wird in der nächsten Stufe
+                                callback_on_step_end=step_callback,
+                                callback_on_step_end_tensor_inputs=self._step_callback_tensor_inputs(guided_steps),
+                                **({"denoising_end": refiner[1]} if refiner_state else {}), # Mit Refiner: Rest übernimmt dieser
+                            )
+                        if profiler:
+                            # Vorläufiger Name, die Schreibstufe benennt die Dateien passend zum Bild bzw. Shard-Beispiel um
+                            job["profile_base"] = os.path.join(IMAGE_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+                            job["profile_files"] = profiler.export(job["profile_base"])
+                            print(f"DEBUG: Profil von Bild {i+1}/{num_images}: {', '.join(job['profile_files']) or 'keine Schritte aufgezeichnet'}")
+                        job["latents"] = pipeline_output.images if pipeline_output and hasattr(pipeline_output, 'images') else None
+                        if job["latents"] is None:
+                            raise RuntimeError("Keine gültigen Latents von der Pipeline erhalten. Speicher oder Modell inkompatibel.")
+                        if refiner_state:
+                            job["latents"] = self._refine_latents(refiner_state["pipe"], job["latents"], prompt, negative_prompt, num_inference_steps, guidance_scale,
+                                                                  current_generator, i, num_images, guided_steps, refiner[1])
+                        if deep_cache:
+                            job["deep_cache_summary"] = deep_cache.summary()
+                            print(f"DEBUG: {job['deep_cache_summary']}")
+                    job["denoise_seconds"] = time.time() - start_time
+
+                    if job["latents"] is not None and not overlap_decode:
+                        self._decode_job(job)
+                    decode_queue.put(job) # Blockiert, solange die Warteschlange voll ist
+                    job = None # Übergeben: Die folgenden Stufen geben den Cache-Schlüssel frei
+
+                except StopIteration:
+                    self.after(0, self.update_status, f"Generierung von Bild {i+1}/{num_images} abgebrochen.", "orange")
+                    self.after(0, lambda: self.image_label.configure(text=f"Generierung von Bild {i+1}/{num_images} abgebrochen."))
+                    self._clear_image_details("Abgebrochen") # Dauer bei Abbruch
+                    break # Abbruch der Schleife bei StopIteration
+                except torch.cuda.OutOfMemoryError:
+                    self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: GPU-Speicher (VRAM) nicht ausreichend. Versuchen Sie kleinere Bildgrößen oder weniger Schritte.", "red")
+                    self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}: GPU-Speicher nicht ausreichend."))
+                    traceback.print_exc()
+                    self._clear_image_details("Fehler") # Dauer bei Fehler
+                    break # Abbruch der Schleife bei OOM-Fehler
+                except RuntimeError as e:
+                    if "out of memory" in str(e).lower() or "cuda" in str(e).lower():
+                        self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: Speicher nicht ausreichend. Versuchen Sie kleinere Bildgrößen oder weniger Schritte. ({e})", "red")
+                        self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}: Speicher nicht ausreichend."))
+                    else:
+                        self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: {e}", "red")
+                        self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}."))
+                    traceback.print_exc()
+                    self._clear_image_details("Fehler") # Dauer bei Fehler
+                    break # Abbruch der Schleife bei RuntimeError
+                except Exception as e:
                     self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: {e}", "red")
                     self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}."))
-                traceback.print_exc()
-                self.current_generated_image = None
-                self.current_image_seed = -1
-                self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
-                self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
-                self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
-                self.after(0, lambda: self.details_generation_time_label.configure(text="Dauer: Fehler")) # Dauer bei Fehler
-                break # Abbruch der Schleife bei RuntimeError
-            except Exception as e:
-                self.after(0, self.update_status, f"Fehler bei Bild {i+1}/{num_images}: {e}", "red")
-                self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {i+1}/{num_images}."))
-                traceback.print_exc()
-                self.current_generated_image = None
-                self.current_image_seed = -1
-                self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
-                self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
-                self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
-                self.after(0, lambda: self.details_generation_time_label.configure(text="Dauer: Fehler")) # Dauer bei Fehler
-                break # Abbruch der Schleife bei anderen Fehlern
-            finally:
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache() # Leere GPU-Speicher nach jeder Generierung
+                    traceback.print_exc()
+                    self._clear_image_details("Fehler") # Dauer bei Fehler
+                    break # Abbruch der Schleife bei anderen Fehlern
+                finally:
+                    if job is not None:
+                        self._discard_job(job) # Nicht übergeben: wartende identische Anfragen wecken (auch bei Fehlern)
+                    # Den Allokator-Cache behalten, damit das nächste Bild dieselben Blöcke wiederverwendet; nur bei knappem VRAM leeren
+                    if cuda_memory_pressure():
+                        print("DEBUG: Wenig freier GPU-Speicher, leere den Allokator-Cache.")
+                        torch.cuda.empty_cache()
+        finally:
+            decode_queue.put(None) # Ende des Durchlaufs: die Stufen arbeiten ihre Warteschlangen ab und beenden sich
+            for stage_thread in stage_threads:
+                stage_thread.join()
+            if deep_cache:
+                deep_cache.remove()
+            if shard_writer:
+                shard_writer.close()
+                self.after(0, lambda: self.shard_info_label.configure(text=shard_writer.describe()))
+            if upscaler:
+                upscaler.close()
+            print(f"DEBUG: {self.tensor_pool.summary()}")
+            self.tensor_pool.clear() # Zwischen Durchläufen nichts festhalten
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache() # Einmal am Ende des Durchlaufs statt nach jedem Bild
+
+        run_seconds = time.time() - run_start_time
+        if run["completed"] > 1 and not abort_event.is_set() and not self.stop_event.is_set():
+            throughput_text = f"{run['completed']} Bilder in {run_seconds:.1f} s ({run_seconds / run['completed']:.2f} s pro Bild)"
+            print(f"DEBUG: Durchsatz: {throughput_text}")
+            self.after(0, self.update_status, f"Fertig: {throughput_text}.", "green")
 
         self.after(0, self._reset_ui_after_generation)
+        self.after(0, self._update_memory_info_label)
+        self.after(0, self._update_result_cache_info_label)
         # Nachdem alle Bilder generiert wurden, aktualisiere die Galerie (falls geöffnet)
         # Sicherstellen, dass der Fortschrittsbalken am Ende wirklich 100% ist, wenn alle Bilder erfolgreich waren
-        if not self.stop_event.is_set():
+        if not self.stop_event.is_set() and not abort_event.is_set():
             self.after(0, self._update_progress_bar, 1.0, "100% (Fertig)")
         self.after(0, self._update_gallery_if_open)
 
+    def _decode_job(self, job):
+        """
+        Dekodiert die Latents eines Auftrags mit dem VAE (bei gekachelter Generierung gekachelt). Bei profilierten
+        Aufträgen wird das Dekodieren getrennt aufgezeichnet (<profile_base>.decode.trace.json/.ops.txt).
+        """
+        decode_start_time = time.time()
+        if job["profile_base"]:
+            with PipelineProfiler(self.pipe, 1, 0, 1) as profiler, torch.profiler.record_function("vae.decode"):
+                job["pixels"] = self._decode_latents(job["latents"], tiled=job["tiled"], output_type="np")[0]
+            job["profile_files"] += profiler.export(job["profile_base"] + ".decode", title="Aufgezeichnet: VAE-Dekodierung")
+        else:
+            job["pixels"] = self._decode_latents(job["latents"], tiled=job["tiled"], output_type="np")[0]
+        job["latents"] = None
+        job["decode_seconds"] = time.time() - decode_start_time
+
+    def _discard_job(self, job):
+        """Verwirft einen Auftrag und gibt seinen Ergebnis-Cache-Schlüssel frei."""
+        if job["owns_cache_key"]:
+            self.result_cache.release(job["cache_key"])
+            job["owns_cache_key"] = False
+
+    def _decode_stage(self, decode_queue, write_queue, abort_event):
+        """Zweite Pipeline-Stufe: dekodiert Latents und reicht die Bilder an die Schreibstufe weiter."""
+        while True:
+            job = decode_queue.get()
+            if job is None:
+                write_queue.put(None)
+                return
+            if abort_event.is_set() or self.stop_event.is_set():
+                self._discard_job(job)
+                continue
+            try:
+                if job["latents"] is not None:
+                    self._decode_job(job)
+            except Exception as e:
+                self._report_stage_error(job, "Dekodieren", e)
+                abort_event.set()
+                self._discard_job(job)
+                continue
+            write_queue.put(job) # Blockiert, solange die Schreibstufe im Rückstand ist
+
+    def _write_stage(self, write_queue, abort_event, run):
+        """Dritte Pipeline-Stufe: speichert, archiviert und zeigt die fertigen Bilder an."""
+        while True:
+            job = write_queue.get()
+            if job is None:
+                return
+            try:
+                if not (abort_event.is_set() or self.stop_event.is_set()):
+                    self._finish_job(job, run)
+                    run["completed"] += 1
+            except Exception as e:
+                self._report_stage_error(job, "Speichern", e)
+                abort_event.set()
+            finally:
+                self._discard_job(job) # Nach dem Eintragen in den Ergebnis-Cache wartende Anfragen wecken
+
+    def _report_stage_error(self, job, stage_name, error):
+        """Meldet einen Fehler aus der Dekodier- oder Schreibstufe."""
+        print(f"FEHLER: {stage_name} von Bild {job['index'] + 1} fehlgeschlagen: {error}")
+        traceback.print_exc()
+        self.after(0, self.update_status, f"Fehler beim {stage_name} von Bild {job['index'] + 1}: {error}", "red")
+        self.after(0, lambda: self.image_label.configure(text=f"Fehler bei Bild {job['index'] + 1}."))
+        self._clear_image_details("Fehler")
+
+    def _clear_image_details(self, duration_text):
+        """Setzt das aktuelle Bild und die Details unter dem Bild nach Abbruch oder Fehler zurück."""
+        self.current_generated_image = None
+        self.current_image_seed = -1
+        self.after(0, lambda: self.details_prompt_label.configure(text="Prompt: "))
+        self.after(0, lambda: self.details_negative_prompt_label.configure(text="Negativ: "))
+        self.after(0, lambda: self.details_params_label.configure(text="Parameter: "))
+        self.after(0, lambda: self.details_generation_time_label.configure(text=f"Dauer: {duration_text}"))
+
+    def _finish_job(self, job, run):
+        """Fertiges Bild übernehmen: Metadaten, Speichern bzw. Ergebnis-Cache, Anzeige und Details."""
+        i, num_images = job["index"], run["num_images"]
+        prompt, negative_prompt = run["prompt"], run["negative_prompt"]
+        width, height = run["width"], run["height"]
+        num_inference_steps, guidance_scale, cfg_guided_steps = run["steps"], run["cfg"], run["cfg_guided_steps"]
+        cached_filepath = job["cached_filepath"]
+        generation_duration = job["denoise_seconds"] + job["decode_seconds"]
+
+        # Einzige Umwandlung des dekodierten Puffers in ein PIL-Bild; Anzeige, Speichern und Vorschaubild teilen es
+        image = job["image"] if job["image"] is not None else Image.fromarray(job["pixels"])
+        job["pixels"] = None
+        upscale_seconds = None
+        if run["upscaler"] and not cached_filepath: # Cache-Treffer sind bereits hochskaliert gespeichert
+            upscale_start_time = time.time()
+            image = run["upscaler"].upscale(image, run["upscale_factor"])
+            upscale_seconds = time.time() - upscale_start_time
+            print(f"DEBUG: Bild {i+1}/{num_images} in {upscale_seconds:.2f} s auf {image.width}x{image.height} hochskaliert ({run['upscaler'].method}).")
+        self.current_generated_image = image # Speichert das PIL-Image
+        self.current_image_seed = job["seed"] # Speichere den tatsächlichen Seed
+        self.current_generation_info = {
+            "seed": job["seed"],
+            "width": width,
+            "height": height,
+            "steps": num_inference_steps,
+            "cfg": round(guidance_scale, 2),
+            "cfg_guided_steps": cfg_guided_steps, # Schritte mit unbedingtem Durchlauf (0 = CFG übersprungen)
+            "scheduler": run["scheduler"],
+            "model": self.current_model_name,
+            "model_hash": self.current_model_hash[:16] if self.current_model_hash else None,
+            "tiled": run["tiled"],
+            "token_merging": self.token_merging_ratio,
+            "deep_cache": run["deep_cache"],
+            "attention": run.get("attention"),
+            "few_step": self._few_step_label(),
+            "loras": self._lora_labels(),
+            "profiled": bool(job["profile_files"]), # Dauer enthält dann den Profiling-Aufwand
+            "duration": round(generation_duration, 2),
+        }
+        if run.get("refiner"):
+            self.current_generation_info.update({"refiner": run["refiner"], "refiner_switch": run["refiner_switch"]})
+        if run.get("draft"):
+            self.current_generation_info.update(run["draft"]) # Entwurfsraster, Schritte und Größe des Entwurfs
+        if run.get("batch_size", 1) > 1:
+            self.current_generation_info["batch_size"] = run["batch_size"] # Gemeinsam mit anderen Aufträgen entrauscht
+        if run["upscaler"]:
+            self.current_generation_info.update({
+                "upscale_factor": run["upscale_factor"],
+                "upscaler": run["upscaler"].method,
+                "upscale_duration": round(upscale_seconds, 2) if upscale_seconds is not None else None,
+            })
+        # Das Herunterrechnen für die Anzeige läuft hier statt im UI-Thread
+        display_image = image.resize(fit_size(image.width, image.height, *self.display_area), Image.LANCZOS)
+        self.after(0, self._display_generated_image, image, display_image) # Zeige das finale Bild an
+
+        if cached_filepath:
+            # Liegt bereits in der Galerie, nicht erneut speichern
+            self.after(0, self.update_status, f"Bild {i+1}/{num_images} aus dem Ergebnis-Cache geladen: {os.path.basename(cached_filepath)}", "green")
+        elif run["shard_writer"]:
+            # Datensatz-Ausgabe: Bild und Metadaten in den laufenden Shard statt Einzeldatei, JSON und Archiv
+            sample_metadata = {"prompt": prompt, "negative_prompt": negative_prompt or "", "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            sample_metadata.update(self.current_generation_info)
+            shard_name, key = run["shard_writer"].add(image, sample_metadata)
+            self.after(0, self.update_status, f"Bild {i+1}/{num_images} in {shard_name} gespeichert (Schlüssel {key})", "green")
+            sample_base = os.path.join(run["shard_writer"].output_dir, f"profile_{key}") # Der Schlüssel enthält die Shard-Nummer
+            for profile_path in job["profile_files"]:
+                # profile_<Zeitstempel>.trace.json -> profile_<Schlüssel>.trace.json (neben dem Shard)
+                os.replace(profile_path, sample_base + "." + os.path.basename(profile_path).split(".", 1)[1])
+        else:
+            # Automatisch das Bild speichern (vor dem Freigeben des Cache-Schlüssels, damit der Eintrag auf die fertige Datei zeigt)
+            filename, filepath = self._save_generated_image(image, prompt, negative_prompt, self.current_generation_info)
+            if job["cache_key"]:
+                self.result_cache.store(job["cache_key"], job["spec"], filename, filepath)
+            self.after(0, self.update_status, f"Bild {i+1}/{num_images} erfolgreich generiert und gespeichert: {filename}", "green")
+            # Vorschaubild für die Galerie aus dem Anzeigebild, statt später die PNG-Datei erneut zu dekodieren
+            thumbnail = display_image.copy()
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            self.after(0, self._store_thumbnail, filepath, thumbnail)
+            image_base = os.path.splitext(filepath)[0]
+            for profile_path in job["profile_files"]:
+                # profile_<Zeitstempel>.trace.json -> image_<Zeitstempel>.trace.json (neben dem Bild)
+                os.replace(profile_path, image_base + "." + os.path.basename(profile_path).split(".", 1)[1])
+        duration_text = "aus dem Cache" if cached_filepath else f"{generation_duration:.2f} Sekunden"
+        if upscale_seconds is not None:
+            duration_text += f" + {upscale_seconds:.2f} s Hochskalieren ({run['upscale_factor']}x, {image.width}x{image.height})"
+        if job["deep_cache_summary"] and not cached_filepath:
+            duration_text += f" | {job['deep_cache_summary']}"
+
+        # Aktualisiere die Details unter dem Bild
+        seed = job["seed"]
+        self.after(0, lambda: self.details_prompt_label.configure(text=f"Prompt: {prompt}"))
+        self.after(0, lambda: self.details_negative_prompt_label.configure(text=f"Negativ: {negative_prompt if negative_prompt else 'Kein negativer Prompt'}"))
+        self.after(0, lambda: self.details_params_label.configure(text=f"Größe: {width}x{height} | Schritte: {num_inference_steps} | CFG: {guidance_scale:.1f}{f' (in {cfg_guided_steps}/{num_inference_steps} Schritten)' if 0 < cfg_guided_steps < num_inference_steps else ''} | Seed: {seed} | Scheduler: {run['scheduler']}{f' | ToMe: {self.token_merging_ratio:.2f}' if self.token_merging_ratio else ''}{f' | Few-Step: {self._few_step_label()}' if self.few_step_mode else ''}{(' | LoRAs: ' + ', '.join(self._lora_labels())) if self.active_loras else ''}"))
+        self.after(0, lambda: self.details_generation_time_label.configure(text=f"Dauer: {duration_text}")) # Anzeige der Dauer
+
+        # Füge den Prompt zum Verlauf hinzu
+        self.after(0, self._add_to_prompt_history, prompt, negative_prompt)
+
     def _reset_ui_after_generation(self):
         """Setzt die UI-Elemente nach der Generierung oder einem Abbruch zurück."""
         self.after(0, self.stop_loading_animation)
@@ -1173,8 +5762,11 @@ class ImageGeneratorApp(ctk.CTk):
         # Dieser Code-Block ist jetzt deaktiviert, da Live-Vorschau entfernt wurde.
         pass
 
-    def _display_generated_image(self, pil_image):
-        """Zeigt das finale generierte PIL-Bild in der GUI an."""
+    def _display_generated_image(self, pil_image, display_image=None):
+        """
+        Zeigt das finale generierte PIL-Bild in der GUI an. display_image ist eine bereits herunterskalierte
+        Fassung aus der Schreibstufe; sie wird verwendet, wenn sie noch zur Größe der Anzeigefläche passt.
+        """
         try:
             self.update_idletasks()
             # Der image_label ist jetzt im right_panel, das sich ausdehnt.
@@ -1184,20 +5776,14 @@ class ImageGeneratorApp(ctk.CTk):
 
             if display_width <= 0 or display_height <= 0:
                 # Fallback-Werte, falls winfo_width/height noch nicht korrekt sind
-                display_width = 700
-                display_height = 500
+                display_width, display_height = DEFAULT_DISPLAY_AREA
+            self.display_area = (display_width, display_height) # Für das Herunterskalieren in der Schreibstufe
 
-            img_width, img_height = pil_image.size
-            aspect_ratio = img_width / img_height
-
-            if display_width / display_height > aspect_ratio:
-                new_height = display_height
-                new_width = int(new_height * aspect_ratio)
+            new_width, new_height = fit_size(pil_image.width, pil_image.height, display_width, display_height)
+            if display_image is not None and display_image.size == (new_width, new_height):
+                image = display_image
             else:
-                new_width = display_width
-                new_height = int(new_width / aspect_ratio)
-
-            image = pil_image.resize((new_width, new_height), Image.LANCZOS)
+                image = pil_image.resize((new_width, new_height), Image.LANCZOS)
             
             # Hier wird CTkImage verwendet
             ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=(new_width, new_height))
@@ -1212,41 +5798,60 @@ class ImageGeneratorApp(ctk.CTk):
             self.current_generated_image = None
             self.save_button.configure(state="disabled")
 
-    def save_current_image_to_default_folder(self):
+    def _save_generated_image(self, image, prompt, negative_prompt, generation_info=None):
         """
-        Speichert das aktuell angezeigte Bild automatisch im Standardordner
-        und aktualisiert die Metadaten.
+        Speichert ein Bild im Standardordner und legt seine Metadaten im Archiv ab (eine Zeile pro Bild).
+        Das Archiv ist die einzige Metadatenquelle; die JSON-Metadatendatei wird nur ohne Archiv geschrieben.
+        Thread-sicher (wird auch aus dem Generierungs-Thread aufgerufen). Gibt (Dateiname, Pfad) zurück.
         """
-        if not self.current_generated_image or not self.current_generated_prompt:
-            self.update_status("Kein Bild zum Speichern vorhanden.", "orange")
-            return
-
-        try:
+        with self.metadata_lock:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"image_{timestamp}.png"
+            suffix = 1
+            while os.path.exists(os.path.join(IMAGE_DIR, filename)): # Mehrere Bilder pro Sekunde nicht überschreiben
+                filename = f"image_{timestamp}_{suffix}.png"
+                suffix += 1
             filepath = os.path.join(IMAGE_DIR, filename)
 
-            self.current_generated_image.save(filepath)
+            image.save(filepath)
 
-            # Metadaten laden, aktualisieren und speichern
-            metadata = {}
-            if os.path.exists(METADATA_FILE):
-                with open(METADATA_FILE, "r", encoding="utf-8") as f:
-                    try:
-                        metadata = json.load(f)
-                    except json.JSONDecodeError:
-                        metadata = {}
-
-            metadata[filename] = {
-                "prompt": self.current_generated_prompt,
-                "negative_prompt": self.current_generated_negative_prompt,
+            entry = {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt or "",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), # Zeitstempel im lesbaren Format
                 "filepath": filepath # Speichere den vollständigen Pf
             }
+            entry.update(generation_info or {}) # Seed, Größe, Modell, Scheduler usw.
 
-            with open(METADATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(metadata, f, indent=4, ensure_ascii=False)
+            if self.image_archive:
+                # Im indizierten Archiv ablegen (Suche und Galerie): eine Einfügung statt die ganze JSON-Datei neu zu schreiben
+                self.image_archive.add(filename, entry)
+            else:
+                # Ohne Archiv (SQLite nicht verfügbar) bleibt die JSON-Datei der Metadatenspeicher
+                metadata = {}
+                if os.path.exists(METADATA_FILE):
+                    with open(METADATA_FILE, "r", encoding="utf-8") as f:
+                        try:
+                            metadata = json.load(f)
+                        except json.JSONDecodeError:
+                            metadata = {}
+                metadata[filename] = entry
+                with open(METADATA_FILE, "w", encoding="utf-8") as f:
+                    json.dump(metadata, f, indent=4, ensure_ascii=False)
+
+        return filename, filepath
 
+    def save_current_image_to_default_folder(self):
+        """
+        Speichert das aktuell angezeigte Bild automatisch im Standardordner
+        und aktualisiert die Metadaten.
+        """
+        if not self.current_generated_image or not self.current_generated_prompt:
+            self.update_status("Kein Bild zum Speichern vorhanden.", "orange")
+            return
+
+        try:
+            filename, _ = self._save_generated_image(self.current_generated_image, self.current_generated_prompt, self.current_generated_negative_prompt, self.current_generation_info)
             self.update_status(f"Bild automatisch gespeichert: {filename}", "green")
             # Der save_button wird hier nicht deaktiviert, da er jetzt "Speichern unter..." ist
             # und das automatische Speichern eine separate Funktion ist.
@@ -1271,10 +5876,22 @@ class ImageGeneratorApp(ctk.CTk):
         gallery_window.protocol("WM_DELETE_WINDOW", lambda: self._on_gallery_close(gallery_window)) # Callback beim Schließen
 
         gallery_window.grid_columnconfigure(0, weight=1)
-        gallery_window.grid_rowconfigure(0, weight=1)
+        gallery_window.grid_rowconfigure(1, weight=1)
+
+        # Suchleiste über das Bildarchiv (Volltext und Filter)
+        search_frame = ctk.CTkFrame(gallery_window, fg_color="transparent")
+        search_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(10, 0))
+        search_frame.grid_columnconfigure(0, weight=1)
+        self.gallery_search_entry = ctk.CTkEntry(search_frame, placeholder_text="Suche: katze mond seed:42 model:name scheduler:\"DPM++ 2M\" size:512x512 date:2026-10-01..2026-10-19", corner_radius=8)
+        self.gallery_search_entry.grid(row=0, column=0, sticky="ew", padx=(0, 5))
+        self.gallery_search_entry.bind("<Return>", lambda event: self._update_gallery_if_open())
+        search_button = ctk.CTkButton(search_frame, text="Suchen", width=80, command=self._update_gallery_if_open, corner_radius=8)
+        search_button.grid(row=0, column=1)
+        self.gallery_result_label = ctk.CTkLabel(search_frame, text="", font=ctk.CTkFont(size=10), text_color="gray")
+        self.gallery_result_label.grid(row=1, column=0, columnspan=2, sticky="w")
 
         scrollable_frame = ctk.CTkScrollableFrame(gallery_window)
-        scrollable_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
+        scrollable_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
         scrollable_frame.grid_columnconfigure(0, weight=1)
 
         self.gallery_scrollable_frame = scrollable_frame # Speichere Referenz für Updates
@@ -1284,7 +5901,7 @@ class ImageGeneratorApp(ctk.CTk):
 
         # Button zum Löschen aller Bilder in der Galerie
         clear_all_button = ctk.CTkButton(gallery_window, text="Alle Bilder löschen", command=lambda: self._confirm_clear_all_images(gallery_window))
-        clear_all_button.grid(row=1, column=0, pady=10)
+        clear_all_button.grid(row=2, column=0, pady=10)
 
     def _on_gallery_close(self, gallery_window):
         """Wird aufgerufen, wenn das Galerie-Fenster geschlossen wird."""
@@ -1299,9 +5916,12 @@ class ImageGeneratorApp(ctk.CTk):
                 widget.destroy()
             self._load_gallery_images() # Lade die aktualisierten Bilder
 
-    def _load_gallery_images(self):
-        """Lädt die Bilder in das Galerie-ScrollableFrame."""
-        # Metadaten laden
+    def _get_gallery_entries(self, query):
+        """Liefert die anzuzeigenden Bilder (neueste zuerst), gefiltert über das Bildarchiv."""
+        if self.image_archive:
+            return self.image_archive.search(query, limit=ARCHIVE_SEARCH_LIMIT)
+
+        # Fallback ohne Archiv: Metadaten-Datei laden (ohne Suche)
         images_data = {}
         if os.path.exists(METADATA_FILE):
             with open(METADATA_FILE, "r", encoding="utf-8") as f:
@@ -1310,28 +5930,36 @@ class ImageGeneratorApp(ctk.CTk):
                     images_data = {k: v for k, v in images_data.items() if "prompt" in v and "timestamp" in v and "filepath" in v}
                 except json.JSONDecodeError:
                     pass
-
-        if not images_data:
-            ctk.CTkLabel(self.gallery_scrollable_frame, text="Noch keine Bilder gespeichert.", font=ctk.CTkFont(size=16), text_color="gray").pack(pady=20)
-            return
-
         # Sortiere Bilder nach Zeitstempel (neuestes zuerst)
         sorted_filenames = sorted(images_data.keys(), key=lambda k: images_data[k].get("timestamp", ""), reverse=True)
+        return [dict(images_data[filename], filename=filename) for filename in sorted_filenames[:ARCHIVE_SEARCH_LIMIT]]
 
-        for filename in sorted_filenames:
-            filepath = images_data[filename].get("filepath") # Verwende den gespeicherten Dateipfad
-            prompt = images_data[filename].get("prompt", "Kein Prompt verfügbar")
-            negative_prompt = images_data[filename].get("negative_prompt", "Kein negativer Prompt verfügbar")
-            timestamp = images_data[filename].get("timestamp", "Unbekannt")
+    def _load_gallery_images(self):
+        """Lädt die Bilder in das Galerie-ScrollableFrame."""
+        query = self.gallery_search_entry.get().strip()
+        start_time = time.perf_counter()
+        entries = self._get_gallery_entries(query)
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        self.gallery_result_label.configure(text=f"{len(entries)} Treffer{' (neueste ' + str(ARCHIVE_SEARCH_LIMIT) + ')' if len(entries) >= ARCHIVE_SEARCH_LIMIT else ''} in {duration_ms:.1f} ms")
+
+        if not entries:
+            text = "Keine passenden Bilder gefunden." if query else "Noch keine Bilder gespeichert."
+            ctk.CTkLabel(self.gallery_scrollable_frame, text=text, font=ctk.CTkFont(size=16), text_color="gray").pack(pady=20)
+            return
+
+        for entry in entries:
+            filepath = entry.get("filepath") or "" # Verwende den gespeicherten Dateipfad
+            prompt = entry.get("prompt") or "Kein Prompt verfügbar"
+            negative_prompt = entry.get("negative_prompt") or ""
+            timestamp = entry.get("timestamp") or "Unbekannt"
 
             if not os.path.exists(filepath):
                 ctk.CTkLabel(self.gallery_scrollable_frame, text=f"Bilddatei nicht gefunden: {os.path.basename(filepath)} (Pfad: {filepath})", text_color="orange").pack()
                 continue
 
             try:
-                img = Image.open(filepath) # Korrigiert: Image.open
-                img.thumbnail((200, 200), Image.LANCZOS)
-                tk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(200, 200))
+                img = self._gallery_thumbnail(filepath)
+                tk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
 
                 img_frame = ctk.CTkFrame(self.gallery_scrollable_frame, corner_radius=8)
                 img_frame.pack(pady=10, padx=10, fill="x", expand=True)
@@ -1351,12 +5979,253 @@ class ImageGeneratorApp(ctk.CTk):
                 else:
                     timestamp_row = 2
 
-                timestamp_label = ctk.CTkLabel(img_frame, text=f"Generiert: {timestamp}", font=ctk.CTkFont(size=10), text_color="gray")
+                details = f"Generiert: {timestamp}"
+                if entry.get("seed") is not None:
+                    details += f" | Seed: {entry['seed']} | {entry.get('width')}x{entry.get('height')} | {entry.get('scheduler')} | Modell: {entry.get('model')}"
+                timestamp_label = ctk.CTkLabel(img_frame, text=details, font=ctk.CTkFont(size=10), text_color="gray")
                 timestamp_label.grid(row=timestamp_row, column=0, padx=10, pady=2, sticky="w")
 
+                inpaint_button = ctk.CTkButton(img_frame, text="Inpainting...", width=110, height=24, corner_radius=8, command=lambda path=filepath, data=entry: self._open_inpaint_editor(path, data))
+                inpaint_button.grid(row=timestamp_row + 1, column=0, padx=10, pady=(2, 8), sticky="w")
+
             except Exception as e:
                 ctk.CTkLabel(self.gallery_scrollable_frame, text=f"Fehler beim Laden von {os.path.basename(filepath)}: {e}", text_color="red").pack()
 
+    def _store_thumbnail(self, filepath, thumbnail):
+        """Legt ein Vorschaubild im LRU-Cache ab (UI-Thread)."""
+        self.thumbnail_cache[filepath] = thumbnail
+        self.thumbnail_cache.move_to_end(filepath)
+        while len(self.thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+            self.thumbnail_cache.popitem(last=False)
+
+    def _gallery_thumbnail(self, filepath):
+        """Vorschaubild aus dem Cache, sonst einmal aus der Datei erzeugen und zwischenspeichern."""
+        thumbnail = self.thumbnail_cache.get(filepath)
+        if thumbnail is None:
+            with Image.open(filepath) as img:
+                img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+                thumbnail = img.copy()
+        self._store_thumbnail(filepath, thumbnail)
+        return thumbnail
+
+    def _open_inpaint_editor(self, filepath, entry):
+        """Masken-Editor für ein Galerie-Bild: Bereich übermalen (oder Maske laden), Prompt anpassen und Inpainting starten."""
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        try:
+            with Image.open(filepath) as img:
+                source = img.convert("RGB")
+        except OSError as e:
+            self.update_status(f"Bild konnte nicht geöffnet werden: {e}", "red")
+            return
+
+        editor = ctk.CTkToplevel(self)
+        editor.title(f"Inpainting: {os.path.basename(filepath)}")
+        editor.transient(self)
+        editor.grid_columnconfigure(1, weight=1)
+
+        view_scale = min(1.0, INPAINT_EDITOR_SIZE / max(source.size))
+        view_size = (max(1, round(source.width * view_scale)), max(1, round(source.height * view_scale)))
+        view_image = source.resize(view_size, Image.LANCZOS)
+        state = {"mask": Image.new("L", source.size, 0), "last": None}
+        state["draw"] = ImageDraw.Draw(state["mask"])
+
+        canvas = ctk.CTkCanvas(editor, width=view_size[0], height=view_size[1], highlightthickness=0, cursor="crosshair")
+        canvas.grid(row=0, column=0, columnspan=3, padx=10, pady=10)
+
+        def redraw():
+            """Bild mit halbtransparent roter Maske neu zeichnen (nach Laden oder Löschen der Maske)."""
+            overlay = Image.new("RGB", view_size, (255, 0, 0))
+            alpha = state["mask"].resize(view_size, Image.NEAREST).point(lambda value: value // 2)
+            preview = Image.composite(overlay, view_image, alpha)
+            state["preview"] = ImageTk.PhotoImage(preview) # Referenz halten, sonst räumt Tk das Bild weg
+            canvas.delete("all")
+            canvas.create_image(0, 0, anchor="nw", image=state["preview"])
+
+        def paint(event):
+            radius = brush_slider.get() / 2
+            x, y = event.x / view_scale, event.y / view_scale
+            state["draw"].ellipse([x - radius, y - radius, x + radius, y + radius], fill=255)
+            canvas.create_oval(event.x - radius * view_scale, event.y - radius * view_scale, event.x + radius * view_scale, event.y + radius * view_scale, fill="red", outline="", stipple="gray50")
+            if state["last"] is not None: # Lücken bei schnellen Mausbewegungen schließen
+                last_x, last_y = state["last"]
+                state["draw"].line([last_x / view_scale, last_y / view_scale, x, y], fill=255, width=int(radius * 2))
+                canvas.create_line(last_x, last_y, event.x, event.y, fill="red", width=radius * 2 * view_scale, stipple="gray50")
+            state["last"] = (event.x, event.y)
+
+        def end_stroke(event):
+            state["last"] = None
+
+        def clear_mask():
+            state["mask"] = Image.new("L", source.size, 0)
+            state["draw"] = ImageDraw.Draw(state["mask"])
+            redraw()
+
+        def load_mask():
+            mask_path = filedialog.askopenfilename(parent=editor, title="Maske laden (weiß = neu malen)", filetypes=[("Bilder", "*.png *.jpg *.jpeg *.webp"), ("Alle Dateien", "*.*")])
+            if not mask_path:
+                return
+            try:
+                with Image.open(mask_path) as mask_file:
+                    state["mask"] = mask_file.convert("L").resize(source.size, Image.NEAREST).point(lambda value: 255 if value >= 128 else 0)
+            except OSError as e:
+                self.update_status(f"Maske konnte nicht geladen werden: {e}", "red")
+                return
+            state["draw"] = ImageDraw.Draw(state["mask"])
+            redraw()
+
+        def start():
+            self._start_inpaint(filepath, source, state["mask"].copy(), prompt_entry.get().strip(), negative_prompt_entry.get().strip(), strength_slider.get())
+            editor.destroy()
+
+        canvas.bind("<Button-1>", paint)
+        canvas.bind("<B1-Motion>", paint)
+        canvas.bind("<ButtonRelease-1>", end_stroke)
+        redraw()
+
+        ctk.CTkLabel(editor, text="Pinsel:", font=ctk.CTkFont(size=12)).grid(row=1, column=0, padx=10, pady=2, sticky="w")
+        brush_slider = ctk.CTkSlider(editor, from_=5, to=200, number_of_steps=39)
+        brush_slider.grid(row=1, column=1, padx=10, pady=2, sticky="ew")
+        brush_slider.set(INPAINT_DEFAULT_BRUSH)
+        ctk.CTkButton(editor, text="Maske löschen", width=120, command=clear_mask, corner_radius=8).grid(row=1, column=2, padx=10, pady=2)
+        ctk.CTkLabel(editor, text="Stärke:", font=ctk.CTkFont(size=12)).grid(row=2, column=0, padx=10, pady=2, sticky="w")
+        strength_slider = ctk.CTkSlider(editor, from_=0.1, to=1.0, number_of_steps=18)
+        strength_slider.grid(row=2, column=1, padx=10, pady=2, sticky="ew")
+        strength_slider.set(INPAINT_DEFAULT_STRENGTH)
+        ctk.CTkButton(editor, text="Maske laden...", width=120, command=load_mask, corner_radius=8).grid(row=2, column=2, padx=10, pady=2)
+        prompt_entry = ctk.CTkEntry(editor, placeholder_text="Prompt für den maskierten Bereich", corner_radius=8)
+        prompt_entry.grid(row=3, column=0, columnspan=3, padx=10, pady=2, sticky="ew")
+        prompt_entry.insert(0, entry.get("prompt") or self.prompt_entry.get())
+        negative_prompt_entry = ctk.CTkEntry(editor, placeholder_text="Negativer Prompt", corner_radius=8)
+        negative_prompt_entry.grid(row=4, column=0, columnspan=3, padx=10, pady=2, sticky="ew")
+        negative_prompt_entry.insert(0, entry.get("negative_prompt") or "")
+        ctk.CTkButton(editor, text="Inpainting starten", command=start, corner_radius=8).grid(row=5, column=0, columnspan=3, padx=10, pady=10)
+
+    def _start_inpaint(self, filepath, source, mask, prompt, negative_prompt, strength):
+        """Prüft Maske und Einstellungen und startet das Inpainting des Ausschnitts im Hintergrund."""
+        if not self.pipe:
+            self.update_status("Bitte zuerst ein Modell laden!", "orange")
+            return
+        if isinstance(self.pipe.vae, OnnxComponent):
+            self.update_status("Inpainting ist mit dem ONNX-Backend nicht verfügbar (kein VAE-Encoder).", "orange")
+            return
+        if self._job_queue_busy() or (self.generation_thread and self.generation_thread.is_alive()):
+            self.update_status("Es läuft bereits eine Generierung, Inpainting danach möglich.", "orange")
+            return
+        if mask.getbbox() is None:
+            self.update_status("Die Maske ist leer: bitte den neu zu malenden Bereich übermalen.", "orange")
+            return
+        if not prompt:
+            self.update_status("Bitte eine Bildbeschreibung eingeben!", "orange")
+            return
+        seed_str = self.seed_entry.get().strip()
+        seed = int(seed_str) if seed_str.lstrip("-").isdigit() and seed_str != "-1" else random.randint(0, 2**32 - 1)
+        num_inference_steps = int(self.steps_slider.get())
+        guidance_scale = float(self.cfg_slider.get())
+        scheduler_name = self.few_step_mode["scheduler"] if self.few_step_mode else self.scheduler_optionmenu.get()
+        self._set_pipeline_scheduler(scheduler_name)
+
+        self.current_generated_prompt = prompt
+        self.current_generated_negative_prompt = negative_prompt
+        self.save_button.configure(state="disabled")
+        self.generate_button.configure(state="disabled", text="Inpainting...")
+        self._set_settings_state("disabled")
+        self.start_loading_animation(base_message="Inpainting", mode="determinate")
+        self.generation_thread = threading.Thread(target=self._inpaint_thread, daemon=True,
+                                                  args=(filepath, source, mask, prompt, negative_prompt, round(strength, 2), num_inference_steps, guidance_scale, seed, scheduler_name))
+        self.generation_thread.start()
+
+    def _inpaint_thread(self, filepath, source, mask, prompt, negative_prompt, strength, num_inference_steps, guidance_scale, seed, scheduler_name):
+        """
+        Entrauscht nur einen Ausschnitt um die Maske (mit Kontextrand, in der nativen Modellauflösung) und setzt ihn
+        mit weichem Rand in das Originalbild ein. Die Inpainting-Pipeline teilt alle Komponenten mit der geladenen.
+        """
+        start_time = time.time()
+        try:
+            crop_box = inpaint_crop_box(mask.getbbox(), source.size)
+            crop_width, crop_height = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+            native_size = self.pipe.unet.config.sample_size * self.pipe.vae_scale_factor
+            work_width, work_height = inpaint_working_size(crop_width, crop_height, native_size)
+            print(f"DEBUG: Inpainting-Ausschnitt {crop_box} ({crop_width}x{crop_height} von {source.width}x{source.height}), entrauscht in {work_width}x{work_height}.")
+
+            attention_backend = self._select_attention_backend(work_width, work_height, 2 if guidance_scale > 1.0 else 1)
+            inpaint_pipe = AutoPipelineForInpainting.from_pipe(self.pipe) # Keine Kopie der Gewichte
+            generator = torch.Generator(device=self.pipe.device if hasattr(self.pipe, 'device') else "cpu").manual_seed(seed)
+            result = inpaint_pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt or None,
+                image=source.crop(crop_box).resize((work_width, work_height), Image.LANCZOS),
+                mask_image=mask.crop(crop_box).resize((work_width, work_height), Image.NEAREST),
+                width=work_width,
+                height=work_height,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                generator=generator,
+                # Img2img überspringt die ersten Schritte, es laufen nur num_inference_steps * strength
+                callback_on_step_end=self._make_step_callback(0, 1, total_steps=max(1, min(int(num_inference_steps * strength), num_inference_steps))),
+                callback_on_step_end_tensor_inputs=["latents"],
+            ).images[0]
+
+            # Nur der maskierte Bereich (mit weichem Rand) ersetzt das Original, der Rest bleibt pixelgenau erhalten
+            image = source.copy()
+            image.paste(result.resize((crop_width, crop_height), Image.LANCZOS), crop_box[:2], feather_mask(mask.crop(crop_box)))
+            duration = time.time() - start_time
+
+            generation_info = {
+                "seed": seed,
+                "width": image.width,
+                "height": image.height,
+                "steps": num_inference_steps,
+                "cfg": round(guidance_scale, 2),
+                "scheduler": scheduler_name,
+                "model": self.current_model_name,
+                "model_hash": self.current_model_hash[:16] if self.current_model_hash else None,
+                "token_merging": self.token_merging_ratio,
+                "attention": attention_backend,
+                "few_step": self._few_step_label(),
+                "loras": self._lora_labels(),
+                "inpaint_source": os.path.basename(filepath),
+                "inpaint_crop": list(crop_box),
+                "inpaint_size": [work_width, work_height],
+                "inpaint_strength": strength,
+                "duration": round(duration, 2),
+            }
+            self.current_generation_info = generation_info
+            self.current_image_seed = seed
+            self.current_generated_image = image # Vor _reset_ui_after_generation, das den Speichern-Button danach setzt
+            filename, saved_path = self._save_generated_image(image, prompt, negative_prompt, generation_info)
+            display_image = image.resize(fit_size(image.width, image.height, *self.display_area), Image.LANCZOS)
+            self.after(0, self._display_generated_image, image, display_image)
+            thumbnail = display_image.copy()
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            self.after(0, self._store_thumbnail, saved_path, thumbnail)
+            self.after(0, self._update_gallery_if_open)
+
+            area_percent = 100 * work_width * work_height / (source.width * source.height)
+            self.after(0, lambda: self.details_prompt_label.configure(text=f"Prompt: {prompt}"))
+            self.after(0, lambda: self.details_negative_prompt_label.configure(text=f"Negativ: {negative_prompt if negative_prompt else 'Kein negativer Prompt'}"))
+            self.after(0, lambda: self.details_params_label.configure(text=f"Inpainting von {os.path.basename(filepath)} | Ausschnitt {crop_width}x{crop_height}, entrauscht in {work_width}x{work_height} ({area_percent:.0f} % der Bildfläche) | Stärke: {strength:.2f} | Seed: {seed}"))
+            self.after(0, lambda: self.details_generation_time_label.configure(text=f"Dauer: {duration:.2f} Sekunden"))
+            self.after(0, self.update_status, f"Inpainting gespeichert: {filename}", "green")
+        except StopIteration:
+            self.after(0, self.update_status, "Inpainting abgebrochen.", "orange")
+        except Exception as e:
+            traceback.print_exc()
+            self.after(0, self.update_status, f"Inpainting fehlgeschlagen: {e}", "red")
+        finally:
+            self._reset_ui_after_generation()
+
+    def _refresh_upscaler_list(self):
+        """Liest beim Einschalten des Hochskalierens die verfügbaren ONNX-Modelle neu ein."""
+        if not self.upscale_checkbox.get():
+            return
+        methods = list_upscalers()
+        self.upscale_method_optionmenu.configure(values=methods)
+        if self.upscale_method_optionmenu.get() not in methods:
+            self.upscale_method_optionmenu.set(UPSCALE_LANCZOS)
+
     def _confirm_clear_all_images(self, gallery_window):
         """Fragt den Benutzer, ob alle Bilder gelöscht werden sollen."""
         response = messagebox.askyesno(
@@ -1370,8 +6239,14 @@ class ImageGeneratorApp(ctk.CTk):
 
     def _clear_all_images(self):
         """Löscht alle gespeicherten Bilder und die Metadatendatei."""
+        if self.result_cache:
+            self.result_cache.clear() # Cache-Einträge zeigen sonst auf gelöschte Bilder
+        self.thumbnail_cache.clear()
+        archive_filename = os.path.basename(ARCHIVE_DB_FILE)
         if os.path.exists(IMAGE_DIR):
             for filename in os.listdir(IMAGE_DIR):
+                if filename.startswith(archive_filename): # Archiv (inkl. -wal/-shm) wird unten geleert statt gelöscht
+                    continue
                 file_path = os.path.join(IMAGE_DIR, filename)
                 try:
                     if os.path.isfile(file_path):
@@ -1379,16 +6254,18 @@ class ImageGeneratorApp(ctk.CTk):
                 except Exception as e:
                     print(f"Fehler beim Löschen von Datei {file_path}: {e}")
         
-        # Leere auch den Prompt-Verlauf
+        # Leere auch den Prompt-Verlauf und das Archiv
         self.prompt_history.clear()
-        self._save_prompt_history()
         self._update_prompt_history_options()
+        if self.image_archive:
+            self.image_archive.clear()
 
         # Erstelle den Ordner neu, falls er gelöscht wurde (oder nur die Dateien darin)
         os.makedirs(IMAGE_DIR, exist_ok=True)
-        # Erstelle die leere Metadatendatei neu
-        with open(METADATA_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f)
+        # Ohne Archiv die leere Metadatendatei neu erstellen
+        if not self.image_archive:
+            with open(METADATA_FILE, "w", encoding="utf-8") as f:
+                json.dump({}, f)
 
 
 if __name__ == "__main__":
@@ -1398,5 +6275,18 @@ if __name__ == "__main__":
         force_cpu_mode = True
         print("CPU-Modus erzwungen.")
 
-    app = ImageGeneratorApp(force_cpu=force_cpu_mode)
+    # /profile schaltet das Profiling ein, /profile=ÜBERSPRINGEN:AUFZEICHNEN legt zusätzlich den Zeitplan fest
+    profile_schedule = None
+    for argument in sys.argv[1:]:
+        if argument == "/profile" or argument.startswith("/profile="):
+            profile_schedule = (PROFILE_SKIP_STEPS, int(PROFILE_RECORD_DEFAULT))
+            if "=" in argument:
+                try:
+                    skip_text, record_text = argument.split("=", 1)[1].split(":")
+                    profile_schedule = (max(0, int(skip_text)), max(1, int(record_text)))
+                except ValueError:
+                    print(f"FEHLER: Ungültiger Profiling-Zeitplan '{argument}', erwartet z.B. /profile=1:3. Verwende Standard.")
+            print(f"Profiling aktiviert: {profile_schedule[0]} Schritte überspringen, {profile_schedule[1]} aufzeichnen.")
+
+    app = ImageGeneratorApp(force_cpu=force_cpu_mode, profile_schedule=profile_schedule)
     app.mainloop()
@@ -44,8 +44,8 @@ echo Virtuelle Umgebung aktiviert.
 
 rem --- Schritt 2: Allgemeine Python-Abhaengigkeiten installieren ---
 echo.
-echo Installiere Kern-Abhaengigkeiten (customtkinter, Pillow, numpy, safetensors, pyperclip)...
-pip install customtkinter Pillow numpy safetensors pyperclip
+echo Installiere Kern-Abhaengigkeiten (customtkinter, Pillow, numpy, safetensors, pyperclip, psutil)...
+pip install customtkinter Pillow numpy safetensors pyperclip psutil
 if %errorlevel% neq 0 (
     echo FEHLER: Konnte Kern-Abhaengigkeiten nicht installieren. Bitte pruefen Sie Ihre Internetverbindung.
     pause
@@ -87,7 +87,7 @@ echo PyTorch installiert.
 rem --- Schritt 4: Diffusers und xformers installieren ---
 echo.
 echo Installiere diffusers und accelerate...
-pip install --upgrade diffusers transformers accelerate
+pip install --upgrade diffusers transformers accelerate peft
 if %errorlevel% neq 0 (
     echo FEHLER: Konnte diffusers/accelerate nicht installieren.
     pause
@@ -105,6 +105,15 @@ if %errorlevel% neq 0 (
     echo xformers erfolgreich installiert.
 )
 
+echo.
+echo Versuche, ONNX Runtime zu installieren (optional, schnelleres Backend fuer reine CPU-Rechner)...
+pip install onnxruntime onnx
+if %errorlevel% neq 0 (
+    echo WARNUNG: onnxruntime konnte nicht installiert werden. Dies ist optional, das ONNX-Backend steht dann nicht zur Verfuegung.
+) else (
+    echo onnxruntime erfolgreich installiert.
+)
+
 rem --- Schritt 5: Modelle- und Output-Ordner sicherstellen ---
 echo.
 echo Stelle sicher, dass 'models' und 'output' Ordner existieren...